@@ -1,32 +1,36 @@
-from passlib.context import CryptContext
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
+import time
 from fastapi import HTTPException
-from database import get_user_by_email, get_user_by_username, create_user
-from models import User, UserLogin, TokenResponse
-from config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
+from pymongo.errors import DuplicateKeyError
+from typing import Optional
+from database import get_user_by_username, create_user, set_user_admin, update_user_password
+from hashing import hash_password, verify_password, hash_password_async, verify_and_update_async
+from models import User, UserLogin, TokenResponse, CurrentUser
+from cache import TTLCache
+from config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, USER_CACHE_SIZE, USER_CACHE_TTL_SECONDS
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
-
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+# User records for authorization checks, so hot write paths skip the users collection.
+# Other workers see a role change once their entry expires.
+_user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL_SECONDS)
 
 def create_token(data: dict) -> str:
     to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    now = datetime.utcnow()
+    expire = now + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    to_encode.update({"exp": expire, "iat": now})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-def verify_token(token: str) -> str:
+def decode_token(token: str) -> Optional[dict]:
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload.get("sub")
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except JWTError:
         return None
 
+def verify_token(token: str) -> str:
+    payload = decode_token(token)
+    return payload.get("sub") if payload else None
+
 def validate_password_strength(password: str) -> bool:
     has_upper = any(c.isupper() for c in password)
     has_lower = any(c.islower() for c in password)
@@ -36,17 +40,14 @@ def validate_password_strength(password: str) -> bool:
     
     return has_upper and has_lower and has_digit and has_special and is_long_enough
 
-def register_user(user: User) -> dict:
-    if get_user_by_email(user.email) or get_user_by_username(user.username):
-        raise HTTPException(status_code=400, detail="Email or username already registered")
-    
+async def register_user(user: User) -> dict:
     if not validate_password_strength(user.password):
         raise HTTPException(
             status_code=400, 
             detail="Password must be at least 8 characters long and contain uppercase, lowercase, number, and special character"
         )
     
-    hashed_password = hash_password(user.password)
+    hashed_password = await hash_password_async(user.password)
     is_admin = user.username in ["admin", "shopadmin"]
     
     user_data = {
@@ -57,27 +58,79 @@ def register_user(user: User) -> dict:
         "created_at": datetime.utcnow()
     }
     
-    result = create_user(user_data)
+    # Unique indexes on username and email reject duplicates atomically
+    try:
+        result = await create_user(user_data)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Email or username already registered")
     return {"message": "User created successfully", "user_id": str(result.inserted_id)}
 
-def login_user(user: UserLogin) -> TokenResponse:
-    user_data = get_user_by_username(user.username)
-    if not user_data or not verify_password(user.password, user_data["password"]):
+async def login_user(user: UserLogin) -> TokenResponse:
+    user_data = await get_user_by_username(user.username)
+    if not user_data:
         raise HTTPException(status_code=401, detail="Incorrect username or password")
     
-    token = create_token({"sub": user.username})
+    valid, new_hash = await verify_and_update_async(user.password, user_data["password"])
+    if not valid:
+        raise HTTPException(status_code=401, detail="Incorrect username or password")
+    
+    # Stored hash was made with a different BCRYPT_ROUNDS; upgrade it transparently
+    if new_hash:
+        await update_user_password(user.username, new_hash)
+        invalidate_user(user.username)
+    
+    role = "admin" if user_data.get("is_admin", False) else "user"
+    token = create_token({"sub": user.username, "role": role})
     return TokenResponse(access_token=token, token_type="bearer")
 
-def get_current_user(token: str) -> str:
+def get_current_user(token: str) -> CurrentUser:
     if not token:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    username = verify_token(token)
-    if not username:
+    payload = decode_token(token)
+    if not payload or not payload.get("sub"):
         raise HTTPException(status_code=401, detail="Invalid token")
     
-    return username
+    role = payload.get("role")
+    return CurrentUser(
+        username=payload["sub"],
+        is_admin=None if role is None else role == "admin",
+        issued_at=payload.get("iat")
+    )
+
+async def get_cached_user(username: str) -> Optional[dict]:
+    user_data = _user_cache.get(username)
+    if user_data is None:
+        user_data = await get_user_by_username(username)
+        if user_data:
+            _user_cache.set(username, user_data)
+    return user_data
+
+def invalidate_user(username: str):
+    _user_cache.invalidate(username)
 
-def is_admin(username: str) -> bool:
-    user_data = get_user_by_username(username)
-    return user_data.get("is_admin", False) if user_data else False
+def _role_claim_is_current(user: CurrentUser, user_data: dict) -> bool:
+    changed_at = user_data.get("role_changed_at")
+    return changed_at is None or (user.issued_at is not None and user.issued_at > changed_at)
+
+async def is_admin(user: CurrentUser) -> bool:
+    # The signed role claim is trusted unless the user's role changed after the
+    # token was issued; role_changed_at lives on the user document, so every
+    # worker sees it through the cached lookup
+    user_data = await get_cached_user(user.username)
+    if not user_data:
+        return False
+    if user.is_admin is not None and _role_claim_is_current(user, user_data):
+        return user.is_admin
+    return user_data.get("is_admin", False)
+
+async def set_user_role(username: str, admin: bool, current_user: CurrentUser) -> dict:
+    if not await is_admin(current_user):
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    
+    result = await set_user_admin(username, admin, int(time.time()))
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    invalidate_user(username)
+    return {"message": "User role updated successfully", "username": username, "is_admin": admin}
@@ -0,0 +1,20 @@
+"""
+Helpers shared by the benchmark scripts
+"""
+
+def percentile(samples: list, pct: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def summarize(latencies: list, elapsed: float) -> dict:
+    """Throughput and latency percentiles (ms) for one measured run"""
+    return {
+        "requests": len(latencies),
+        "elapsed_s": round(elapsed, 4),
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "latency_p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "latency_p90_ms": round(percentile(latencies, 90) * 1000, 2),
+        "latency_p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "latency_max_ms": round(max(latencies) * 1000, 2),
+    }
@@ -0,0 +1,68 @@
+"""
+Compare two benchmark suite results
+
+Matches scenarios by (scenario, catalog_size) and prints the change in
+throughput and p50/p99 latency. Exits with status 1 if any scenario lost more
+than --threshold percent throughput or gained more than --threshold percent
+p99 latency, so it can gate CI:
+
+    cd backend
+    python -m benchmarks.compare before.json after.json --threshold 10
+"""
+
+import argparse
+import json
+import sys
+
+def load(path: str) -> tuple:
+    with open(path) as fh:
+        report = json.load(fh)
+    return {(r["scenario"], r["catalog_size"]): r for r in report["results"]}, report.get("meta", {})
+
+def change(before: float, after: float) -> float:
+    return (after - before) / before * 100 if before else 0.0
+
+def compare(base: dict, head: dict, threshold: float) -> list:
+    """Return one row per scenario present in both runs"""
+    rows = []
+    for key in sorted(base.keys() & head.keys(), key=lambda k: (k[1], k[0])):
+        old, new = base[key], head[key]
+        throughput = change(old["throughput_rps"], new["throughput_rps"])
+        p99 = change(old["latency_p99_ms"], new["latency_p99_ms"])
+        rows.append({
+            "scenario": key[0],
+            "catalog_size": key[1],
+            "throughput_rps": (old["throughput_rps"], new["throughput_rps"], round(throughput, 1)),
+            "latency_p50_ms": (old["latency_p50_ms"], new["latency_p50_ms"],
+                               round(change(old["latency_p50_ms"], new["latency_p50_ms"]), 1)),
+            "latency_p99_ms": (old["latency_p99_ms"], new["latency_p99_ms"], round(p99, 1)),
+            "regressed": throughput < -threshold or p99 > threshold,
+        })
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("base", help="Results from the baseline commit")
+    parser.add_argument("head", help="Results from the commit under test")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Percent change treated as a regression")
+    parser.add_argument("--json", action="store_true", help="Print the comparison as JSON")
+    args = parser.parse_args()
+
+    base, base_meta = load(args.base)
+    head, head_meta = load(args.head)
+    rows = compare(base, head, args.threshold)
+
+    if args.json:
+        print(json.dumps({"base": base_meta.get("commit"), "head": head_meta.get("commit"), "rows": rows}, indent=2))
+    else:
+        print(f"base {base_meta.get('commit')}  head {head_meta.get('commit')}")
+        for row in rows:
+            flag = "REGRESSED" if row["regressed"] else ""
+            print(f"{row['catalog_size']:>7} {row['scenario']:<16}"
+                  f" rps {row['throughput_rps'][0]:>9} -> {row['throughput_rps'][1]:>9} ({row['throughput_rps'][2]:+.1f}%)"
+                  f"  p99 {row['latency_p99_ms'][0]:>8} -> {row['latency_p99_ms'][1]:>8} ms ({row['latency_p99_ms'][2]:+.1f}%)"
+                  f"  {flag}")
+    sys.exit(1 if any(row["regressed"] for row in rows) else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Purchase contention benchmark
+
+Seeds one sweet with a fixed amount of stock and fires many concurrent
+purchases at it through the ASGI app. Checks that exactly `stock` purchases
+succeed, that the quantity never goes negative, and reports throughput and
+latency percentiles.
+
+Runs against the MongoDB in MONGODB_URL, in a separate database:
+
+    cd backend
+    python -m benchmarks.purchase_contention --buyers 500 --stock 200
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+os.environ.setdefault("DATABASE_NAME", "sweet_shop_bench")
+# Every buyer shares one token; the purchase budget would turn most into 429s
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import httpx
+from auth import create_token
+from database import get_db, create_sweet
+from main import app
+from benchmarks.common import percentile
+
+async def run(buyers: int, stock: int, quantity: int) -> dict:
+    db = get_db()
+    await db.sweets.delete_many({"name": "Contention Sweet"})
+    result = await create_sweet({
+        "name": "Contention Sweet", "category": "Benchmark", "price": 1.0, "quantity": stock
+    })
+    sweet_id = str(result.inserted_id)
+    headers = {"Authorization": f"Bearer {create_token({'sub': 'bench-buyer'})}"}
+
+    latencies = []
+    statuses = {}
+
+    async def buy(client: httpx.AsyncClient):
+        started = time.perf_counter()
+        response = await client.post(f"/api/sweets/{sweet_id}/purchase", json={"quantity": quantity}, headers=headers)
+        latencies.append(time.perf_counter() - started)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(buy(client) for _ in range(buyers)))
+        elapsed = time.perf_counter() - started
+
+    final = await db.sweets.find_one({"_id": result.inserted_id})
+    await db.sweets.delete_one({"_id": result.inserted_id})
+
+    expected_successes = min(buyers, stock // quantity)
+    return {
+        "benchmark": "purchase_contention",
+        "buyers": buyers,
+        "initial_stock": stock,
+        "quantity_per_purchase": quantity,
+        "succeeded": statuses.get(200, 0),
+        "rejected_out_of_stock": statuses.get(400, 0),
+        "other_statuses": {str(code): count for code, count in statuses.items() if code not in (200, 400)},
+        "final_quantity": final["quantity"],
+        "correct": statuses.get(200, 0) == expected_successes
+                   and final["quantity"] == stock - expected_successes * quantity
+                   and final["quantity"] >= 0,
+        "elapsed_s": round(elapsed, 4),
+        "throughput_rps": round(buyers / elapsed, 1),
+        "latency_p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "latency_p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--buyers", type=int, default=500, help="Number of concurrent purchase requests")
+    parser.add_argument("--stock", type=int, default=200, help="Initial stock of the contended sweet")
+    parser.add_argument("--quantity", type=int, default=1, help="Units bought per request")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.buyers, args.stock, args.quantity))
+    print(json.dumps(results, indent=2))
+    sys.exit(0 if results["correct"] else 1)
+
+if __name__ == "__main__":
+    main()
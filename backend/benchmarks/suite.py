@@ -0,0 +1,195 @@
+"""
+Catalog, purchase and auth benchmark suite
+
+For each catalog size, seeds that many synthetic sweets spread over
+--categories categories, then drives the ASGI app (with its lifespan running)
+through httpx with --concurrency requests in flight. Each scenario reports
+throughput and p50/p90/p99 latency:
+
+    list_sweets        GET /api/sweets, first page, random category and sort
+    list_categories    GET /api/categories?include=sweets
+    category_sweets    GET /api/categories/{id}/sweets
+    purchase           POST /api/sweets/{id}/purchase on random sweets
+    restock            POST /api/sweets/{id}/restock (admin)
+    login              POST /api/auth/login (bcrypt-bound)
+
+Results are written as JSON, together with the git commit they were measured
+at. Compare two runs with benchmarks.compare.
+
+Needs a MongoDB at MONGODB_URL; everything goes into a separate database
+(sweet_shop_bench unless DATABASE_NAME is set), which is wiped per size:
+
+    cd backend
+    python -m benchmarks.suite --sizes 1000 10000 100000 --output before.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+os.environ.setdefault("DATABASE_NAME", "sweet_shop_bench")
+# Budgets are per client; one benchmark client would mostly measure 429s
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import httpx
+import pymongo
+from auth import create_token
+from hashing import hash_password
+from database import get_db, with_derived_fields
+from main import app
+import catalog_cache
+import readiness
+from benchmarks.common import summarize
+
+BENCH_PASSWORD = "BenchPassword123!"
+SEED_BATCH = 5000
+
+async def seed(size: int, categories: int, rng: random.Random) -> dict:
+    """Replace the benchmark database contents with a synthetic catalog"""
+    db = get_db()
+    for collection in ("sweets", "categories", "users", "stock_movements", "reservations"):
+        await db[collection].delete_many({})
+    catalog_cache.invalidate()
+
+    names = [f"Category {i:03d}" for i in range(categories)]
+    await db.categories.insert_many([
+        {"name": name, "description": f"Synthetic {name}", "is_active": True} for name in names
+    ])
+    for start in range(0, size, SEED_BATCH):
+        # Same derived fields the app writes, so stock updates and the
+        # low-stock index see realistic documents
+        await db.sweets.insert_many([
+            with_derived_fields({
+                "name": f"Sweet {i:06d}",
+                "category": names[i % categories],
+                "price": round(rng.uniform(1, 100), 2),
+                # Deep enough that purchases during the run never sell out
+                "quantity": rng.randint(10_000, 20_000),
+            })
+            for i in range(start, min(size, start + SEED_BATCH))
+        ])
+    await db.users.insert_one({
+        "username": "bench-admin", "email": "bench-admin@example.com",
+        "password": hash_password(BENCH_PASSWORD), "is_admin": True,
+        "created_at": datetime.utcnow()
+    })
+
+    sample = await db.sweets.aggregate([{"$sample": {"size": 500}}, {"$project": {"_id": 1}}])
+    category_docs = await db.categories.find({}, {"_id": 1}).to_list(None)
+    return {
+        "category_names": names,
+        "category_ids": [str(doc["_id"]) for doc in category_docs],
+        "sweet_ids": [str(doc["_id"]) for doc in await sample.to_list(None)],
+    }
+
+def scenarios(catalog: dict, rng: random.Random) -> dict:
+    """Scenario name -> function returning the next (method, url, json body)"""
+    sorts = ["name", "-name", "price", "-price", "quantity"]
+    return {
+        "list_sweets": lambda: (
+            "GET", f"/api/sweets?limit=50&sort={rng.choice(sorts)}"
+                   f"&category={rng.choice(catalog['category_names'])}", None),
+        "list_categories": lambda: ("GET", "/api/categories?include=sweets", None),
+        "category_sweets": lambda: (
+            "GET", f"/api/categories/{rng.choice(catalog['category_ids'])}/sweets", None),
+        "purchase": lambda: (
+            "POST", f"/api/sweets/{rng.choice(catalog['sweet_ids'])}/purchase", {"quantity": 1}),
+        "restock": lambda: (
+            "POST", f"/api/sweets/{rng.choice(catalog['sweet_ids'])}/restock", {"quantity": 1}),
+        "login": lambda: (
+            "POST", "/api/auth/login", {"username": "bench-admin", "password": BENCH_PASSWORD}),
+    }
+
+async def measure(client: httpx.AsyncClient, next_request, total: int, concurrency: int, headers: dict) -> dict:
+    latencies = []
+    statuses = {}
+    remaining = total
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            method, url, body = next_request()
+            started = time.perf_counter()
+            response = await client.request(method, url, json=body, headers=headers)
+            latencies.append(time.perf_counter() - started)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    result = summarize(latencies, time.perf_counter() - started)
+    result["statuses"] = {str(code): count for code, count in sorted(statuses.items())}
+    result["errors"] = sum(count for code, count in statuses.items() if code >= 400)
+    return result
+
+async def run(args) -> dict:
+    rng = random.Random(args.seed)
+    headers = {"Authorization": f"Bearer {create_token({'sub': 'bench-admin', 'role': 'admin'})}"}
+    results = []
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        # Startup connects and builds indexes in the background; measure after it
+        await readiness.wait()
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for size in args.sizes:
+                catalog = await seed(size, args.categories, rng)
+                for name, next_request in scenarios(catalog, rng).items():
+                    if args.scenarios and name not in args.scenarios:
+                        continue
+                    total = args.login_requests if name == "login" else args.requests
+                    # Warm caches and connections so the first samples aren't outliers
+                    await measure(client, next_request, min(total, args.concurrency * 2), args.concurrency, headers)
+                    result = await measure(client, next_request, total, args.concurrency, headers)
+                    result.update({"scenario": name, "catalog_size": size, "concurrency": args.concurrency})
+                    results.append(result)
+                    print(f"{size:>7} {name:<16} {result['throughput_rps']:>9} rps  "
+                          f"p50 {result['latency_p50_ms']:>8} ms  p99 {result['latency_p99_ms']:>8} ms",
+                          file=sys.stderr)
+    return {"meta": metadata(args), "results": results}
+
+def metadata(args) -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "pymongo": pymongo.version,
+        "platform": platform.platform(),
+        "args": vars(args),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="Catalog sizes to seed")
+    parser.add_argument("--categories", type=int, default=50, help="Categories the sweets are spread over")
+    parser.add_argument("--requests", type=int, default=2000, help="Measured requests per scenario")
+    parser.add_argument("--login-requests", type=int, default=200, help="Measured requests for login, which is bcrypt-bound")
+    parser.add_argument("--concurrency", type=int, default=32, help="Requests in flight at once")
+    parser.add_argument("--scenarios", nargs="+", help="Only run these scenarios")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed for the catalog and request mix")
+    parser.add_argument("--output", help="Write JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    body = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as fh:
+            fh.write(body + "\n")
+    else:
+        print(body)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+In-process cache for sweets listings, with content-derived ETags
+
+Every mutation in sweets.py calls invalidate(), which bumps the catalog
+version and drops all cached pages. Other worker processes don't see this
+process's invalidations; the TTL bounds how stale their entries can get.
+
+A listing's ETag is a digest of its payload, computed when it is loaded and
+stored with the cache entry. It changes whenever the content does, however
+the change was made, and every worker computes the same tag for the same
+listing. A client's If-None-Match is answered from the live entry only.
+
+Single sweets and categories get ETags from their own stored version
+instead, which If-Match can be checked against.
+
+Misses are coalesced: concurrent callers asking for the same key at the same
+catalog version share one in-flight query and its result. A write bumps the
+version, so requests arriving after it never join a query started before it.
+Write paths in categories.py invalidate too, for the category listings.
+"""
+
+import asyncio
+import hashlib
+from typing import Optional
+import orjson
+from cache import TTLCache
+from config import CATALOG_CACHE_SIZE, CATALOG_CACHE_TTL_SECONDS
+import metrics
+
+_version = 0
+_entries = TTLCache(CATALOG_CACHE_SIZE, CATALOG_CACHE_TTL_SECONDS)
+# (kind, key, version) -> task running the query those callers share
+_inflight = {}
+
+def version() -> int:
+    return _version
+
+def invalidate():
+    global _version
+    _version += 1
+    _entries.clear()
+
+def make_key(params: dict) -> tuple:
+    return tuple(sorted(params.items()))
+
+def payload_etag(payload) -> str:
+    body = orjson.dumps(payload, default=str, option=orjson.OPT_SORT_KEYS)
+    return f'"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+
+def etag_matches(if_none_match: str, current: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    # Weak comparison, as If-None-Match requires
+    return "*" in candidates or current in [tag[2:] if tag.startswith("W/") else tag for tag in candidates]
+
+def version_etag(version: int) -> str:
+    """ETag for a single sweet or category, derived from its stored version"""
+    return f'"v{version}"'
+
+def if_match_versions(if_match: Optional[str]) -> Optional[list]:
+    """Versions an If-Match header accepts; None when any version will do.
+
+    Weak tags never match, as If-Match requires strong comparison, and
+    neither do tags this server didn't issue.
+    """
+    if not if_match or if_match.strip() == "*":
+        return None
+    versions = []
+    for tag in if_match.split(","):
+        tag = tag.strip()
+        if tag.startswith('"v') and tag.endswith('"') and tag[2:-1].isdigit():
+            versions.append(int(tag[2:-1]))
+    return versions
+
+def _finished(flight: tuple, task: asyncio.Task):
+    if _inflight.get(flight) is task:
+        del _inflight[flight]
+    if not task.cancelled():
+        # Mark the exception retrieved even if every caller went away
+        task.exception()
+
+async def coalesce(kind: str, key: tuple, loader):
+    """Return `await loader()`, sharing one call among concurrent identical requests.
+
+    The query runs as its own task, so a caller that disconnects doesn't
+    cancel it for the others. Its result (or exception) goes to every caller.
+    """
+    loop = asyncio.get_running_loop()
+    flight = (kind, key, _version)
+    task = _inflight.get(flight)
+    if task is not None and task.get_loop() is loop:
+        metrics.observe_read(kind, shared=True)
+    else:
+        task = loop.create_task(loader())
+        _inflight[flight] = task
+        task.add_done_callback(lambda done: _finished(flight, done))
+        metrics.observe_read(kind, shared=False)
+    return await asyncio.shield(task)
+
+async def _load_tagged(loader) -> tuple:
+    payload = await loader()
+    return payload_etag(payload), payload
+
+async def get_or_load(key: tuple, loader):
+    """Return (etag, payload), calling `loader()` only on a miss"""
+    at_version = _version
+    entry = _entries.get(key)
+    if entry is not None:
+        return entry
+    # Callers sharing the query share its digest too
+    entry = await coalesce("sweets", key, lambda: _load_tagged(loader))
+    # Don't store a result that raced with a write; the next request reloads
+    if at_version == _version:
+        _entries.set(key, entry)
+    return entry
@@ -0,0 +1,180 @@
+"""
+Streaming bulk import and export of the sweets catalog
+
+Imports read NDJSON or CSV request bodies line by line and upsert by name in
+batches of IMPORT_BATCH_SIZE with one unordered bulk_write each, so memory
+stays flat however large the upload is. Bad rows are reported with their
+line number and don't stop the import. So are rows that would change the
+quantity of a sweet with units reserved, as PUT /sweets/{id} refuses too. Exports stream straight from a
+database cursor.
+"""
+
+import csv
+import io
+import json
+from datetime import datetime
+from fastapi import HTTPException
+from pydantic import ValidationError
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from database import bulk_upsert_sweets, iter_sweets, with_stock_headroom, reserved_stock_guard, reserved_sweet_names
+from models import Sweet, CurrentUser
+from auth import is_admin
+from config import IMPORT_BATCH_SIZE, IMPORT_MAX_ERRORS
+import catalog_cache
+import search_index
+
+EXPORT_FIELDS = ["id", "name", "category", "price", "quantity", "reorder_threshold"]
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+EXPORT_CHUNK_ROWS = 500
+
+def resolve_format(format: str = None, content_type: str = None) -> str:
+    """Pick ndjson/csv from an explicit format or the request's content type"""
+    if format:
+        if format not in FORMATS:
+            raise HTTPException(status_code=400, detail="Format must be 'ndjson' or 'csv'")
+        return format
+    if content_type and "csv" in content_type:
+        return "csv"
+    return "ndjson"
+
+async def _iter_lines(chunks):
+    """Split a stream of byte chunks into lines without buffering the whole body"""
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line
+    if buffer:
+        yield buffer
+
+def _parse_csv_line(line: str, header: list) -> dict:
+    values = next(csv.reader([line]))
+    if len(values) != len(header):
+        raise ValueError(f"expected {len(header)} columns, got {len(values)}")
+    # An empty cell means the field was not given, e.g. no reorder_threshold
+    return {column: value for column, value in zip(header, values) if value != ""}
+
+class _ImportReport:
+    def __init__(self):
+        self.processed = 0
+        self.inserted = 0
+        self.updated = 0
+        self.error_count = 0
+        self.errors = []
+
+    def add_error(self, line_number: int, error: str):
+        self.error_count += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append({"line": line_number, "error": error})
+
+    def as_dict(self) -> dict:
+        return {
+            "processed": self.processed,
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "error_count": self.error_count,
+            "errors": self.errors
+        }
+
+async def _flush(batch: list, report: _ImportReport):
+    """Write one batch of (line_number, name, UpdateOne) triples"""
+    if not batch:
+        return
+    try:
+        result = await bulk_upsert_sweets([operation for _, _, operation in batch])
+        report.inserted += result.upserted_count
+        report.updated += result.matched_count
+    except BulkWriteError as exc:
+        details = exc.details
+        report.inserted += details.get("nUpserted", 0)
+        report.updated += details.get("nMatched", 0)
+        write_errors = details.get("writeErrors", [])
+        # A row the reserved-stock guard filtered out falls through to an
+        # insert and hits the unique name index; only this path reads again
+        duplicates = [batch[e["index"]][1] for e in write_errors if e.get("code") == 11000]
+        reserved = await reserved_sweet_names(duplicates) if duplicates else set()
+        for write_error in write_errors:
+            line_number, name, _ = batch[write_error["index"]]
+            if write_error.get("code") == 11000 and name in reserved:
+                report.add_error(line_number, "units are reserved; change the quantity once they are committed or released")
+            else:
+                report.add_error(line_number, write_error.get("errmsg", "write failed"))
+    batch.clear()
+
+async def import_sweets(chunks, format: str, current_user: CurrentUser) -> dict:
+    if not await is_admin(current_user):
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    
+    report = _ImportReport()
+    batch = []
+    header = None
+    line_number = 0
+    
+    async for raw_line in _iter_lines(chunks):
+        line_number += 1
+        line = raw_line.decode("utf-8-sig" if line_number == 1 else "utf-8", errors="replace").strip()
+        if not line:
+            continue
+        
+        if format == "csv" and header is None:
+            header = [column.strip() for column in next(csv.reader([line]))]
+            continue
+        
+        report.processed += 1
+        try:
+            row = _parse_csv_line(line, header) if format == "csv" else json.loads(line)
+            sweet = Sweet.model_validate(row)
+        except (ValueError, ValidationError) as exc:
+            report.add_error(line_number, str(exc).splitlines()[0])
+            continue
+        
+        now = datetime.utcnow()
+        update = with_stock_headroom({
+            "category": sweet.category, "price": sweet.price, "quantity": sweet.quantity,
+            "reorder_threshold": sweet.reorder_threshold, "updated_at": now
+        })
+        # Pipeline updates have no $setOnInsert; only new sweets lack created_at
+        update.insert(0, {"$set": {"created_at": {"$ifNull": ["$created_at", now]}}})
+        query = {"name": sweet.name, **reserved_stock_guard(sweet.quantity)}
+        batch.append((line_number, sweet.name, UpdateOne(query, update, upsert=True)))
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            await _flush(batch, report)
+    
+    await _flush(batch, report)
+    if report.inserted or report.updated:
+        catalog_cache.invalidate()
+        # Upserts don't tell us every affected id, so reload the search index
+        await search_index.refresh()
+    return report.as_dict()
+
+async def _export_rows(format: str):
+    projection = {field: 1 for field in EXPORT_FIELDS if field != "id"}
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if format == "csv":
+        writer.writerow(EXPORT_FIELDS)
+    
+    rows = 0
+    async for sweet in iter_sweets(projection):
+        sweet["id"] = str(sweet.pop("_id"))
+        if format == "csv":
+            writer.writerow([sweet.get(field, "") for field in EXPORT_FIELDS])
+        else:
+            buffer.write(json.dumps({field: sweet.get(field) for field in EXPORT_FIELDS}) + "\n")
+        rows += 1
+        # Send in chunks rather than one tiny write per document
+        if rows % EXPORT_CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    
+    if buffer.tell():
+        yield buffer.getvalue()
+
+async def export_sweets(format: str, current_user: CurrentUser):
+    """Check access up front, then return an async iterator over the export body"""
+    if not await is_admin(current_user):
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    return _export_rows(format)
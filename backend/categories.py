@@ -3,34 +3,92 @@ Category management business logic
 """
 
 from fastapi import HTTPException
+from pymongo.errors import DuplicateKeyError
 from database import (
-    get_all_categories, get_category_by_id, get_category_by_name,
-    create_category, update_category, delete_category, get_sweets_by_category
+    get_all_categories, get_category_by_id, CATEGORY_FIELDS,
+    create_category, update_category, rename_category, delete_category_with_policy, sweets_by_category_cursor,
+    aggregate_category_stats, get_categories_with_sweets, get_category_with_sweets
 )
 from models import Category, CategoryUpdate
 from datetime import datetime
+from streaming import stream_cursor
+from cache import TTLCache
+from config import (
+    CATEGORY_STATS_TTL_SECONDS, CATEGORY_SWEETS_LIMIT, CATEGORY_SWEETS_MAX_LIMIT,
+    CATEGORY_DELETE_POLICY, CATEGORY_REASSIGN_TO
+)
+import catalog_cache
+import search_index
+
+DELETE_POLICIES = ("block", "reassign", "cascade")
 
-def get_categories(active_only: bool = False):
-    """Get all categories, optionally filtered by active status"""
-    return get_all_categories(active_only)
+# Keyed by catalog version, so writes in this process show up immediately;
+# the TTL bounds staleness from other workers and category-only changes
+_stats_cache = TTLCache(4, CATEGORY_STATS_TTL_SECONDS)
 
-def get_category(category_id: str):
-    """Get a specific category by ID"""
-    category = get_category_by_id(category_id)
+def _sweets_limit(sweets_limit: int = None) -> int:
+    return min(sweets_limit or CATEGORY_SWEETS_LIMIT, CATEGORY_SWEETS_MAX_LIMIT)
+
+async def get_categories(active_only: bool = False, include_sweets: bool = False, sweets_limit: int = None):
+    """Get all categories, optionally filtered by active status.
+    
+    With include_sweets, each category carries up to sweets_limit of its
+    sweets, fetched in the same aggregation rather than one query per category.
+    """
+    # Identical concurrent requests share one query
+    if include_sweets:
+        limit = _sweets_limit(sweets_limit)
+        return await catalog_cache.coalesce(
+            "categories", (active_only, limit), lambda: get_categories_with_sweets(active_only, limit)
+        )
+    return await catalog_cache.coalesce("categories", (active_only,), lambda: get_all_categories(active_only))
+
+async def get_category_stats():
+    """Sweet counts, stock and inventory value for every category"""
+    key = catalog_cache.version()
+    if CATEGORY_STATS_TTL_SECONDS > 0:
+        cached = _stats_cache.get(key)
+        if cached is not None:
+            return cached
+    
+    categories = await get_all_categories()
+    totals = {row["_id"]: row for row in await aggregate_category_stats()}
+    
+    stats = []
+    for category in categories:
+        row = totals.pop(category["name"], {})
+        stats.append(_stats_entry(category["name"], category["id"], row))
+    # Sweets pointing at a category name with no category document
+    for name, row in totals.items():
+        stats.append(_stats_entry(name, None, row))
+    
+    if CATEGORY_STATS_TTL_SECONDS > 0:
+        _stats_cache.set(key, stats)
+    return stats
+
+def _stats_entry(name: str, category_id: str, row: dict) -> dict:
+    return {
+        "category": name,
+        "category_id": category_id,
+        "sweet_count": row.get("sweet_count", 0),
+        "total_quantity": row.get("total_quantity", 0),
+        "inventory_value": round(row.get("inventory_value", 0), 2),
+        "out_of_stock": row.get("out_of_stock", 0)
+    }
+
+async def get_category(category_id: str, include_sweets: bool = False, sweets_limit: int = None):
+    """Get a specific category by ID, optionally with its sweets embedded"""
+    if include_sweets:
+        category = await get_category_with_sweets(category_id, _sweets_limit(sweets_limit))
+    else:
+        category = await get_category_by_id(category_id, CATEGORY_FIELDS)
     if not category:
         raise HTTPException(status_code=404, detail="Category not found")
     
-    category["id"] = str(category["_id"])
-    del category["_id"]
     return category
 
-def create_new_category(category: Category):
+async def create_new_category(category: Category):
     """Create a new category"""
-    # Check if category with same name already exists
-    existing_category = get_category_by_name(category.name)
-    if existing_category:
-        raise HTTPException(status_code=400, detail="Category with this name already exists")
-    
     category_data = {
         "name": category.name,
         "description": category.description,
@@ -38,26 +96,21 @@ def create_new_category(category: Category):
         "created_at": datetime.utcnow()
     }
     
-    result = create_category(category_data)
+    # The unique index on name rejects duplicates without a pre-read
+    try:
+        result = await create_category(category_data)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Category with this name already exists")
+    catalog_cache.invalidate()
     category_data["id"] = str(result.inserted_id)
     del category_data["created_at"]
     return category_data
 
-def update_existing_category(category_id: str, category_update: CategoryUpdate):
-    """Update an existing category"""
-    # Check if category exists
-    existing_category = get_category_by_id(category_id)
-    if not existing_category:
-        raise HTTPException(status_code=404, detail="Category not found")
-    
+async def update_existing_category(category_id: str, category_update: CategoryUpdate, if_match: str = None):
+    """Update an existing category and return it; with If-Match, only if it is still at that version"""
     # Prepare update data (only include non-None fields)
     update_data = {}
     if category_update.name is not None:
-        # Check if new name conflicts with existing category
-        if category_update.name != existing_category["name"]:
-            conflicting_category = get_category_by_name(category_update.name)
-            if conflicting_category:
-                raise HTTPException(status_code=400, detail="Category with this name already exists")
         update_data["name"] = category_update.name
     
     if category_update.description is not None:
@@ -69,31 +122,61 @@ def update_existing_category(category_id: str, category_update: CategoryUpdate):
     if not update_data:
         raise HTTPException(status_code=400, detail="No valid fields to update")
     
-    result = update_category(category_id, update_data)
-    if result.modified_count == 0:
-        raise HTTPException(status_code=400, detail="No changes made")
+    versions = catalog_cache.if_match_versions(if_match)
+    try:
+        if "name" in update_data:
+            # A rename moves the category's sweets to the new name in the same transaction
+            category = await rename_category(category_id, update_data, versions)
+        else:
+            category = await update_category(category_id, update_data, versions)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Category with this name already exists")
+    if not category:
+        # Only the failure path reads again, to tell 404 from 412
+        if versions is None or not await get_category_by_id(category_id, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Category not found")
+        raise HTTPException(status_code=412, detail="Category was changed by someone else; reload it and retry")
     
-    # Return updated category
-    return get_category(category_id)
+    catalog_cache.invalidate()
+    if "name" in update_data:
+        search_index.invalidate()
+    return category
 
-def delete_existing_category(category_id: str):
-    """Delete an existing category"""
-    # Check if category exists
-    existing_category = get_category_by_id(category_id)
-    if not existing_category:
-        raise HTTPException(status_code=404, detail="Category not found")
+async def delete_existing_category(category_id: str, policy: str = None, reassign_to: str = None):
+    """Delete a category, blocking on, reassigning or deleting its sweets"""
+    policy = policy or CATEGORY_DELETE_POLICY
+    if policy not in DELETE_POLICIES:
+        raise HTTPException(status_code=400, detail=f"Invalid policy. Use one of: {', '.join(DELETE_POLICIES)}")
+    reassign_to = reassign_to or CATEGORY_REASSIGN_TO
     
-    result = delete_category(category_id)
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=400, detail="Failed to delete category")
+    result = await delete_category_with_policy(category_id, policy, reassign_to)
+    if not result:
+        raise HTTPException(status_code=404, detail="Category not found")
+    if result["conflict"]:
+        raise HTTPException(status_code=409, detail=result["conflict"])
     
-    return {"message": "Category deleted successfully"}
+    catalog_cache.invalidate()
+    if not result["sweets"]:
+        return {"message": "Category deleted successfully"}
+    search_index.invalidate()
+    if policy == "reassign":
+        return {"message": f"Category deleted successfully; {result['sweets']} sweet(s) moved to {reassign_to}"}
+    return {"message": f"Category deleted successfully along with {result['sweets']} sweet(s)"}
 
-def get_category_sweets(category_id: str):
+async def get_category_sweets(category_id: str):
     """Get all sweets in a specific category"""
-    # Check if category exists
-    category = get_category_by_id(category_id)
+    # A plain find rather than the $lookup: unbounded, the joined sweets
+    # could outgrow MongoDB's 16 MB document limit
+    category = await get_category_by_id(category_id, {"name": 1})
+    if not category:
+        raise HTTPException(status_code=404, detail="Category not found")
+    
+    return await sweets_by_category_cursor(category["name"]).to_list(None)
+
+async def stream_category_sweets(category_id: str, format: str):
+    """Stream the sweets in a category straight from the cursor"""
+    category = await get_category_by_id(category_id)
     if not category:
         raise HTTPException(status_code=404, detail="Category not found")
     
-    return get_sweets_by_category(category["name"])
+    return stream_cursor(sweets_by_category_cursor(category["name"]), format)
@@ -7,16 +7,116 @@ load_dotenv()
 # Database Configuration
 MONGODB_URL = os.getenv("MONGODB_URL", "mongodb://localhost:27017")
 DATABASE_NAME = os.getenv("DATABASE_NAME", "sweet_shop")
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_CONNECTING = int(os.getenv("MONGO_MAX_CONNECTING", "2"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000"))
+# Connections each worker opens at startup, before serving traffic (0 skips)
+MONGO_WARMUP_CONNECTIONS = int(os.getenv("MONGO_WARMUP_CONNECTIONS", "4"))
+
+# Startup and Readiness Configuration (/ready pings MongoDB at most once per cache interval)
+READY_CHECK_TIMEOUT_SECONDS = float(os.getenv("READY_CHECK_TIMEOUT_SECONDS", "2"))
+READY_CACHE_SECONDS = float(os.getenv("READY_CACHE_SECONDS", "5"))
+STARTUP_RETRY_MAX_SECONDS = float(os.getenv("STARTUP_RETRY_MAX_SECONDS", "30"))
 
 # JWT Configuration
 SECRET_KEY = os.getenv("SECRET_KEY", "your-super-secret-jwt-key-change-this-in-production")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
 
+# Password Hashing Configuration
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_POOL_WORKERS = int(os.getenv("PASSWORD_POOL_WORKERS", str(os.cpu_count() or 1)))
+PASSWORD_QUEUE_LIMIT = int(os.getenv("PASSWORD_QUEUE_LIMIT", "64"))
+
+# User Cache Configuration (authorization lookups)
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL_SECONDS = int(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+
 # Server Configuration
 HOST = os.getenv("HOST", "0.0.0.0")
 PORT = int(os.getenv("PORT", "8000"))
 DEBUG = os.getenv("DEBUG", "True").lower() == "true"
 
+# Metrics Configuration (Prometheus /metrics endpoint and Mongo timings)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "True").lower() == "true"
+
 # CORS Configuration
 CORS_ORIGINS = os.getenv("CORS_ORIGINS", "http://localhost:3000,http://127.0.0.1:3000").split(",")
+
+# Rate Limiting Configuration
+# RATE_LIMITS: comma-separated "METHOD PATH=CAPACITY/SECONDS[:ip|user]"
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "True").lower() == "true"
+RATE_LIMITS = os.getenv("RATE_LIMITS", ",".join([
+    "POST /api/auth/login=10/60:ip",
+    "POST /api/auth/register=5/60:ip",
+    "POST /api/sweets/{sweet_id}/purchase=30/60",
+    "POST /api/sweets/{sweet_id}/reserve=30/60",
+    "POST /api/sweets/import=5/60",
+    "GET /api/sweets/export=5/60",
+    "GET /api/sweets=300/60",
+    "GET /api/sweets/search=600/60",
+]))
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+RATE_LIMIT_SHARDS = int(os.getenv("RATE_LIMIT_SHARDS", "16"))
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+RATE_LIMIT_TRUST_FORWARDED = os.getenv("RATE_LIMIT_TRUST_FORWARDED", "False").lower() == "true"
+# Proxies in front of the app that append to X-Forwarded-For; the client IP is that many entries from the right
+RATE_LIMIT_TRUSTED_PROXIES = int(os.getenv("RATE_LIMIT_TRUSTED_PROXIES", "1"))
+
+# Idempotency-Key Configuration (purchase and restock)
+# IDEMPOTENCY_BACKEND: "memory" (per worker) or "mongo" (shared by all workers)
+IDEMPOTENCY_BACKEND = os.getenv("IDEMPOTENCY_BACKEND", "memory").lower()
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "100000"))
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "10"))
+IDEMPOTENCY_LOCK_SECONDS = int(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "60"))
+
+# Sweets Listing Configuration
+SWEETS_PAGE_SIZE = int(os.getenv("SWEETS_PAGE_SIZE", "50"))
+SWEETS_MAX_PAGE_SIZE = int(os.getenv("SWEETS_MAX_PAGE_SIZE", "200"))
+CATALOG_CACHE_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", "256"))
+CATALOG_CACHE_TTL_SECONDS = int(os.getenv("CATALOG_CACHE_TTL_SECONDS", "30"))
+STREAM_CHUNK_BYTES = int(os.getenv("STREAM_CHUNK_BYTES", "16384"))
+
+# Low Stock Configuration (threshold for sweets created without their own)
+DEFAULT_REORDER_THRESHOLD = int(os.getenv("DEFAULT_REORDER_THRESHOLD", "10"))
+
+# Category Statistics Configuration (0 disables caching)
+CATEGORY_STATS_TTL_SECONDS = int(os.getenv("CATEGORY_STATS_TTL_SECONDS", "10"))
+
+# Embedded Category Sweets Configuration (?include=sweets)
+CATEGORY_SWEETS_LIMIT = int(os.getenv("CATEGORY_SWEETS_LIMIT", "20"))
+CATEGORY_SWEETS_MAX_LIMIT = int(os.getenv("CATEGORY_SWEETS_MAX_LIMIT", "200"))
+
+# Category Delete Configuration
+# CATEGORY_DELETE_POLICY: what happens to a deleted category's sweets by default:
+# "block" (refuse while it has sweets), "reassign" (move them to CATEGORY_REASSIGN_TO)
+# or "cascade" (delete them too)
+CATEGORY_DELETE_POLICY = os.getenv("CATEGORY_DELETE_POLICY", "block").lower()
+CATEGORY_REASSIGN_TO = os.getenv("CATEGORY_REASSIGN_TO", "Uncategorized")
+
+# Type-ahead Search Configuration
+SEARCH_INDEX_MAX_AGE_SECONDS = int(os.getenv("SEARCH_INDEX_MAX_AGE_SECONDS", "300"))
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", "50"))
+
+# Bulk Import/Export Configuration
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "1000"))
+
+# Stock Movement Ledger Configuration
+# LEDGER_DURABILITY: "async" returns once queued, "sync" waits for the batch write
+LEDGER_DURABILITY = os.getenv("LEDGER_DURABILITY", "async").lower()
+LEDGER_JOURNAL = os.getenv("LEDGER_JOURNAL", "False").lower() == "true"
+LEDGER_BATCH_SIZE = int(os.getenv("LEDGER_BATCH_SIZE", "500"))
+LEDGER_FLUSH_INTERVAL_MS = int(os.getenv("LEDGER_FLUSH_INTERVAL_MS", "200"))
+LEDGER_QUEUE_LIMIT = int(os.getenv("LEDGER_QUEUE_LIMIT", "10000"))
+LEDGER_MAX_RETRIES = int(os.getenv("LEDGER_MAX_RETRIES", "3"))
+LEDGER_DRAIN_TIMEOUT_SECONDS = float(os.getenv("LEDGER_DRAIN_TIMEOUT_SECONDS", "10"))
+
+# Checkout Reservation Configuration
+RESERVATION_TTL_SECONDS = int(os.getenv("RESERVATION_TTL_SECONDS", "600"))
+RESERVATION_SWEEP_INTERVAL_SECONDS = float(os.getenv("RESERVATION_SWEEP_INTERVAL_SECONDS", "15"))
+RESERVATION_SWEEP_BATCH = int(os.getenv("RESERVATION_SWEEP_BATCH", "500"))
+# Closed reservations are deleted by a TTL index after this long
+RESERVATION_RETENTION_SECONDS = int(os.getenv("RESERVATION_RETENTION_SECONDS", "604800"))
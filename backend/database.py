@@ -1,81 +1,575 @@
-from pymongo import MongoClient
+import asyncio
+import logging
+import os
+from pymongo import AsyncMongoClient, ASCENDING, DESCENDING, ReturnDocument, WriteConcern
+from pymongo.errors import OperationFailure
 from bson import ObjectId
 from datetime import datetime
-from config import MONGODB_URL, DATABASE_NAME
+import re
+from config import (
+    MONGODB_URL, DATABASE_NAME, MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE,
+    MONGO_MAX_CONNECTING, MONGO_MAX_IDLE_TIME_MS, MONGO_WARMUP_CONNECTIONS,
+    LEDGER_JOURNAL, METRICS_ENABLED, DEFAULT_REORDER_THRESHOLD
+)
+from metrics import mongo_listeners
 
-client = MongoClient(MONGODB_URL)
-db = client[DATABASE_NAME]
+logger = logging.getLogger(__name__)
 
-def get_user_by_username(username: str):
-    return db.users.find_one({"username": username})
+client = None
+_client_loop = None
+_client_pid = None
+# Cleared the first time the server turns out not to support transactions
+_transactions_supported = True
 
-def get_user_by_email(email: str):
-    return db.users.find_one({"email": email})
+# Server error code for transactions on a standalone mongod
+ILLEGAL_OPERATION = 20
 
-def create_user(user_data: dict):
-    return db.users.insert_one(user_data)
+# Fields served by the listing/detail endpoints. id is rendered by the server,
+# so results need no per-document _id -> id rewrite in Python.
+SWEET_FIELDS = {
+    "_id": 0, "id": {"$toString": "$_id"}, "name": 1, "category": 1, "price": 1, "quantity": 1,
+    "reserved": 1, "reorder_threshold": 1, "version": 1
+}
+LOW_STOCK_FIELDS = {**SWEET_FIELDS, "stock_headroom": 1}
+CATEGORY_FIELDS = {"_id": 0, "id": {"$toString": "$_id"}, "name": 1, "description": 1, "is_active": 1, "version": 1}
+MOVEMENT_FIELDS = {
+    "_id": 0, "id": {"$toString": "$_id"}, "kind": 1, "sweet_name": 1,
+    "quantity": 1, "quantity_after": 1, "username": 1, "at": 1
+}
 
-def get_all_sweets():
-    sweets = list(db.sweets.find())
-    for sweet in sweets:
-        sweet["id"] = str(sweet["_id"])
-        del sweet["_id"]
-    return sweets
+def _discard_client(stale: AsyncMongoClient, stale_loop, stale_pid: int):
+    """Close a client that can no longer be used from here, where that is safe"""
+    if stale_pid != os.getpid():
+        # Inherited over fork(): its sockets are the parent's, and the parent closes them
+        return
+    if stale_loop.is_running():
+        # Still serving another thread (e.g. an earlier TestClient portal); close it there
+        asyncio.run_coroutine_threadsafe(stale.close(), stale_loop)
+    else:
+        # Its loop is gone, so close() can't run; dropping it releases the sockets
+        logger.debug("Discarding a MongoDB client whose event loop has stopped")
 
-def get_sweet_by_id(sweet_id: str):
-    return db.sweets.find_one({"_id": ObjectId(sweet_id)})
+def get_client() -> AsyncMongoClient:
+    """Return the AsyncMongoClient for the running event loop and process.
 
-def get_sweet_by_name(name: str):
-    return db.sweets.find_one({"name": name})
+    An AsyncMongoClient is bound to the loop it is first used on, so a new one
+    is created whenever we are called from a different loop (e.g. a fresh
+    TestClient portal). Pools can't be shared across fork() either, so a
+    worker forked from a parent that already had a client builds its own.
+    Normally connect() creates it during startup; this creates it lazily
+    for scripts and tests that skip the lifespan.
+    """
+    global client, _client_loop, _client_pid
+    loop = asyncio.get_running_loop()
+    if client is None or _client_loop is not loop or _client_pid != os.getpid():
+        if client is not None:
+            _discard_client(client, _client_loop, _client_pid)
+        client = AsyncMongoClient(
+            MONGODB_URL,
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            maxConnecting=MONGO_MAX_CONNECTING,
+            maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+            event_listeners=mongo_listeners() if METRICS_ENABLED else None
+        )
+        _client_loop = loop
+        _client_pid = os.getpid()
+    return client
 
-def create_sweet(sweet_data: dict):
-    return db.sweets.insert_one(sweet_data)
+async def connect():
+    """Create this worker's client and warm it up before it reports ready.
 
-def update_sweet(sweet_id: str, update_data: dict):
-    return db.sweets.update_one(
-        {"_id": ObjectId(sweet_id)},
-        {"$set": update_data}
+    The ping fails fast if MongoDB is unreachable (readiness.py retries). Concurrent pings
+    then each check out their own connection, leaving MONGO_WARMUP_CONNECTIONS
+    open in the pool so the first requests don't pay for TCP/TLS handshakes.
+    """
+    mongo = get_client()
+    await mongo.aconnect()
+    await mongo.admin.command("ping")
+    if MONGO_WARMUP_CONNECTIONS > 0:
+        await asyncio.gather(*(mongo.admin.command("ping") for _ in range(MONGO_WARMUP_CONNECTIONS)))
+    logger.info("MongoDB connected (pid %d, %d warm connections)", os.getpid(), MONGO_WARMUP_CONNECTIONS)
+
+async def close():
+    """Close this worker's client and its pooled connections"""
+    global client, _client_loop, _client_pid
+    if client is not None and _client_pid == os.getpid():
+        await client.close()
+    client = _client_loop = _client_pid = None
+
+def get_db():
+    return get_client()[DATABASE_NAME]
+
+async def run_transaction(callback):
+    """Return `await callback(session)` run inside a transaction.
+
+    Transactions need a replica set or mongos. Against a standalone server
+    (local development, tests) the callback runs once with session=None, so
+    its writes are applied in order but not atomically.
+    """
+    global _transactions_supported
+    if _transactions_supported:
+        async with get_client().start_session() as session:
+            try:
+                return await session.with_transaction(callback)
+            except OperationFailure as exc:
+                if exc.code != ILLEGAL_OPERATION:
+                    raise
+        _transactions_supported = False
+        logger.warning("MongoDB server does not support transactions; multi-document writes are not atomic")
+    return await callback(None)
+
+async def get_user_by_username(username: str):
+    return await get_db().users.find_one({"username": username})
+
+async def get_user_by_email(email: str):
+    return await get_db().users.find_one({"email": email})
+
+async def create_user(user_data: dict):
+    return await get_db().users.insert_one(user_data)
+
+async def update_user_password(username: str, hashed_password: str):
+    return await get_db().users.update_one(
+        {"username": username},
+        {"$set": {"password": hashed_password}}
+    )
+
+async def set_user_admin(username: str, is_admin: bool, changed_at: int):
+    """Set the role and record when it changed; tokens issued earlier lose their role claim"""
+    return await get_db().users.update_one(
+        {"username": username},
+        {"$set": {"is_admin": is_admin, "role_changed_at": changed_at}}
     )
 
-def delete_sweet(sweet_id: str):
-    return db.sweets.delete_one({"_id": ObjectId(sweet_id)})
+async def get_all_sweets():
+    return await get_db().sweets.find({}, SWEET_FIELDS).to_list(None)
+
+# Sort keys accepted by the sweets listing; each one is backed by a (field, _id) index
+SWEET_SORT_FIELDS = ("name", "price", "quantity")
+
+def sweets_cursor(filters: dict, sort_field: str = "_id", descending: bool = False,
+                  limit: int = None, after: tuple = None, projection: dict = SWEET_FIELDS):
+    """Keyset query over sweets ordered by (sort_field, _id).
+
+    `after` is the (sort_value, _id) pair of the last item already returned;
+    only documents strictly past it in sort order are fetched. A None
+    sort_value stands for a document without the field, which Mongo sorts
+    before any set value.
+    """
+    query = dict(filters)
+    direction = DESCENDING if descending else ASCENDING
+    if after is not None:
+        last_value, last_id = after
+        op = "$lt" if descending else "$gt"
+        if sort_field == "_id":
+            seek = {"_id": {op: last_id}}
+        elif last_value is None:
+            # Missing values sort first: ascending, every set value is still to come;
+            # descending, only the remaining missing ones are
+            seek = {sort_field: None, "_id": {op: last_id}}
+            if not descending:
+                seek = {"$or": [{sort_field: {"$ne": None}}, seek]}
+        else:
+            seek = {"$or": [
+                {sort_field: {op: last_value}},
+                {sort_field: last_value, "_id": {op: last_id}}
+            ]}
+            if descending:
+                # $lt never matches a missing field, yet those documents sort last here
+                seek["$or"].append({sort_field: None})
+        query = {"$and": [query, seek]} if query else seek
+
+    sort = [(sort_field, direction)]
+    if sort_field != "_id":
+        sort.append(("_id", direction))
+
+    cursor = get_db().sweets.find(query, projection).sort(sort)
+    if limit is not None:
+        cursor = cursor.limit(limit)
+    return cursor
+
+async def find_sweets(filters: dict, sort_field: str = "_id", descending: bool = False,
+                      limit: int = None, after: tuple = None):
+    return await sweets_cursor(filters, sort_field, descending, limit, after).to_list(None)
+
+def build_sweet_filters(name_prefix: str = None, category: str = None, min_price: float = None,
+                        max_price: float = None, in_stock: bool = None) -> dict:
+    filters = {}
+    if name_prefix:
+        # Anchored, case-sensitive regex so the name index can serve it as a range scan
+        filters["name"] = {"$regex": "^" + re.escape(name_prefix)}
+    if category:
+        filters["category"] = category
+    if min_price is not None or max_price is not None:
+        filters["price"] = {}
+        if min_price is not None:
+            filters["price"]["$gte"] = min_price
+        if max_price is not None:
+            filters["price"]["$lte"] = max_price
+    if in_stock is True:
+        filters["quantity"] = {"$gt": 0}
+    elif in_stock is False:
+        filters["quantity"] = {"$lte": 0}
+    return filters
+
+async def bulk_upsert_sweets(operations: list):
+    # Unordered so one bad row doesn't stop the rest of the batch
+    return await get_db().sweets.bulk_write(operations, ordered=False)
+
+def iter_sweets(projection: dict = None, batch_size: int = 1000):
+    """Cursor over the whole catalog in _id order, fetched in batches"""
+    return get_db().sweets.find({}, projection).sort("_id", ASCENDING).batch_size(batch_size)
 
-def update_sweet_quantity(sweet_id: str, quantity_change: int):
-    return db.sweets.update_one(
+async def get_sweet_by_id(sweet_id: str, projection: dict = None):
+    return await get_db().sweets.find_one({"_id": ObjectId(sweet_id)}, projection)
+
+# Sweets and categories carry a version that every write to them increments.
+# Conditional updates filter on it, so a stale write matches nothing instead of
+# overwriting someone else's. Documents written before versions existed count
+# as version 0.
+def _version_filter(versions: list = None) -> dict:
+    if versions is None:
+        return {}
+    if 0 in versions:
+        return {"$or": [{"version": {"$in": versions}}, {"version": {"$exists": False}}]}
+    return {"version": {"$in": versions}}
+
+async def get_sweet_by_name(name: str):
+    return await get_db().sweets.find_one({"name": name})
+
+# Every sweet carries stock_headroom = quantity - reorder_threshold, kept in step
+# by each $inc on quantity. A partial index over headroom <= 0 then finds
+# low-stock sweets without looking at the rest of the catalog.
+def with_stock_headroom(fields: dict) -> list:
+    """Pipeline update that sets `fields`, then re-derives stock_headroom.
+
+    A reorder_threshold of None keeps the sweet's current threshold (or the
+    default for a new sweet).
+    """
+    fields = dict(fields)
+    threshold = fields.pop("reorder_threshold", None)
+    # $literal, so a string starting with "$" is never read as a field path
+    stages = [{"$set": {key: {"$literal": value} for key, value in fields.items()}}] if fields else []
+    stages.append({"$set": {"reorder_threshold": (
+        threshold if threshold is not None
+        else {"$ifNull": ["$reorder_threshold", DEFAULT_REORDER_THRESHOLD]}
+    )}})
+    stages.append({"$set": {
+        "stock_headroom": {"$subtract": ["$quantity", "$reorder_threshold"]},
+        "version": {"$add": [{"$ifNull": ["$version", 0]}, 1]}
+    }})
+    return stages
+
+def with_derived_fields(sweet_data: dict) -> dict:
+    """Fill in the fields every new sweet carries (threshold, headroom, version)"""
+    if sweet_data.get("reorder_threshold") is None:
+        sweet_data["reorder_threshold"] = DEFAULT_REORDER_THRESHOLD
+    sweet_data["stock_headroom"] = sweet_data["quantity"] - sweet_data["reorder_threshold"]
+    sweet_data["version"] = 1
+    return sweet_data
+
+async def create_sweet(sweet_data: dict):
+    return await get_db().sweets.insert_one(with_derived_fields(sweet_data))
+
+def reserved_stock_guard(quantity: int) -> dict:
+    """Filter for sweets whose quantity may be set to `quantity` outright.
+
+    With units reserved, releasing them would add them back on top of the new
+    figure, so only a sweet with nothing reserved (or whose quantity doesn't
+    change) matches.
+    """
+    return {"$or": [{"reserved": {"$not": {"$gt": 0}}}, {"quantity": quantity}]}
+
+async def reserved_sweet_names(names: list) -> set:
+    """Which of `names` currently have units reserved"""
+    cursor = get_db().sweets.find({"name": {"$in": names}, "reserved": {"$gt": 0}}, {"_id": 0, "name": 1})
+    return {sweet["name"] for sweet in await cursor.to_list(None)}
+
+async def update_sweet(sweet_id: str, update_data: dict, versions: list = None):
+    """Apply `update_data` and return the updated sweet (SWEET_FIELDS).
+
+    With `versions`, only a sweet currently at one of them is updated. None
+    means the sweet is missing, was changed since, or has reserved units and
+    `update_data` changes its quantity (their release would add them back on
+    top of the new figure).
+    """
+    query = {"_id": ObjectId(sweet_id), **_version_filter(versions)}
+    if "quantity" in update_data:
+        query = {"$and": [query, reserved_stock_guard(update_data["quantity"])]}
+    return await get_db().sweets.find_one_and_update(
+        query,
+        with_stock_headroom(update_data),
+        projection=SWEET_FIELDS,
+        return_document=ReturnDocument.AFTER
+    )
+
+async def backfill_stock_headroom():
+    """Derive stock_headroom for sweets written before it existed or outside the app"""
+    return await get_db().sweets.update_many(
+        {"stock_headroom": {"$exists": False}},
+        with_stock_headroom({})
+    )
+
+def low_stock_cursor(threshold: int = None, limit: int = None, after: tuple = None):
+    """Sweets at or below their own reorder threshold, or at or below `threshold`.
+
+    Ordered most urgent first, by (stock_headroom, _id) or (quantity, _id).
+    """
+    if threshold is None:
+        return sweets_cursor({"stock_headroom": {"$lte": 0}}, "stock_headroom",
+                             limit=limit, after=after, projection=LOW_STOCK_FIELDS)
+    return sweets_cursor({"quantity": {"$lte": threshold}}, "quantity",
+                         limit=limit, after=after, projection=LOW_STOCK_FIELDS)
+
+async def delete_sweet(sweet_id: str):
+    return await get_db().sweets.delete_one({"_id": ObjectId(sweet_id)})
+
+async def update_sweet_quantity(sweet_id: str, quantity_change: int):
+    return await get_db().sweets.update_one(
         {"_id": ObjectId(sweet_id)},
-        {"$inc": {"quantity": quantity_change}}
+        {"$inc": {"quantity": quantity_change, "stock_headroom": quantity_change, "version": 1}}
     )
 
+async def increment_sweet_stock(sweet_id: str, quantity: int):
+    """Add `quantity` units and return the updated sweet, or None if it is missing"""
+    return await get_db().sweets.find_one_and_update(
+        {"_id": ObjectId(sweet_id)},
+        {"$inc": {"quantity": quantity, "stock_headroom": quantity, "version": 1}},
+        return_document=ReturnDocument.AFTER
+    )
+
+async def decrement_sweet_stock(sweet_id: str, quantity: int):
+    """Atomically take `quantity` units if at least that many are in stock.
+
+    Returns the updated sweet, or None when the sweet is missing or short of stock.
+    """
+    return await get_db().sweets.find_one_and_update(
+        {"_id": ObjectId(sweet_id), "quantity": {"$gte": quantity}},
+        {"$inc": {"quantity": -quantity, "stock_headroom": -quantity, "version": 1}},
+        return_document=ReturnDocument.AFTER
+    )
+
+# Checkout reservations
+# A held reservation has already taken its units out of `quantity` and counts
+# them in the sweet's `reserved` field, so availability needs no scan.
+async def hold_sweet_stock(sweet_id: str, quantity: int):
+    """Move `quantity` units from available to reserved if enough are in stock"""
+    return await get_db().sweets.find_one_and_update(
+        {"_id": ObjectId(sweet_id), "quantity": {"$gte": quantity}},
+        {"$inc": {"quantity": -quantity, "stock_headroom": -quantity, "reserved": quantity, "version": 1}},
+        return_document=ReturnDocument.AFTER
+    )
+
+async def return_held_stock(sweet_id: ObjectId, quantity: int):
+    """Put units from an abandoned reservation back on sale"""
+    return await get_db().sweets.update_one(
+        {"_id": sweet_id},
+        {"$inc": {"quantity": quantity, "stock_headroom": quantity, "reserved": -quantity, "version": 1}}
+    )
+
+async def settle_held_stock(sweet_id: ObjectId, quantity: int):
+    """Drop committed units from reserved; they have already left quantity"""
+    return await get_db().sweets.find_one_and_update(
+        {"_id": sweet_id},
+        {"$inc": {"reserved": -quantity, "version": 1}},
+        return_document=ReturnDocument.AFTER
+    )
+
+async def create_reservation(reservation_data: dict):
+    return await get_db().reservations.insert_one(reservation_data)
+
+async def get_reservation(reservation_id: str):
+    return await get_db().reservations.find_one({"_id": ObjectId(reservation_id)})
+
+async def close_reservation(query: dict, status: str, closed_at: datetime):
+    """Atomically move a held reservation matching `query` to `status`.
+
+    Returns the reservation, or None if it was not held (already committed,
+    released or expired by someone else).
+    """
+    return await get_db().reservations.find_one_and_update(
+        {**query, "status": "held"},
+        {"$set": {"status": status, "closed_at": closed_at}}
+    )
+
+async def find_expired_reservations(now: datetime, limit: int):
+    cursor = get_db().reservations.find(
+        {"status": "held", "expires_at": {"$lte": now}}, {"_id": 1}
+    )
+    return await cursor.limit(limit).to_list(None)
+
+# Stock movement ledger (append-only)
+def _stock_movements():
+    return get_db().get_collection(
+        "stock_movements", write_concern=WriteConcern(w=1, j=LEDGER_JOURNAL)
+    )
+
+async def insert_stock_movements(entries: list):
+    return await _stock_movements().insert_many(entries, ordered=False)
+
+async def get_stock_movements(sweet_id: str, limit: int):
+    """Most recent movements for one sweet, newest first"""
+    cursor = _stock_movements().find({"sweet_id": ObjectId(sweet_id)}, MOVEMENT_FIELDS)
+    return await cursor.sort([("at", DESCENDING), ("_id", DESCENDING)]).limit(limit).to_list(None)
+
 # Category operations
-def get_all_categories(active_only: bool = False):
+async def get_all_categories(active_only: bool = False):
     query = {"is_active": True} if active_only else {}
-    categories = list(db.categories.find(query))
-    for category in categories:
-        category["id"] = str(category["_id"])
-        del category["_id"]
-    return categories
+    return await get_db().categories.find(query, CATEGORY_FIELDS).to_list(None)
 
-def get_category_by_id(category_id: str):
-    return db.categories.find_one({"_id": ObjectId(category_id)})
+async def get_category_by_id(category_id: str, projection: dict = None):
+    return await get_db().categories.find_one({"_id": ObjectId(category_id)}, projection)
 
-def get_category_by_name(name: str):
-    return db.categories.find_one({"name": name})
+async def get_category_by_name(name: str):
+    return await get_db().categories.find_one({"name": name})
 
-def create_category(category_data: dict):
-    return db.categories.insert_one(category_data)
+async def create_category(category_data: dict):
+    category_data["version"] = 1
+    return await get_db().categories.insert_one(category_data)
 
-def update_category(category_id: str, update_data: dict):
-    return db.categories.update_one(
-        {"_id": ObjectId(category_id)},
-        {"$set": update_data}
+async def update_category(category_id: str, update_data: dict, versions: list = None):
+    """Apply `update_data` and return the updated category (CATEGORY_FIELDS), or None"""
+    return await get_db().categories.find_one_and_update(
+        {"_id": ObjectId(category_id), **_version_filter(versions)},
+        {"$set": update_data, "$inc": {"version": 1}},
+        projection=CATEGORY_FIELDS,
+        return_document=ReturnDocument.AFTER
     )
 
-def delete_category(category_id: str):
-    return db.categories.delete_one({"_id": ObjectId(category_id)})
+async def delete_category(category_id: str):
+    return await get_db().categories.delete_one({"_id": ObjectId(category_id)})
+
+# Sweets refer to their category by name. Renames and deletes carry over to
+# the sweets with one update_many/delete_many on the category index, inside the
+# same transaction, so the round-trips don't grow with the number of sweets.
+async def rename_category(category_id: str, update_data: dict, versions: list = None):
+    """Update a category (including its name) and move its sweets along.
+
+    Returns the updated category (CATEGORY_FIELDS), or None if it is missing
+    or no longer at one of `versions`.
+    """
+    db = get_db()
+
+    async def apply(session):
+        before = await db.categories.find_one_and_update(
+            {"_id": ObjectId(category_id), **_version_filter(versions)},
+            {"$set": update_data, "$inc": {"version": 1}},
+            projection=CATEGORY_FIELDS,
+            session=session
+        )
+        if before is None:
+            return None
+        if before["name"] != update_data["name"]:
+            await db.sweets.update_many(
+                {"category": before["name"]},
+                {"$set": {"category": update_data["name"]}, "$inc": {"version": 1}},
+                session=session
+            )
+        return {**before, **update_data, "version": before.get("version", 0) + 1}
+
+    return await run_transaction(apply)
+
+async def delete_category_with_policy(category_id: str, policy: str, reassign_to: str = None):
+    """Delete a category and deal with its sweets according to `policy`:
+
+    block     keep the category if any sweet still uses it
+    reassign  move its sweets to the category named `reassign_to`, creating it if needed
+    cascade   delete its sweets too
+
+    Returns None if the category is missing, else {"name", "conflict", "sweets"}:
+    conflict says why nothing was deleted (None if it was), and sweets counts
+    the sweets reassigned or deleted.
+    """
+    db = get_db()
+
+    async def apply(session):
+        category = await db.categories.find_one({"_id": ObjectId(category_id)}, {"name": 1}, session=session)
+        if category is None:
+            return None
+        name, affected = category["name"], 0
+        if policy == "block":
+            if await db.sweets.find_one({"category": name}, {"_id": 1}, session=session):
+                return {"name": name, "conflict": "Category still has sweets", "sweets": 0}
+        elif policy == "reassign":
+            if name == reassign_to:
+                return {"name": name, "conflict": "Cannot reassign sweets to the category being deleted", "sweets": 0}
+            await db.categories.update_one(
+                {"name": reassign_to},
+                {"$setOnInsert": {
+                    "description": "Sweets from deleted categories", "is_active": True,
+                    "version": 1, "created_at": datetime.utcnow()
+                }},
+                upsert=True,
+                session=session
+            )
+            result = await db.sweets.update_many(
+                {"category": name},
+                {"$set": {"category": reassign_to}, "$inc": {"version": 1}},
+                session=session
+            )
+            affected = result.modified_count
+        else:
+            affected = (await db.sweets.delete_many({"category": name}, session=session)).deleted_count
+        await db.categories.delete_one({"_id": category["_id"]}, session=session)
+        return {"name": name, "conflict": None, "sweets": affected}
+
+    return await run_transaction(apply)
+
+def sweets_by_category_cursor(category_name: str):
+    return get_db().sweets.find({"category": category_name}, SWEET_FIELDS)
+
+def _category_sweets_pipeline(match: dict, sweets_limit: int):
+    """Categories matching `match` with up to `sweets_limit` of their sweets under "sweets".
+
+    The lookup joins on the indexed sweets.category field and projects on the
+    server. Combining localField/foreignField with a pipeline needs MongoDB
+    5.0 or later. The limit is required: every joined sweet lands in the
+    category's result document, which must stay under the 16 MB BSON limit.
+    One extra sweet is fetched so has_more_sweets can tell a full page from a
+    truncated one.
+    """
+    sweets_pipeline = [
+        {"$sort": {"_id": 1}},
+        {"$limit": sweets_limit + 1},
+        {"$project": SWEET_FIELDS}
+    ]
+    project = dict(CATEGORY_FIELDS)
+    project["sweets"] = {"$slice": ["$sweets", sweets_limit]}
+    project["has_more_sweets"] = {"$gt": [{"$size": "$sweets"}, sweets_limit]}
+    return [
+        {"$match": match},
+        {"$lookup": {
+            "from": "sweets",
+            "localField": "name",
+            "foreignField": "category",
+            "pipeline": sweets_pipeline,
+            "as": "sweets"
+        }},
+        {"$project": project}
+    ]
+
+async def get_categories_with_sweets(active_only: bool, sweets_limit: int):
+    query = {"is_active": True} if active_only else {}
+    cursor = await get_db().categories.aggregate(_category_sweets_pipeline(query, sweets_limit))
+    return await cursor.to_list(None)
+
+async def get_category_with_sweets(category_id: str, sweets_limit: int):
+    cursor = await get_db().categories.aggregate(
+        _category_sweets_pipeline({"_id": ObjectId(category_id)}, sweets_limit)
+    )
+    categories = await cursor.to_list(1)
+    return categories[0] if categories else None
 
-def get_sweets_by_category(category_name: str):
-    sweets = list(db.sweets.find({"category": category_name}))
-    for sweet in sweets:
-        sweet["id"] = str(sweet["_id"])
-        del sweet["_id"]
-    return sweets
+async def aggregate_category_stats():
+    """Per-category counts, stock and inventory value in one pass over sweets"""
+    pipeline = [
+        {"$group": {
+            "_id": "$category",
+            "sweet_count": {"$sum": 1},
+            "total_quantity": {"$sum": "$quantity"},
+            "inventory_value": {"$sum": {"$multiply": ["$price", "$quantity"]}},
+            "out_of_stock": {"$sum": {"$cond": [{"$lte": ["$quantity", 0]}, 1, 0]}}
+        }}
+    ]
+    cursor = await get_db().sweets.aggregate(pipeline)
+    return await cursor.to_list(None)
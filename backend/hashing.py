@@ -0,0 +1,75 @@
+"""
+Password hashing on a dedicated process pool
+
+bcrypt costs hundreds of milliseconds of CPU per call, so hashing and
+verification run in worker processes instead of the request's event loop or
+threadpool. The number of jobs waiting for or running on the pool is capped;
+beyond PASSWORD_QUEUE_LIMIT new requests are shed with a 503 straight away.
+"""
+
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+from fastapi import HTTPException
+from config import BCRYPT_ROUNDS, PASSWORD_POOL_WORKERS, PASSWORD_QUEUE_LIMIT
+
+_pwd_context = None
+_executor = None
+_pending = 0
+
+def get_pwd_context():
+    """Build the CryptContext on first use; passlib's bcrypt setup is slow to import"""
+    global _pwd_context
+    if _pwd_context is None:
+        from passlib.context import CryptContext
+        # Hashes made with a different cost report needs_update, which drives rehash-on-login
+        _pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+    return _pwd_context
+
+def hash_password(password: str) -> str:
+    return get_pwd_context().hash(password)
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return get_pwd_context().verify(plain_password, hashed_password)
+
+def verify_and_update(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verify a password; on success also return a fresh hash if the stored one is outdated"""
+    return get_pwd_context().verify_and_update(plain_password, hashed_password)
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # spawn, not fork: the parent runs an event loop and database client threads
+        _executor = ProcessPoolExecutor(
+            max_workers=PASSWORD_POOL_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _executor
+
+async def _run_in_pool(func, *args):
+    global _pending
+    if _pending >= PASSWORD_QUEUE_LIMIT:
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy, please retry shortly",
+            headers={"Retry-After": "1"}
+        )
+    _pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_get_executor(), func, *args)
+    finally:
+        _pending -= 1
+
+async def hash_password_async(password: str) -> str:
+    return await _run_in_pool(hash_password, password)
+
+async def verify_and_update_async(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    return await _run_in_pool(verify_and_update, plain_password, hashed_password)
+
+async def shutdown_pool():
+    """Stop the worker processes without blocking the event loop while they exit"""
+    global _executor
+    if _executor is not None:
+        executor, _executor = _executor, None
+        await asyncio.to_thread(executor.shutdown, wait=True, cancel_futures=True)
@@ -0,0 +1,263 @@
+"""
+Idempotency-Key handling for purchase and restock
+
+A client that times out and retries a POST sends the same Idempotency-Key
+header both times. The first request claims the key and runs; its outcome
+(the response body, or a 4xx error) is stored for IDEMPOTENCY_TTL_SECONDS and
+retries replay it without touching inventory. Replays carry an
+"Idempotent-Replayed: true" header.
+
+A request that fails unexpectedly (or is cancelled) after its handler sent
+the stock update may have changed inventory, so its key is not released:
+retries get a 500 saying the outcome is unknown instead of running it again.
+Handlers call write_started() just before that update; a failure before it
+(or one where no server was ever selected) releases the key for a real retry.
+
+A duplicate that arrives while the first request is still running waits for
+it (up to IDEMPOTENCY_WAIT_SECONDS, then 409) instead of racing it. Reusing a
+key for a different request (another sweet or quantity) is rejected with 422.
+Keys are scoped to the user, so clients can't collide with each other.
+
+Outcomes are kept in memory per worker by default. With
+IDEMPOTENCY_BACKEND=mongo they live in the idempotency_keys collection
+instead, so a retry that lands on another worker is still recognised. The
+worker running a request renews its claim while it runs, so only a claim
+whose worker died mid-request goes unrenewed for IDEMPOTENCY_LOCK_SECONDS
+and is taken over.
+"""
+
+import asyncio
+import contextvars
+import hashlib
+import json
+import logging
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+from fastapi import HTTPException, Response
+from pydantic import BaseModel
+from pymongo.errors import DuplicateKeyError, ServerSelectionTimeoutError
+from cache import TTLCache
+from database import get_db
+from config import (
+    IDEMPOTENCY_BACKEND, IDEMPOTENCY_TTL_SECONDS, IDEMPOTENCY_MAX_KEYS,
+    IDEMPOTENCY_WAIT_SECONDS, IDEMPOTENCY_LOCK_SECONDS
+)
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+DONE = "done"
+REPLAYED_HEADER = "Idempotent-Replayed"
+UNKNOWN_OUTCOME = ("The request with this Idempotency-Key failed midway and may have been applied; "
+                   "check before retrying with a new key")
+# How often a duplicate checks on a request running in another worker
+POLL_INTERVAL_SECONDS = 0.05
+
+class MemoryStore:
+    """Outcomes for this worker only, LRU-bounded.
+
+    Claims still running are kept apart from the LRU, so a burst of other
+    keys can never evict one and let a duplicate run the request again.
+    """
+
+    # Claims live as long as this worker, so there is nothing to renew
+    renews_claims = False
+
+    def __init__(self, max_keys: int = IDEMPOTENCY_MAX_KEYS, ttl: float = IDEMPOTENCY_TTL_SECONDS):
+        self._entries = TTLCache(max_keys, ttl)
+        self._pending = {}
+
+    async def claim(self, key: str, fingerprint: str, owner: str) -> Optional[dict]:
+        """Claim the key for `owner` and return None, or return the entry that already holds it"""
+        # No await in between, so this is atomic on the event loop
+        entry = self._pending.get(key) or self._entries.get(key)
+        if entry is None:
+            self._pending[key] = {"fingerprint": fingerprint, "state": PENDING, "owner": owner}
+        return entry
+
+    async def renew(self, key: str, owner: str):
+        pass
+
+    async def complete(self, key: str, entry: dict, owner: str):
+        self._pending.pop(key, None)
+        self._entries.set(key, entry)
+
+    async def release(self, key: str, owner: str):
+        self._pending.pop(key, None)
+
+    def reset(self):
+        self._entries.clear()
+        self._pending.clear()
+
+class MongoStore:
+    """Outcomes shared by every worker, one document each in idempotency_keys"""
+
+    renews_claims = True
+
+    async def claim(self, key: str, fingerprint: str, owner: str) -> Optional[dict]:
+        collection = get_db().idempotency_keys
+        now = datetime.utcnow()
+        claim = {
+            "fingerprint": fingerprint, "state": PENDING, "owner": owner, "claimed_at": now,
+            "expires_at": now + timedelta(seconds=IDEMPOTENCY_TTL_SECONDS)
+        }
+        while True:
+            try:
+                await collection.insert_one({"_id": key, **claim})
+                return None
+            except DuplicateKeyError:
+                pass
+            # Take over a claim whose worker died before storing an outcome;
+            # a live one renews claimed_at well within IDEMPOTENCY_LOCK_SECONDS
+            abandoned = {"_id": key, "state": PENDING,
+                         "claimed_at": {"$lt": now - timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)}}
+            if await collection.find_one_and_update(abandoned, {"$set": claim}):
+                return None
+            entry = await collection.find_one({"_id": key})
+            if entry is not None:
+                return entry
+            # Expired between the insert and the read; claim it again
+
+    async def renew(self, key: str, owner: str):
+        await get_db().idempotency_keys.update_one(
+            {"_id": key, "state": PENDING, "owner": owner},
+            {"$set": {"claimed_at": datetime.utcnow()}}
+        )
+
+    async def complete(self, key: str, entry: dict, owner: str):
+        # A claim taken over from us belongs to its new owner now
+        await get_db().idempotency_keys.update_one({"_id": key, "owner": owner}, {"$set": {
+            **entry, "expires_at": datetime.utcnow() + timedelta(seconds=IDEMPOTENCY_TTL_SECONDS)
+        }})
+
+    async def release(self, key: str, owner: str):
+        await get_db().idempotency_keys.delete_one({"_id": key, "state": PENDING, "owner": owner})
+
+    def reset(self):
+        pass
+
+def make_store(name: str = IDEMPOTENCY_BACKEND):
+    if name == "mongo":
+        return MongoStore()
+    if name == "memory":
+        return MemoryStore()
+    raise ValueError(f"Unknown IDEMPOTENCY_BACKEND: {name!r}")
+
+_store = make_store()
+# key -> future resolved when this worker's first attempt finishes
+_running = {}
+# Set by write_started() while run() is waiting on a handler
+_write_progress = contextvars.ContextVar("idempotency_write_progress", default=None)
+
+def write_started():
+    """Mark that the handler is about to send its write.
+
+    From here on a failure may have left the write applied, so run() keeps
+    the key instead of releasing it. Outside run() this does nothing.
+    """
+    progress = _write_progress.get()
+    if progress is not None:
+        progress["sent"] = True
+
+def reset():
+    """Forget all in-memory outcomes"""
+    _store.reset()
+
+def _fingerprint(operation: str, payload: dict) -> str:
+    body = json.dumps([operation, payload], sort_keys=True, default=str)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+def _replay(entry: dict, response: Response):
+    if entry["status"] >= 400:
+        raise HTTPException(status_code=entry["status"], detail=entry["body"],
+                            headers={REPLAYED_HEADER: "true"})
+    response.headers[REPLAYED_HEADER] = "true"
+    return entry["body"]
+
+async def _wait_for_first(key: str, deadline: float):
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise HTTPException(
+            status_code=409,
+            detail="A request with this Idempotency-Key is still in progress",
+            headers={"Retry-After": "1"}
+        )
+    running = _running.get(key)
+    try:
+        if running is not None and running.get_loop() is asyncio.get_running_loop():
+            await asyncio.wait_for(asyncio.shield(running), remaining)
+        else:
+            # The first attempt runs in another worker; check back shortly
+            await asyncio.sleep(min(POLL_INTERVAL_SECONDS, remaining))
+    except asyncio.TimeoutError:
+        pass
+
+async def _keep_claim(key: str, owner: str):
+    """Renew a running claim so other workers don't take it over"""
+    while True:
+        await asyncio.sleep(IDEMPOTENCY_LOCK_SECONDS / 3)
+        try:
+            await _store.renew(key, owner)
+        except Exception as exc:
+            logger.warning("Could not renew Idempotency-Key claim: %s", exc)
+
+async def run(idempotency_key: Optional[str], username: str, operation: str, payload: dict,
+              call, response: Response):
+    """Run `call()` at most once per (user, Idempotency-Key) and replay its outcome"""
+    if not idempotency_key:
+        return await call()
+
+    key = f"{username}|{idempotency_key}"
+    fingerprint = _fingerprint(operation, payload)
+    owner = uuid.uuid4().hex
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+    while True:
+        entry = await _store.claim(key, fingerprint, owner)
+        if entry is None:
+            break
+        if entry["fingerprint"] != fingerprint:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+        if entry["state"] == DONE:
+            return _replay(entry, response)
+        await _wait_for_first(key, deadline)
+
+    finished = asyncio.get_running_loop().create_future()
+    _running[key] = finished
+    progress = {"sent": False}
+    progress_token = _write_progress.set(progress)
+    keeper = asyncio.create_task(_keep_claim(key, owner)) if _store.renews_claims else None
+    try:
+        result = await call()
+    except HTTPException as exc:
+        # 4xx answers are final; 429 and 5xx (e.g. shed load) are worth retrying for real
+        if exc.status_code >= 500 or exc.status_code == 429:
+            await _store.release(key, owner)
+        else:
+            await _store.complete(key, {"fingerprint": fingerprint, "state": DONE,
+                                        "status": exc.status_code, "body": exc.detail}, owner)
+        raise
+    except BaseException as exc:
+        if progress["sent"] and not isinstance(exc, ServerSelectionTimeoutError):
+            # The write may have been applied before the failure (or
+            # cancellation), so running it again could apply it twice
+            await _store.complete(key, {"fingerprint": fingerprint, "state": DONE, "status": 500,
+                                        "body": UNKNOWN_OUTCOME}, owner)
+        else:
+            # Nothing was sent, so a retry should run for real
+            await _store.release(key, owner)
+        raise
+    else:
+        body = result.model_dump(mode="json") if isinstance(result, BaseModel) else result
+        await _store.complete(key, {"fingerprint": fingerprint, "state": DONE, "status": 200, "body": body}, owner)
+        return result
+    finally:
+        if keeper is not None:
+            keeper.cancel()
+        _write_progress.reset(progress_token)
+        # Wakes duplicates in this worker once the outcome is stored; a
+        # takeover in this worker may already have replaced our future
+        if _running.get(key) is finished:
+            del _running[key]
+        finished.set_result(None)
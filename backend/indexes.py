@@ -0,0 +1,83 @@
+"""
+Declarative index registry, ensured at application startup
+
+Every secondary index the queries in database.py rely on is listed here.
+Unique indexes also enforce the no-duplicates rules, so creation paths
+insert directly and handle DuplicateKeyError instead of reading first; the
+application isn't ready until they exist.
+"""
+
+import logging
+from pymongo import IndexModel, ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+from database import get_db, SWEET_SORT_FIELDS
+from config import RESERVATION_RETENTION_SECONDS
+
+logger = logging.getLogger(__name__)
+
+INDEXES = {
+    "users": [
+        IndexModel([("username", ASCENDING)], unique=True, name="username_unique"),
+        IndexModel([("email", ASCENDING)], unique=True, name="email_unique"),
+    ],
+    "sweets": [
+        IndexModel([("name", ASCENDING)], unique=True, name="name_unique"),
+        IndexModel([("category", ASCENDING), ("_id", ASCENDING)], name="category_id"),
+    ] + [
+        # Keyset pagination sorts on (field, _id)
+        IndexModel([(field, ASCENDING), ("_id", ASCENDING)], name=f"{field}_id")
+        for field in SWEET_SORT_FIELDS
+    ] + [
+        # Holds only sweets at or below their reorder threshold
+        IndexModel(
+            [("stock_headroom", ASCENDING), ("_id", ASCENDING)],
+            partialFilterExpression={"stock_headroom": {"$lte": 0}},
+            name="low_stock"
+        ),
+    ],
+    "categories": [
+        IndexModel([("name", ASCENDING)], unique=True, name="name_unique"),
+    ],
+    "reservations": [
+        # The sweeper's query: held reservations past their expiry
+        IndexModel([("status", ASCENDING), ("expires_at", ASCENDING)], name="status_expires_at"),
+        # Only closed reservations have closed_at, so held ones are never purged
+        IndexModel([("closed_at", ASCENDING)], expireAfterSeconds=RESERVATION_RETENTION_SECONDS, name="closed_at_ttl"),
+    ],
+    "idempotency_keys": [
+        # Only used by IDEMPOTENCY_BACKEND=mongo; outcomes are kept until expires_at
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0, name="expires_at_ttl"),
+    ],
+    "rate_limits": [
+        # Only used by RATE_LIMIT_BACKEND=mongo; idle buckets are full again by expires_at
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0, name="expires_at_ttl"),
+    ],
+    "stock_movements": [
+        IndexModel([("sweet_id", ASCENDING), ("at", DESCENDING), ("_id", DESCENDING)], name="sweet_at"),
+        IndexModel([("at", ASCENDING)], name="at"),
+    ],
+}
+
+async def ensure_indexes():
+    """Create any missing indexes; existing ones are left untouched.
+
+    A unique index that can't be built (e.g. existing duplicates) raises, so
+    the bootstrap keeps retrying and /ready stays unhealthy: without it the
+    insert paths would let duplicates through. Failures on other indexes only
+    cost query speed and are logged.
+    """
+    db = get_db()
+    for collection, models in INDEXES.items():
+        unique = [model for model in models if model.document.get("unique")]
+        others = [model for model in models if not model.document.get("unique")]
+        if others:
+            try:
+                await db[collection].create_indexes(others)
+            except OperationFailure as exc:
+                logger.error("Could not ensure indexes on %s: %s", collection, exc)
+        if unique:
+            try:
+                await db[collection].create_indexes(unique)
+            except OperationFailure as exc:
+                logger.error("Could not ensure unique indexes on %s: %s", collection, exc)
+                raise
@@ -0,0 +1,167 @@
+"""
+Append-only stock movement ledger with a batched write-behind queue
+
+Every purchase and restock appends one document to the stock_movements
+collection. Entries are queued in process and written by a single background
+task with insert_many, in batches of up to LEDGER_BATCH_SIZE or every
+LEDGER_FLUSH_INTERVAL_MS, whichever comes first.
+
+LEDGER_DURABILITY picks what a request waits for:
+  async - the request returns once the entry is queued; entries still queued
+          when the process dies are lost
+  sync  - the request waits until the batch holding its entry is written
+          (group commit)
+
+A batch that still fails after LEDGER_MAX_RETRIES is held in memory and
+written after the next batch that succeeds; the stock change it records has
+already happened, so the request is never failed over it. Entries get their
+_id when queued, so a batch retried after a failure cannot be written twice.
+On shutdown the queue is drained before the process exits.
+"""
+
+import asyncio
+import logging
+from datetime import datetime
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+from database import insert_stock_movements
+import metrics
+from config import (
+    LEDGER_DURABILITY, LEDGER_BATCH_SIZE, LEDGER_FLUSH_INTERVAL_MS,
+    LEDGER_QUEUE_LIMIT, LEDGER_MAX_RETRIES, LEDGER_DRAIN_TIMEOUT_SECONDS
+)
+
+logger = logging.getLogger(__name__)
+
+_queue = None
+_writer = None
+_writer_loop = None
+# Entries whose batch failed every attempt, oldest first; at most LEDGER_QUEUE_LIMIT
+_unwritten = []
+
+def start():
+    """Start the writer task on the running loop (idempotent per loop)"""
+    global _queue, _writer, _writer_loop
+    loop = asyncio.get_running_loop()
+    if _writer is not None and _writer_loop is loop and not _writer.done():
+        return
+    _queue = asyncio.Queue(maxsize=LEDGER_QUEUE_LIMIT)
+    _writer_loop = loop
+    _writer = loop.create_task(_run())
+
+async def drain(timeout: float = LEDGER_DRAIN_TIMEOUT_SECONDS):
+    """Write out everything still queued, then stop the writer"""
+    global _writer
+    if _writer is None or _writer_loop is not asyncio.get_running_loop():
+        return
+    # None tells the writer to flush what it has and exit
+    await _queue.put(None)
+    try:
+        await asyncio.wait_for(_writer, timeout)
+    except asyncio.TimeoutError:
+        logger.error("Ledger drain timed out with %d entries unwritten", _queue.qsize())
+    if _unwritten:
+        logger.error("Exiting with %d ledger entries that could not be written", len(_unwritten))
+    _writer = None
+
+async def record(kind: str, sweet: dict, quantity: int, username: str):
+    """Append a movement for `sweet` as it is after the change"""
+    start()
+    entry = {
+        "_id": ObjectId(),
+        "kind": kind,
+        "sweet_id": sweet["_id"],
+        "sweet_name": sweet["name"],
+        "quantity": quantity,
+        "quantity_after": sweet["quantity"],
+        "username": username,
+        "at": datetime.utcnow()
+    }
+    done = asyncio.get_running_loop().create_future() if LEDGER_DURABILITY == "sync" else None
+    # A full queue pushes back on writers instead of dropping entries
+    await _queue.put((entry, done))
+    if done is not None:
+        await done
+
+async def _run():
+    interval = LEDGER_FLUSH_INTERVAL_MS / 1000
+    stopping = False
+    while not stopping:
+        item = await _queue.get()
+        if item is None:
+            break
+        batch = [item]
+        deadline = asyncio.get_running_loop().time() + interval
+        while len(batch) < LEDGER_BATCH_SIZE:
+            remaining = deadline - asyncio.get_running_loop().time()
+            try:
+                item = _queue.get_nowait() if remaining <= 0 else await asyncio.wait_for(_queue.get(), remaining)
+            except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                break
+            if item is None:
+                stopping = True
+                break
+            batch.append(item)
+        await _flush(batch)
+    # Anything queued behind the stop marker still gets written
+    leftover = []
+    while not _queue.empty():
+        item = _queue.get_nowait()
+        if item is not None:
+            leftover.append(item)
+    for i in range(0, len(leftover), LEDGER_BATCH_SIZE):
+        await _flush(leftover[i:i + LEDGER_BATCH_SIZE])
+
+async def _insert(entries: list):
+    """Write `entries`, retrying; return the last error, or None once written"""
+    error = None
+    for attempt in range(LEDGER_MAX_RETRIES + 1):
+        try:
+            await insert_stock_movements(entries)
+            return None
+        except BulkWriteError as exc:
+            # Duplicate _ids are entries an earlier attempt already wrote
+            if all(e.get("code") == 11000 for e in exc.details.get("writeErrors", [])):
+                return None
+            error = exc
+        except Exception as exc:
+            # Never let one bad batch kill the writer and strand the queue
+            error = exc
+        if attempt < LEDGER_MAX_RETRIES:
+            await asyncio.sleep(min(0.1 * 2 ** attempt, 2))
+    return error
+
+def _hold(entries: list, error: Exception):
+    logger.error("Holding %d ledger entries for a later retry after %d attempts: %s",
+                 len(entries), LEDGER_MAX_RETRIES + 1, error)
+    _unwritten.extend(entries)
+    overflow = len(_unwritten) - LEDGER_QUEUE_LIMIT
+    if overflow > 0:
+        logger.error("Dropping %d held ledger entries", overflow)
+        del _unwritten[:overflow]
+
+async def _flush(batch: list):
+    entries = [entry for entry, _ in batch]
+    error = await _insert(entries)
+    if error is not None:
+        _hold(entries, error)
+    # The stock already changed, so waiting requests succeed either way
+    for _, done in batch:
+        if done is not None and not done.done():
+            done.set_result(None)
+    if error is None and _unwritten:
+        # Writes work again; catch up on the batches that failed earlier
+        held = _unwritten[:]
+        del _unwritten[:]
+        for i in range(0, len(held), LEDGER_BATCH_SIZE):
+            chunk = held[i:i + LEDGER_BATCH_SIZE]
+            error = await _insert(chunk)
+            if error is not None:
+                _hold(held[i:], error)
+                break
+
+def pending() -> int:
+    """Entries queued but not yet handed to the writer"""
+    return _queue.qsize() if _queue is not None else 0
+
+metrics.LEDGER_QUEUE.set_function(pending)
@@ -1,10 +1,43 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Response
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from routes import router
 from simple_routes import router as simple_router
-from config import CORS_ORIGINS, DEBUG
+import readiness
+import database
+from rate_limit import RateLimitMiddleware
+from metrics import MetricsMiddleware, render as render_metrics
+from hashing import shutdown_pool
+import ledger
+import reservations
+from config import CORS_ORIGINS, DEBUG, METRICS_ENABLED
 
-app = FastAPI(title="Sweet Shop API", description="A simple sweet shop management system", debug=DEBUG)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Each worker opens (and warms) its own pool in the background; /ready
+    # turns healthy once that is done, so startup never blocks on MongoDB
+    readiness.start()
+    ledger.start()
+    reservations.start_sweeper()
+    yield
+    await readiness.stop()
+    await reservations.stop_sweeper()
+    # Queued ledger entries are written before the process exits
+    await ledger.drain()
+    await shutdown_pool()
+    await database.close()
+
+app = FastAPI(
+    title="Sweet Shop API",
+    description="A simple sweet shop management system",
+    debug=DEBUG,
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
+)
+
+# Added first so CORS wraps it and 429 responses still carry CORS headers
+app.add_middleware(RateLimitMiddleware)
 
 app.add_middleware(
     CORSMiddleware, 
@@ -14,13 +47,32 @@ app.add_middleware(
     allow_headers=["*"]
 )
 
+if METRICS_ENABLED:
+    # Outermost, so its timings include every other middleware
+    app.add_middleware(MetricsMiddleware)
+
 app.include_router(router, prefix="/api")  # Re-enabled for full functionality
 app.include_router(simple_router, prefix="/api")
 
 @app.get("/")
-def root():
+async def root():
     return {"message": "Sweet Shop API - Welcome!"}
 
 @app.get("/health")
-def health():
+async def health():
+    """Liveness: the process is serving requests; never touches MongoDB"""
     return {"status": "healthy"}
+
+@app.get("/ready")
+async def ready():
+    """Readiness: startup has finished and MongoDB answers a (cached) ping"""
+    is_ready, reason = await readiness.check()
+    if not is_ready:
+        return ORJSONResponse({"status": "unavailable", "detail": reason}, status_code=503)
+    return {"status": "ready"}
+
+if METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        body, content_type = render_metrics()
+        return Response(content=body, media_type=content_type)
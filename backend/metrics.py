@@ -0,0 +1,155 @@
+"""
+Prometheus metrics: HTTP route latency, in-flight requests, threadpool use,
+MongoDB command and connection pool timings and read coalescing
+
+Requests are labelled with the route template (e.g.
+/api/sweets/{sweet_id}/purchase) rather than the raw path, so label
+cardinality stays fixed. Labelled children are cached per (method, route,
+status), so a request costs two dict lookups plus one counter increment and
+one histogram observation. Mongo timings come from pymongo event listeners
+installed on the client in database.py. Values are per process; scrape each
+worker separately.
+"""
+
+import time
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from pymongo import monitoring
+from anyio import to_thread
+
+# Buckets sized for an API whose typical request is a few milliseconds
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+DB_BUCKETS = (.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1)
+
+REQUESTS = Counter(
+    "http_requests_total", "HTTP requests handled", ["method", "route", "status"]
+)
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Time spent handling HTTP requests",
+    ["method", "route"], buckets=LATENCY_BUCKETS
+)
+IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests currently being handled")
+THREADPOOL_BUSY = Gauge("threadpool_busy_threads", "Worker threads busy running sync code")
+THREADPOOL_SIZE = Gauge("threadpool_size", "Worker thread limit for sync code")
+
+MONGO_COMMANDS = Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command round-trip time",
+    ["command", "outcome"], buckets=DB_BUCKETS
+)
+MONGO_CHECKOUT_WAIT = Histogram(
+    "mongodb_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection",
+    buckets=DB_BUCKETS
+)
+MONGO_CHECKOUT_FAILURES = Counter(
+    "mongodb_pool_checkout_failures_total", "Connection checkouts that failed", ["reason"]
+)
+MONGO_CHECKED_OUT = Gauge("mongodb_pool_checked_out", "Pooled connections currently in use")
+LEDGER_QUEUE = Gauge("ledger_queue_depth", "Stock movements queued but not yet written")
+# Coalescing ratio: rate of role="shared" over the rate of both roles
+CATALOG_READS = Counter(
+    "catalog_reads_total", "Catalog queries that ran (leader) or joined an identical in-flight one (shared)",
+    ["kind", "role"]
+)
+
+# Requests that never reached a route (404s, rate-limited, CORS preflight)
+UNMATCHED = "unmatched"
+
+_latency_children = {}
+_count_children = {}
+
+def _observe(method: str, route: str, status: int, duration: float):
+    key = (method, route)
+    latency = _latency_children.get(key)
+    if latency is None:
+        latency = _latency_children[key] = REQUEST_LATENCY.labels(method, route)
+    count_key = (method, route, status)
+    count = _count_children.get(count_key)
+    if count is None:
+        count = _count_children[count_key] = REQUESTS.labels(method, route, str(status))
+    latency.observe(duration)
+    count.inc()
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route counts, latency and in-flight requests"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            IN_FLIGHT.dec()
+            # The router stores the matched route on the scope on its way in
+            route = scope.get("route")
+            _observe(scope["method"], getattr(route, "path", UNMATCHED), status, time.perf_counter() - start)
+
+def render() -> tuple:
+    """Return (body, content type) for the /metrics endpoint"""
+    limiter = to_thread.current_default_thread_limiter()
+    THREADPOOL_BUSY.set(limiter.borrowed_tokens)
+    THREADPOOL_SIZE.set(limiter.total_tokens)
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+_read_children = {}
+
+def observe_read(kind: str, shared: bool):
+    key = (kind, shared)
+    child = _read_children.get(key)
+    if child is None:
+        child = _read_children[key] = CATALOG_READS.labels(kind, "shared" if shared else "leader")
+    child.inc()
+
+_command_children = {}
+
+def _observe_command(command: str, outcome: str, duration_micros: int):
+    key = (command, outcome)
+    child = _command_children.get(key)
+    if child is None:
+        child = _command_children[key] = MONGO_COMMANDS.labels(command, outcome)
+    child.observe(duration_micros / 1e6)
+
+class CommandTimer(monitoring.CommandListener):
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        _observe_command(event.command_name, "success", event.duration_micros)
+
+    def failed(self, event):
+        _observe_command(event.command_name, "failure", event.duration_micros)
+
+class PoolTimer(monitoring.ConnectionPoolListener):
+    def connection_checked_out(self, event):
+        MONGO_CHECKOUT_WAIT.observe(event.duration)
+        MONGO_CHECKED_OUT.inc()
+
+    def connection_check_out_failed(self, event):
+        MONGO_CHECKOUT_FAILURES.labels(event.reason).inc()
+
+    def connection_checked_in(self, event):
+        MONGO_CHECKED_OUT.dec()
+
+    # The remaining pool events carry nothing we chart
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_cleared(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_created(self, event): pass
+    def connection_ready(self, event): pass
+    def connection_closed(self, event): pass
+    def connection_check_out_started(self, event): pass
+
+def mongo_listeners() -> list:
+    return [CommandTimer(), PoolTimer()]
@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import List, Optional
 from datetime import datetime
 
 class User(BaseModel):
@@ -11,23 +11,101 @@ class UserLogin(BaseModel):
     username: str
     password: str
 
+class CurrentUser(BaseModel):
+    username: str
+    # Role claim signed into the token; None for tokens issued without one
+    is_admin: Optional[bool] = None
+    issued_at: Optional[int] = None
+
+class RoleUpdate(BaseModel):
+    is_admin: bool
+
 class Sweet(BaseModel):
     name: str
     category: str
     price: float
     quantity: int
+    # Restock when quantity falls to this; None keeps the current (or default) threshold
+    reorder_threshold: Optional[int] = Field(None, ge=0)
+
+class SweetOut(BaseModel):
+    id: str
+    name: str
+    # Sweets written before these were required may lack them
+    category: Optional[str] = None
+    price: Optional[float] = None
+    quantity: Optional[int] = None
+    reserved: int = 0
+    reorder_threshold: Optional[int] = None
+    # Incremented by every write; send it back in If-Match to update safely
+    version: int = 0
+
+class SweetPage(BaseModel):
+    items: List[SweetOut]
+    next_cursor: Optional[str] = None
+
+class LowStockSweet(SweetOut):
+    # quantity minus reorder_threshold; zero or below means reorder now
+    stock_headroom: int
+
+class LowStockPage(BaseModel):
+    items: List[LowStockSweet]
+    next_cursor: Optional[str] = None
+
+class SweetSuggestion(BaseModel):
+    id: str
+    name: str
+    category: str
 
 class Purchase(BaseModel):
-    quantity: int
+    quantity: int = Field(gt=0)
 
 class Restock(BaseModel):
     quantity: int
 
+class Reserve(BaseModel):
+    quantity: int = Field(gt=0)
+
+class ReservationOut(BaseModel):
+    id: str
+    sweet_id: str
+    quantity: int
+    status: str
+    expires_at: datetime
+
+class StockMovement(BaseModel):
+    id: str
+    kind: str
+    sweet_name: str
+    quantity: int
+    quantity_after: int
+    username: str
+    at: datetime
+
 class Category(BaseModel):
     name: str
     description: str
     is_active: bool = True
 
+class CategoryOut(BaseModel):
+    id: str
+    name: str
+    description: str
+    is_active: bool = True
+    version: int = 0
+
+class CategoryWithSweets(CategoryOut):
+    sweets: List[SweetOut]
+    has_more_sweets: bool = False
+
+class CategoryStats(BaseModel):
+    category: Optional[str] = None
+    category_id: Optional[str] = None
+    sweet_count: int
+    total_quantity: int
+    inventory_value: float
+    out_of_stock: int
+
 class CategoryUpdate(BaseModel):
     name: Optional[str] = None
     description: Optional[str] = None
@@ -0,0 +1,219 @@
+"""
+Token-bucket rate limiting with per-route budgets
+
+Budgets come from RATE_LIMITS in config.py, one rule per route:
+
+    METHOD PATH=CAPACITY/SECONDS[:KEY]
+
+e.g. "POST /api/auth/login=10/60:ip" allows bursts of 10 login attempts per
+client IP, refilled at 10 per minute. KEY is "ip" or "user" (the default):
+the JWT subject when a valid token is sent, otherwise the client IP. PATH may
+contain {param} segments.
+
+Requests to routes without a rule pass straight through after one dict
+lookup (plus a regex match per templated rule), so cheap endpoints pay
+nothing measurable. Buckets live in memory, spread over RATE_LIMIT_SHARDS
+LRU-bounded shards, so each worker enforces its own limit. With
+RATE_LIMIT_BACKEND=mongo every bucket is one document updated atomically
+instead, which makes all workers share one limit at the cost of a round-trip
+per limited request.
+
+With RATE_LIMIT_TRUST_FORWARDED the client IP comes from X-Forwarded-For.
+Clients can send that header themselves, so only the entries appended by
+our own RATE_LIMIT_TRUSTED_PROXIES proxies count: the client is the one
+that many entries from the right, never the (forgeable) leftmost.
+"""
+
+import logging
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional, Pattern
+from fastapi.responses import ORJSONResponse
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+from auth import decode_token
+from database import get_db
+from config import (
+    RATE_LIMIT_ENABLED, RATE_LIMITS, RATE_LIMIT_BACKEND, RATE_LIMIT_SHARDS,
+    RATE_LIMIT_MAX_KEYS, RATE_LIMIT_TRUST_FORWARDED, RATE_LIMIT_TRUSTED_PROXIES
+)
+
+logger = logging.getLogger(__name__)
+
+KEY_MODES = ("ip", "user")
+
+class Rule(NamedTuple):
+    name: str
+    capacity: int
+    rate: float     # tokens per second
+    key: str
+    pattern: Optional[Pattern] = None
+
+def parse_rules(spec: str) -> tuple:
+    """Parse RATE_LIMITS into ({(method, path): Rule}, [(method, Rule)] for templated paths)"""
+    exact, templated = {}, []
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        route, _, budget = item.rpartition("=")
+        method, _, path = route.strip().partition(" ")
+        budget, _, key = budget.partition(":")
+        capacity, _, seconds = budget.partition("/")
+        key = key or "user"
+        if not path or key not in KEY_MODES:
+            raise ValueError(f"Invalid rate limit rule: {item!r}")
+        method, path = method.upper(), path.strip()
+        rule = Rule(f"{method} {path}", int(capacity), int(capacity) / float(seconds), key)
+        if "{" in path:
+            pattern = re.compile("^" + re.sub(r"\{[^/]+\}", "[^/]+", path) + "$")
+            templated.append((method, rule._replace(pattern=pattern)))
+        else:
+            exact[(method, path)] = rule
+    return exact, templated
+
+class _Shard:
+    __slots__ = ("lock", "buckets")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = OrderedDict()    # key -> [tokens, last refill]
+
+class MemoryBuckets:
+    """Per-process buckets, sharded so each LRU stays small"""
+
+    def __init__(self, shards: int = RATE_LIMIT_SHARDS, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self._shards = [_Shard() for _ in range(shards)]
+        self._max_per_shard = max(1, max_keys // shards)
+
+    async def take(self, rule: Rule, key: str) -> float:
+        """Spend one token; return 0 if allowed, else seconds until one is available"""
+        bucket_key = (rule.name, key)
+        shard = self._shards[hash(bucket_key) % len(self._shards)]
+        now = time.monotonic()
+        with shard.lock:
+            bucket = shard.buckets.get(bucket_key)
+            if bucket is None:
+                bucket = shard.buckets[bucket_key] = [float(rule.capacity), now]
+                if len(shard.buckets) > self._max_per_shard:
+                    # The least recently seen client; a full bucket is no loss
+                    shard.buckets.popitem(last=False)
+            else:
+                shard.buckets.move_to_end(bucket_key)
+                bucket[0] = min(rule.capacity, bucket[0] + (now - bucket[1]) * rule.rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0
+            return (1 - bucket[0]) / rule.rate
+
+    def reset(self):
+        for shard in self._shards:
+            with shard.lock:
+                shard.buckets.clear()
+
+class MongoBuckets:
+    """Buckets shared by every worker, one document each in rate_limits"""
+
+    async def take(self, rule: Rule, key: str) -> float:
+        now = time.time()
+        # Refill, then spend a token if one is there, in one atomic pipeline update
+        refilled = {"$min": [rule.capacity, {"$add": [
+            {"$ifNull": ["$tokens", rule.capacity]},
+            {"$multiply": [{"$subtract": [now, {"$ifNull": ["$at", now]}]}, rule.rate]}
+        ]}]}
+        update = [
+            {"$set": {"tokens": refilled, "at": now}},
+            {"$set": {
+                "allowed": {"$gte": ["$tokens", 1]},
+                "tokens": {"$cond": [{"$gte": ["$tokens", 1]}, {"$subtract": ["$tokens", 1]}, "$tokens"]},
+                # Once full again the document carries no state worth keeping
+                "expires_at": datetime.utcnow() + timedelta(seconds=rule.capacity / rule.rate)
+            }}
+        ]
+        try:
+            bucket = await get_db().rate_limits.find_one_and_update(
+                {"_id": f"{rule.name}|{key}"}, update,
+                upsert=True, return_document=ReturnDocument.AFTER
+            )
+        except PyMongoError as exc:
+            # Fail open: the limiter must not take the API down with it
+            logger.warning("Rate limit backend unavailable: %s", exc)
+            return 0
+        return 0 if bucket["allowed"] else (1 - bucket["tokens"]) / rule.rate
+
+    def reset(self):
+        pass
+
+def make_backend(name: str = RATE_LIMIT_BACKEND):
+    if name == "mongo":
+        return MongoBuckets()
+    if name == "memory":
+        return MemoryBuckets()
+    raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {name!r}")
+
+_backend = make_backend()
+
+def reset():
+    """Forget all in-memory buckets"""
+    _backend.reset()
+
+def _client_ip(scope: dict, headers: dict) -> str:
+    if RATE_LIMIT_TRUST_FORWARDED and b"x-forwarded-for" in headers:
+        hops = headers[b"x-forwarded-for"].split(b",")
+        return hops[max(len(hops) - RATE_LIMIT_TRUSTED_PROXIES, 0)].strip().decode("latin-1")
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+def _subject(headers: dict) -> Optional[str]:
+    authorization = headers.get(b"authorization", b"").decode("latin-1")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    # Only a verified token counts, or clients could mint a fresh bucket per request
+    payload = decode_token(token)
+    return payload.get("sub") if payload else None
+
+class RateLimitMiddleware:
+    """ASGI middleware answering 429 with Retry-After once a route's budget is spent"""
+
+    def __init__(self, app, rules: str = RATE_LIMITS, backend=None, enabled: bool = RATE_LIMIT_ENABLED):
+        self.app = app
+        self.enabled = enabled
+        self.exact, self.templated = parse_rules(rules)
+        self.backend = backend or _backend
+
+    def match(self, method: str, path: str) -> Optional[Rule]:
+        rule = self.exact.get((method, path))
+        if rule is None and self.templated:
+            for rule_method, candidate in self.templated:
+                if rule_method == method and candidate.pattern.match(path):
+                    return candidate
+        return rule
+
+    def key_for(self, rule: Rule, scope: dict) -> str:
+        headers = dict(scope["headers"])
+        if rule.key != "ip":
+            subject = _subject(headers)
+            if subject is not None:
+                return f"user:{subject}"
+        # Anonymous callers of a per-user route share their IP's budget
+        return f"ip:{_client_ip(scope, headers)}"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.enabled:
+            return await self.app(scope, receive, send)
+        rule = self.match(scope["method"], scope["path"].rstrip("/") or "/")
+        if rule is None:
+            return await self.app(scope, receive, send)
+
+        retry_after = await self.backend.take(rule, self.key_for(rule, scope))
+        if retry_after:
+            response = ORJSONResponse(
+                {"detail": "Too many requests, please slow down"},
+                status_code=429,
+                headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+            )
+            return await response(scope, receive, send)
+        return await self.app(scope, receive, send)
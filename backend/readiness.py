@@ -0,0 +1,101 @@
+"""
+Database bootstrap in the background, and the readiness probe
+
+Startup doesn't wait for MongoDB: the lifespan starts the bootstrap (connect
+and warm the pool, ensure indexes, backfill derived fields) as a task and the
+process begins answering /health straight away. If MongoDB is unreachable the
+bootstrap is retried with backoff instead of crashing the worker.
+
+/ready reports 503 until the bootstrap has finished (including while a unique
+index can't be built over existing duplicates), then reflects a ping to
+MongoDB. Ping results are cached for READY_CACHE_SECONDS and concurrent
+probes share one ping, so however often an orchestrator probes, each worker
+sends at most one ping per interval.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Optional
+import database
+from indexes import ensure_indexes
+import search_index
+from config import READY_CHECK_TIMEOUT_SECONDS, READY_CACHE_SECONDS, STARTUP_RETRY_MAX_SECONDS
+
+logger = logging.getLogger(__name__)
+
+_bootstrap = None
+_ping = None
+_checked_at = None
+_last_error = None
+# Why the last bootstrap attempt failed, reported by /ready until one succeeds
+_bootstrap_error = None
+
+async def _bootstrap_database():
+    global _bootstrap_error
+    delay = 0.5
+    while True:
+        try:
+            await database.connect()
+            await ensure_indexes()
+            await database.backfill_stock_headroom()
+            _bootstrap_error = None
+            break
+        except Exception as exc:
+            _bootstrap_error = str(exc) or type(exc).__name__
+            logger.warning("Database bootstrap failed, retrying in %.1fs: %s", delay, exc)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, STARTUP_RETRY_MAX_SECONDS)
+    # Build the type-ahead index in the background; the first search waits for it
+    search_index.refresh()
+
+def _on_loop(task: Optional[asyncio.Task]) -> bool:
+    return task is not None and task.get_loop() is asyncio.get_running_loop()
+
+def start():
+    """Start the bootstrap for this event loop"""
+    global _bootstrap, _ping, _checked_at, _bootstrap_error
+    if not _on_loop(_bootstrap):
+        _bootstrap = asyncio.create_task(_bootstrap_database())
+        _ping = _checked_at = _bootstrap_error = None
+
+async def wait(timeout: Optional[float] = None):
+    """Wait until the bootstrap has finished (scripts and tests)"""
+    if _bootstrap is not None:
+        await asyncio.wait_for(asyncio.shield(_bootstrap), timeout)
+
+async def stop():
+    global _bootstrap
+    if _on_loop(_bootstrap) and not _bootstrap.done():
+        _bootstrap.cancel()
+        try:
+            await _bootstrap
+        except asyncio.CancelledError:
+            pass
+    _bootstrap = None
+
+async def _ping_database():
+    global _checked_at, _last_error
+    try:
+        await asyncio.wait_for(database.get_client().admin.command("ping"), READY_CHECK_TIMEOUT_SECONDS)
+        _last_error = None
+    except asyncio.TimeoutError:
+        _last_error = f"ping timed out after {READY_CHECK_TIMEOUT_SECONDS}s"
+    except Exception as exc:
+        _last_error = str(exc) or type(exc).__name__
+    _checked_at = time.monotonic()
+
+async def check() -> tuple:
+    """Return (ready, reason); reason is None when ready"""
+    global _ping
+    if not _on_loop(_bootstrap):
+        return False, "not started"
+    if not _bootstrap.done():
+        return False, f"starting: {_bootstrap_error}" if _bootstrap_error else "starting"
+
+    fresh = _checked_at is not None and time.monotonic() - _checked_at < READY_CACHE_SECONDS
+    if not fresh:
+        if not _on_loop(_ping) or _ping.done():
+            _ping = asyncio.create_task(_ping_database())
+        await asyncio.shield(_ping)
+    return _last_error is None, _last_error
@@ -0,0 +1,161 @@
+"""
+Checkout reservations: hold stock for a while, then commit or release it
+
+Reserving moves units from a sweet's `quantity` to its `reserved` counter in
+one conditional update, so listings only ever show stock that can still be
+bought. Every state change claims the reservation with a single
+find_one_and_update on status "held", which makes commit, release and expiry
+mutually exclusive even across worker processes.
+
+Reservations that are neither committed nor released within
+RESERVATION_TTL_SECONDS are expired by a background sweeper that puts the
+units back on sale. A TTL index then removes closed reservations after
+RESERVATION_RETENTION_SECONDS.
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException
+from database import (
+    get_sweet_by_id, hold_sweet_stock, return_held_stock, settle_held_stock,
+    create_reservation, get_reservation, close_reservation, find_expired_reservations
+)
+from models import Reserve, CurrentUser, MessageResponse
+from config import RESERVATION_TTL_SECONDS, RESERVATION_SWEEP_INTERVAL_SECONDS, RESERVATION_SWEEP_BATCH
+import catalog_cache
+import ledger
+
+logger = logging.getLogger(__name__)
+
+# How long shutdown waits for a sweep in progress
+STOP_TIMEOUT_SECONDS = 5
+
+_sweeper = None
+# Set while stop_sweeper() waits, in case the cancellation is swallowed
+_stopping = False
+
+async def reserve(sweet_id: str, request: Reserve, current_user: CurrentUser) -> dict:
+    sweet = await hold_sweet_stock(sweet_id, request.quantity)
+    if not sweet:
+        if not await get_sweet_by_id(sweet_id):
+            raise HTTPException(status_code=404, detail="Sweet not found")
+        raise HTTPException(status_code=400, detail="Not enough stock")
+
+    now = datetime.utcnow()
+    reservation = {
+        "sweet_id": sweet["_id"],
+        "username": current_user.username,
+        "quantity": request.quantity,
+        "status": "held",
+        "created_at": now,
+        "expires_at": now + timedelta(seconds=RESERVATION_TTL_SECONDS)
+    }
+    try:
+        result = await create_reservation(reservation)
+    except Exception:
+        # Without a reservation document nothing would ever release the hold
+        await return_held_stock(sweet["_id"], request.quantity)
+        raise
+    catalog_cache.invalidate()
+
+    return {
+        "id": str(result.inserted_id),
+        "sweet_id": sweet_id,
+        "quantity": request.quantity,
+        "status": "held",
+        "expires_at": reservation["expires_at"]
+    }
+
+async def commit(reservation_id: str, current_user: CurrentUser) -> MessageResponse:
+    reservation = await _close_own(reservation_id, "committed", current_user)
+    sweet = await settle_held_stock(reservation["sweet_id"], reservation["quantity"])
+    catalog_cache.invalidate()
+    if sweet:
+        await ledger.record("purchase", sweet, -reservation["quantity"], current_user.username)
+    return MessageResponse(message=f"Successfully purchased {reservation['quantity']} reserved item(s)")
+
+async def release(reservation_id: str, current_user: CurrentUser) -> MessageResponse:
+    reservation = await _close_own(reservation_id, "released", current_user)
+    await return_held_stock(reservation["sweet_id"], reservation["quantity"])
+    catalog_cache.invalidate()
+    return MessageResponse(message=f"Released {reservation['quantity']} reserved item(s)")
+
+async def _close_own(reservation_id: str, status: str, current_user: CurrentUser) -> dict:
+    """Claim the caller's unexpired held reservation, or raise why not"""
+    try:
+        query = {"_id": ObjectId(reservation_id), "username": current_user.username}
+    except InvalidId:
+        raise HTTPException(status_code=404, detail="Reservation not found")
+
+    now = datetime.utcnow()
+    reservation = await close_reservation({**query, "expires_at": {"$gt": now}}, status, now)
+    if reservation:
+        return reservation
+
+    # Only the failure path reads again, to say why
+    reservation = await get_reservation(reservation_id)
+    if not reservation or reservation["username"] != current_user.username:
+        raise HTTPException(status_code=404, detail="Reservation not found")
+    if reservation["status"] == "held":
+        # Past its expiry but not swept yet; expire it now
+        await _expire(reservation["_id"], now)
+        raise HTTPException(status_code=410, detail="Reservation expired")
+    raise HTTPException(status_code=409, detail=f"Reservation already {reservation['status']}")
+
+async def _expire(reservation_id: ObjectId, now: datetime) -> bool:
+    reservation = await close_reservation(
+        {"_id": reservation_id, "expires_at": {"$lte": now}}, "expired", now
+    )
+    if not reservation:
+        return False
+    await return_held_stock(reservation["sweet_id"], reservation["quantity"])
+    return True
+
+async def sweep_expired() -> int:
+    """Return stock from expired reservations; safe to run in every worker"""
+    now = datetime.utcnow()
+    expired = 0
+    for reservation in await find_expired_reservations(now, RESERVATION_SWEEP_BATCH):
+        if await _expire(reservation["_id"], now):
+            expired += 1
+    if expired:
+        catalog_cache.invalidate()
+    return expired
+
+async def _sweep_forever():
+    while True:
+        try:
+            # A full batch means there may be more waiting; go again straight away
+            if await sweep_expired() >= RESERVATION_SWEEP_BATCH:
+                continue
+        except Exception:
+            if _stopping:
+                # pymongo can turn cancel() into an error mid server selection
+                return
+            logger.exception("Reservation sweep failed")
+        await asyncio.sleep(RESERVATION_SWEEP_INTERVAL_SECONDS)
+
+def _sweeper_running() -> bool:
+    return (_sweeper is not None and not _sweeper.done()
+            and _sweeper.get_loop() is asyncio.get_running_loop())
+
+def start_sweeper():
+    global _sweeper, _stopping
+    if not _sweeper_running():
+        _stopping = False
+        _sweeper = asyncio.create_task(_sweep_forever())
+
+async def stop_sweeper():
+    global _sweeper, _stopping
+    if _sweeper_running():
+        _stopping = True
+        _sweeper.cancel()
+        # A sweep waiting on server selection only notices once that times
+        # out; don't hold up shutdown for it
+        done, _ = await asyncio.wait({_sweeper}, timeout=STOP_TIMEOUT_SECONDS)
+        if not done:
+            logger.warning("Reservation sweeper still stopping after %ss; leaving it", STOP_TIMEOUT_SECONDS)
+        _sweeper = None
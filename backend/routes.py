@@ -1,69 +1,243 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from models import User, UserLogin, Sweet, Purchase, Restock, Category, CategoryUpdate
-from auth import register_user, login_user, get_current_user
-from sweets import get_all_sweets, create_sweet, update_sweet, delete_sweet, purchase_sweet, restock_sweet
-from categories import get_categories, get_category, create_new_category, update_existing_category, delete_existing_category, get_category_sweets
+from models import (
+    User, UserLogin, CurrentUser, RoleUpdate, Sweet, SweetOut, SweetPage, LowStockPage, SweetSuggestion, Purchase, Restock, Reserve, ReservationOut, StockMovement,
+    Category, CategoryOut, CategoryWithSweets, CategoryStats, CategoryUpdate, MessageResponse
+)
+from auth import register_user, login_user, get_current_user, set_user_role
+from typing import List, Optional, Union
+from sweets import get_sweets_listing, stream_sweets, search_sweets, list_low_stock, get_sweet, create_sweet, update_sweet, delete_sweet, purchase_sweet, restock_sweet, get_sweet_movements
+from catalog_cache import etag_matches, version_etag
+import reservations
+import idempotency
+from catalog_io import import_sweets, export_sweets, resolve_format, FORMATS
+from categories import get_categories, get_category_stats, get_category, create_new_category, update_existing_category, delete_existing_category, get_category_sweets, stream_category_sweets
 
 router = APIRouter()
 security = HTTPBearer()
 
-def get_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+async def get_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     return get_current_user(credentials.credentials)
 
 @router.post("/auth/register")
-def register(user: User):
-    return register_user(user)
+async def register(user: User):
+    return await register_user(user)
 
 @router.post("/auth/login")
-def login(user: UserLogin):
-    return login_user(user)
-
-@router.get("/sweets")
-def get_sweets():
-    return get_all_sweets()
-
-@router.post("/sweets")
-def add_sweet(sweet: Sweet, current_user: str = Depends(get_user)):
-    return create_sweet(sweet, current_user)
-
-@router.put("/sweets/{sweet_id}")
-def update_sweet_route(sweet_id: str, sweet: Sweet, current_user: str = Depends(get_user)):
-    return update_sweet(sweet_id, sweet, current_user)
-
-@router.delete("/sweets/{sweet_id}")
-def delete_sweet_route(sweet_id: str, current_user: str = Depends(get_user)):
-    return delete_sweet(sweet_id, current_user)
-
-@router.post("/sweets/{sweet_id}/purchase")
-def purchase_sweet_route(sweet_id: str, purchase: Purchase, current_user: str = Depends(get_user)):
-    return purchase_sweet(sweet_id, purchase, current_user)
-
-@router.post("/sweets/{sweet_id}/restock")
-def restock_sweet_route(sweet_id: str, restock: Restock, current_user: str = Depends(get_user)):
-    return restock_sweet(sweet_id, restock, current_user)
+async def login(user: UserLogin):
+    return await login_user(user)
+
+@router.put("/auth/users/{username}/role")
+async def update_user_role(username: str, role: RoleUpdate, current_user: CurrentUser = Depends(get_user)):
+    return await set_user_role(username, role.is_admin, current_user)
+
+@router.get("/sweets", response_model=Union[SweetPage, List[SweetOut]])
+async def get_sweets(
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, description="Page size (capped by SWEETS_MAX_PAGE_SIZE)"),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from the previous page's next_cursor"),
+    sort: Optional[str] = Query(None, description="Sort key: name, price or quantity; prefix with '-' for descending"),
+    name: Optional[str] = Query(None, description="Filter by name prefix"),
+    category: Optional[str] = Query(None, description="Filter by category"),
+    min_price: Optional[float] = Query(None, ge=0, description="Minimum price"),
+    max_price: Optional[float] = Query(None, ge=0, description="Maximum price"),
+    in_stock: Optional[bool] = Query(None, description="Only sweets with (true) or without (false) stock"),
+    legacy: bool = Query(False, description="Return the full unpaginated list for older clients"),
+    stream: Optional[str] = Query(None, pattern="^(ndjson|json)$", description="Stream the full filtered listing as NDJSON or a JSON array")
+):
+    if stream:
+        return stream_sweets(stream, sort, name, category, min_price, max_price, in_stock)
+    
+    params = {
+        "limit": limit, "cursor": cursor, "sort": sort, "name": name, "category": category,
+        "min_price": min_price, "max_price": max_price, "in_stock": in_stock, "legacy": legacy
+    }
+    # Browsers revalidate with If-None-Match; an unchanged listing costs no body,
+    # and no query while it is cached
+    headers = {"Cache-Control": "no-cache"}
+    etag, sweets = await get_sweets_listing(params)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag, **headers})
+    
+    response.headers.update({"ETag": etag, **headers})
+    return sweets
+
+@router.get("/sweets/search", response_model=List[SweetSuggestion])
+async def search_sweets_route(
+    q: str = Query(..., min_length=1, description="What the user has typed so far"),
+    limit: int = Query(10, ge=1, description="Maximum number of suggestions")
+):
+    return await search_sweets(q, limit)
+
+@router.get("/sweets/low-stock", response_model=LowStockPage)
+async def low_stock_route(
+    threshold: Optional[int] = Query(None, ge=0, description="Quantity at or below which a sweet counts as low; defaults to each sweet's reorder_threshold"),
+    limit: Optional[int] = Query(None, ge=1, description="Page size (capped by SWEETS_MAX_PAGE_SIZE)"),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from the previous page's next_cursor"),
+    current_user: CurrentUser = Depends(get_user)
+):
+    return await list_low_stock(threshold, limit, cursor, current_user)
+
+@router.post("/sweets/import")
+async def import_sweets_route(
+    request: Request,
+    format: Optional[str] = Query(None, description="ndjson or csv; defaults from Content-Type"),
+    current_user: CurrentUser = Depends(get_user)
+):
+    body_format = resolve_format(format, request.headers.get("content-type"))
+    return await import_sweets(request.stream(), body_format, current_user)
+
+@router.get("/sweets/export")
+async def export_sweets_route(
+    format: str = Query("ndjson", description="ndjson or csv"),
+    current_user: CurrentUser = Depends(get_user)
+):
+    body_format = resolve_format(format)
+    rows = await export_sweets(body_format, current_user)
+    return StreamingResponse(
+        rows,
+        media_type=FORMATS[body_format],
+        headers={"Content-Disposition": f"attachment; filename=sweets.{body_format}"}
+    )
+
+@router.post("/sweets", response_model=MessageResponse)
+async def add_sweet(sweet: Sweet, current_user: CurrentUser = Depends(get_user)):
+    return await create_sweet(sweet, current_user)
+
+# Registered after the literal /sweets/... paths so it doesn't shadow them
+@router.get("/sweets/{sweet_id}", response_model=SweetOut)
+async def get_sweet_route(sweet_id: str, request: Request, response: Response):
+    sweet = await get_sweet(sweet_id)
+    etag = version_etag(sweet.get("version", 0))
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return sweet
+
+@router.put("/sweets/{sweet_id}", response_model=SweetOut)
+async def update_sweet_route(
+    sweet_id: str,
+    sweet: Sweet,
+    response: Response,
+    current_user: CurrentUser = Depends(get_user),
+    if_match: Optional[str] = Header(None, description="ETag from a previous read; 412 if the sweet changed since")
+):
+    updated = await update_sweet(sweet_id, sweet, current_user, if_match)
+    response.headers["ETag"] = version_etag(updated["version"])
+    return updated
+
+@router.delete("/sweets/{sweet_id}", response_model=MessageResponse)
+async def delete_sweet_route(sweet_id: str, current_user: CurrentUser = Depends(get_user)):
+    return await delete_sweet(sweet_id, current_user)
+
+@router.post("/sweets/{sweet_id}/purchase", response_model=MessageResponse)
+async def purchase_sweet_route(
+    sweet_id: str,
+    purchase: Purchase,
+    response: Response,
+    current_user: CurrentUser = Depends(get_user),
+    idempotency_key: Optional[str] = Header(None, max_length=255, description="Retries with the same key replay the first outcome")
+):
+    return await idempotency.run(
+        idempotency_key, current_user.username, f"purchase {sweet_id}", purchase.model_dump(),
+        lambda: purchase_sweet(sweet_id, purchase, current_user), response
+    )
+
+@router.post("/sweets/{sweet_id}/restock", response_model=MessageResponse)
+async def restock_sweet_route(
+    sweet_id: str,
+    restock: Restock,
+    response: Response,
+    current_user: CurrentUser = Depends(get_user),
+    idempotency_key: Optional[str] = Header(None, max_length=255, description="Retries with the same key replay the first outcome")
+):
+    return await idempotency.run(
+        idempotency_key, current_user.username, f"restock {sweet_id}", restock.model_dump(),
+        lambda: restock_sweet(sweet_id, restock, current_user), response
+    )
+
+@router.post("/sweets/{sweet_id}/reserve", response_model=ReservationOut)
+async def reserve_sweet_route(sweet_id: str, request: Reserve, current_user: CurrentUser = Depends(get_user)):
+    return await reservations.reserve(sweet_id, request, current_user)
+
+@router.post("/reservations/{reservation_id}/commit", response_model=MessageResponse)
+async def commit_reservation_route(reservation_id: str, current_user: CurrentUser = Depends(get_user)):
+    return await reservations.commit(reservation_id, current_user)
+
+@router.post("/reservations/{reservation_id}/release", response_model=MessageResponse)
+async def release_reservation_route(reservation_id: str, current_user: CurrentUser = Depends(get_user)):
+    return await reservations.release(reservation_id, current_user)
+
+@router.get("/sweets/{sweet_id}/movements", response_model=List[StockMovement])
+async def get_sweet_movements_route(
+    sweet_id: str,
+    limit: int = Query(50, ge=1, le=500, description="Most recent entries to return"),
+    current_user: CurrentUser = Depends(get_user)
+):
+    return await get_sweet_movements(sweet_id, limit, current_user)
 
 # Category routes
-@router.get("/categories")
-def get_categories_route(active_only: bool = Query(False, description="Filter only active categories")):
-    return get_categories(active_only)
-
-@router.get("/categories/{category_id}")
-def get_category_route(category_id: str):
-    return get_category(category_id)
-
-@router.post("/categories")
-def create_category_route(category: Category, current_user: str = Depends(get_user)):
-    return create_new_category(category)
-
-@router.put("/categories/{category_id}")
-def update_category_route(category_id: str, category_update: CategoryUpdate, current_user: str = Depends(get_user)):
-    return update_existing_category(category_id, category_update)
-
-@router.delete("/categories/{category_id}")
-def delete_category_route(category_id: str, current_user: str = Depends(get_user)):
-    return delete_existing_category(category_id)
-
-@router.get("/categories/{category_id}/sweets")
-def get_category_sweets_route(category_id: str):
-    return get_category_sweets(category_id)
+@router.get("/categories", response_model=Union[List[CategoryWithSweets], List[CategoryOut]])
+async def get_categories_route(
+    active_only: bool = Query(False, description="Filter only active categories"),
+    include: Optional[str] = Query(None, pattern="^sweets$", description="Set to 'sweets' to embed each category's sweets"),
+    sweets_limit: Optional[int] = Query(None, ge=1, description="Sweets embedded per category (capped by CATEGORY_SWEETS_MAX_LIMIT)")
+):
+    return await get_categories(active_only, include == "sweets", sweets_limit)
+
+@router.get("/categories/stats", response_model=List[CategoryStats])
+async def get_category_stats_route():
+    return await get_category_stats()
+
+@router.get("/categories/{category_id}", response_model=Union[CategoryWithSweets, CategoryOut])
+async def get_category_route(
+    category_id: str,
+    request: Request,
+    response: Response,
+    include: Optional[str] = Query(None, pattern="^sweets$", description="Set to 'sweets' to embed the category's sweets"),
+    sweets_limit: Optional[int] = Query(None, ge=1, description="Sweets to embed (capped by CATEGORY_SWEETS_MAX_LIMIT)")
+):
+    category = await get_category(category_id, include == "sweets", sweets_limit)
+    if include != "sweets":
+        # Embedded sweets aren't covered by the category's version
+        etag = version_etag(category.get("version", 0))
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        response.headers["ETag"] = etag
+    return category
+
+@router.post("/categories", response_model=CategoryOut)
+async def create_category_route(category: Category, current_user: CurrentUser = Depends(get_user)):
+    return await create_new_category(category)
+
+@router.put("/categories/{category_id}", response_model=CategoryOut)
+async def update_category_route(
+    category_id: str,
+    category_update: CategoryUpdate,
+    response: Response,
+    current_user: CurrentUser = Depends(get_user),
+    if_match: Optional[str] = Header(None, description="ETag from a previous read; 412 if the category changed since")
+):
+    category = await update_existing_category(category_id, category_update, if_match)
+    response.headers["ETag"] = version_etag(category["version"])
+    return category
+
+@router.delete("/categories/{category_id}", response_model=MessageResponse)
+async def delete_category_route(
+    category_id: str,
+    policy: Optional[str] = Query(None, pattern="^(block|reassign|cascade)$", description="What to do with the category's sweets (default CATEGORY_DELETE_POLICY)"),
+    reassign_to: Optional[str] = Query(None, min_length=1, description="Category to move the sweets to with policy=reassign (default CATEGORY_REASSIGN_TO)"),
+    current_user: CurrentUser = Depends(get_user)
+):
+    return await delete_existing_category(category_id, policy, reassign_to)
+
+@router.get("/categories/{category_id}/sweets", response_model=List[SweetOut])
+async def get_category_sweets_route(
+    category_id: str,
+    stream: Optional[str] = Query(None, pattern="^(ndjson|json)$", description="Stream the sweets as NDJSON or a JSON array")
+):
+    if stream:
+        return await stream_category_sweets(category_id, stream)
+    return await get_category_sweets(category_id)
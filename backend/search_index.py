@@ -0,0 +1,174 @@
+"""
+In-memory type-ahead index over sweet names and categories
+
+Every word of a sweet's name and category goes into a sorted token list, so
+a prefix lookup is a bisect plus a short scan. Name trigrams cover matches in
+the middle of a word. The index is built from the database at startup and
+then updated incrementally by the write paths in sweets.py. Writes made by
+other worker processes are picked up by a background rebuild once the index
+is older than SEARCH_INDEX_MAX_AGE_SECONDS.
+"""
+
+import asyncio
+import bisect
+import re
+import time
+from database import iter_sweets
+from config import SEARCH_INDEX_MAX_AGE_SECONDS
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+_docs = {}       # id -> (name, category, words, normalized name)
+_tokens = []     # sorted (token, id) pairs
+_trigrams = {}   # trigram -> set of ids
+_built_at = None
+_rebuild_task = None
+# Bumped by invalidate() so a rebuild that started before it doesn't swap in its scan
+_generation = 0
+# Edits made while a rebuild is scanning, replayed onto the new index
+_journal = None
+
+def _normalize(text: str) -> str:
+    return " ".join(_WORD.findall(text.lower()))
+
+def _words(name: str, category: str) -> set:
+    return set(_WORD.findall(name.lower())) | set(_WORD.findall(category.lower()))
+
+def _name_trigrams(name: str) -> set:
+    text = _normalize(name)
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def upsert(sweet_id: str, name: str, category: str):
+    if _journal is not None:
+        _journal.append((upsert, sweet_id, name, category))
+    _remove(sweet_id)
+    words = _words(name, category)
+    _docs[sweet_id] = (name, category, words, _normalize(name))
+    for word in words:
+        bisect.insort(_tokens, (word, sweet_id))
+    for trigram in _name_trigrams(name):
+        _trigrams.setdefault(trigram, set()).add(sweet_id)
+
+def remove(sweet_id: str):
+    if _journal is not None:
+        _journal.append((remove, sweet_id))
+    _remove(sweet_id)
+
+def _remove(sweet_id: str):
+    doc = _docs.pop(sweet_id, None)
+    if doc is None:
+        return
+    name, category, words, _ = doc
+    for word in words:
+        index = bisect.bisect_left(_tokens, (word, sweet_id))
+        if index < len(_tokens) and _tokens[index] == (word, sweet_id):
+            del _tokens[index]
+    for trigram in _name_trigrams(name):
+        ids = _trigrams.get(trigram)
+        if ids is not None:
+            ids.discard(sweet_id)
+            if not ids:
+                del _trigrams[trigram]
+
+async def rebuild():
+    """Reload the whole index from the database; use refresh() to avoid overlapping rebuilds"""
+    global _docs, _tokens, _trigrams, _built_at, _journal
+    try:
+        while True:
+            generation = _generation
+            docs, pairs, trigrams = {}, [], {}
+            _journal = []
+            async for sweet in iter_sweets({"name": 1, "category": 1}):
+                sweet_id = str(sweet["_id"])
+                name, category = sweet.get("name", ""), sweet.get("category", "")
+                words = _words(name, category)
+                docs[sweet_id] = (name, category, words, _normalize(name))
+                pairs.extend((word, sweet_id) for word in words)
+                for trigram in _name_trigrams(name):
+                    trigrams.setdefault(trigram, set()).add(sweet_id)
+            # invalidate() during the scan means rows already read may be stale; scan again
+            if generation == _generation:
+                break
+        pairs.sort()
+        # Swap in one step so concurrent searches never see a half-built index
+        _docs, _tokens, _trigrams, _built_at = docs, pairs, trigrams, time.monotonic()
+        journal = _journal
+    finally:
+        _journal = None
+    for edit, *args in journal:
+        edit(*args)
+
+def invalidate():
+    """Drop the index and make any rebuild in progress scan again; the next search rebuilds it"""
+    global _docs, _tokens, _trigrams, _built_at, _generation
+    _docs, _tokens, _trigrams, _built_at = {}, [], {}, None
+    _generation += 1
+
+def refresh() -> asyncio.Task:
+    """Start a background rebuild unless one is already running"""
+    global _rebuild_task
+    if _rebuild_task is None or _rebuild_task.done():
+        _rebuild_task = asyncio.create_task(rebuild())
+    return _rebuild_task
+
+def _rank(sweet_id: str, query: str) -> tuple:
+    name, _, _, normalized = _docs[sweet_id]
+    # Whole-name prefix first, then word prefix, then everything else
+    if normalized.startswith(query):
+        tier = 0
+    elif (" " + query) in normalized:
+        tier = 1
+    else:
+        tier = 2
+    return tier, len(name), normalized
+
+def _prefix_matches(query: str, budget: int) -> set:
+    *other_words, last_word = query.split()
+    other_words = set(other_words)
+    matches = set()
+    index = bisect.bisect_left(_tokens, (last_word, ""))
+    # Cap the scan so rare multi-word combinations can't walk a huge posting range
+    end = min(len(_tokens), index + budget * 10)
+    while index < end and len(matches) < budget:
+        token, sweet_id = _tokens[index]
+        if not token.startswith(last_word):
+            break
+        # Earlier words of a multi-word query must match whole words of the sweet
+        if sweet_id not in matches and other_words <= _docs[sweet_id][2]:
+            matches.add(sweet_id)
+        index += 1
+    return matches
+
+def _substring_matches(query: str, exclude: set, budget: int) -> set:
+    grams = [query[i:i + 3] for i in range(len(query) - 2)]
+    if not grams:
+        return set()
+    # Walk the rarest trigram's postings and verify, rather than intersecting every set
+    rarest = min((_trigrams.get(gram, set()) for gram in grams), key=len)
+    matches = set()
+    for sweet_id in rarest:
+        if sweet_id not in exclude and query in _docs[sweet_id][3]:
+            matches.add(sweet_id)
+            if len(matches) >= budget:
+                break
+    return matches
+
+async def search(q: str, limit: int = 10) -> list:
+    """Top `limit` sweets whose name or category matches `q` as you type"""
+    if _built_at is None:
+        await refresh()
+    elif time.monotonic() - _built_at > SEARCH_INDEX_MAX_AGE_SECONDS:
+        refresh()
+    
+    query = _normalize(q)
+    if not query:
+        return []
+    
+    # Collect a few more candidates than needed so ranking has something to choose from
+    budget = limit * 5
+    matches = _prefix_matches(query, budget)
+    if len(matches) < limit and len(query) >= 3:
+        matches |= _substring_matches(query, matches, budget - len(matches))
+    
+    ranked = sorted(matches, key=lambda sweet_id: _rank(sweet_id, query))[:limit]
+    return [{"id": sweet_id, "name": _docs[sweet_id][0], "category": _docs[sweet_id][1]} for sweet_id in ranked]
@@ -4,12 +4,14 @@ Easy to understand implementation
 """
 
 from fastapi import HTTPException
-from database import get_all_categories, get_category_by_name, create_category
+from pymongo.errors import DuplicateKeyError
+from database import get_all_categories, create_category
 from datetime import datetime
+import catalog_cache
 
-def get_categories():
+async def get_categories():
     """Get all categories - simple function"""
-    categories = get_all_categories()
+    categories = await get_all_categories()
     # Convert ObjectId to string for JSON serialization
     for category in categories:
         if '_id' in category:
@@ -17,19 +19,18 @@ def get_categories():
             del category['_id']
     return categories
 
-def create_new_category(category_data):
+async def create_new_category(category_data):
     """Create a new category - simple function"""
-    # Check if category already exists
-    existing = get_category_by_name(category_data["name"])
-    if existing:
-        raise HTTPException(status_code=400, detail="Category with this name already exists")
-    
     # Add timestamp
     category_data["created_at"] = datetime.utcnow()
     category_data["is_active"] = True
     
-    # Save to database
-    result = create_category(category_data)
+    # Save to database (the unique index on name rejects duplicates)
+    try:
+        result = await create_category(category_data)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Category with this name already exists")
+    catalog_cache.invalidate()
     
     # Return the created category with ID (convert ObjectId to string)
     response_data = {
@@ -10,11 +10,11 @@ from simple_categories import get_categories, create_new_category
 router = APIRouter()
 
 @router.get("/categories")
-def get_categories_route():
+async def get_categories_route():
     """Get all categories - simple endpoint"""
-    return get_categories()
+    return await get_categories()
 
 @router.post("/categories")
-def create_category_route(category_data: dict):
+async def create_category_route(category_data: dict):
     """Create a new category - simple endpoint"""
-    return create_new_category(category_data)
+    return await create_new_category(category_data)
@@ -0,0 +1,52 @@
+"""
+Streaming JSON responses straight from a Mongo cursor
+
+Documents are serialized as the cursor yields them instead of being
+collected into a list first, so a large listing runs in memory bounded by
+the cursor batch and STREAM_CHUNK_BYTES, and the first bytes go out as soon
+as the first document arrives.
+"""
+
+import orjson
+from bson import ObjectId
+from fastapi.responses import StreamingResponse
+from config import STREAM_CHUNK_BYTES
+
+STREAM_FORMATS = {"ndjson": "application/x-ndjson", "json": "application/json"}
+
+def _default(value):
+    # orjson handles datetimes natively; ObjectIds are the only other BSON type we store
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError
+
+def _encode(document: dict) -> bytes:
+    if "_id" in document:
+        document["id"] = str(document.pop("_id"))
+    return orjson.dumps(document, default=_default)
+
+async def _serialize(cursor, format: str):
+    if format == "json":
+        opening, separator, closing = b"[", b",", b"]"
+    else:
+        opening, separator, closing = b"", b"", b""
+    terminator = b"\n" if format == "ndjson" else b""
+    
+    buffer = bytearray(opening)
+    first = True
+    async for document in cursor:
+        if not first:
+            buffer += separator
+        buffer += _encode(document) + terminator
+        # Flush the first document right away, then in STREAM_CHUNK_BYTES chunks
+        if first or len(buffer) >= STREAM_CHUNK_BYTES:
+            yield bytes(buffer)
+            buffer.clear()
+        first = False
+    buffer += closing
+    if buffer:
+        yield bytes(buffer)
+
+def stream_cursor(cursor, format: str) -> StreamingResponse:
+    """Wrap a cursor in a StreamingResponse as NDJSON or a JSON array"""
+    return StreamingResponse(_serialize(cursor, format), media_type=STREAM_FORMATS[format])
@@ -1,80 +1,231 @@
 from fastapi import HTTPException
+from pymongo.errors import DuplicateKeyError
 from datetime import datetime
-from database import get_all_sweets as db_get_all_sweets, get_sweet_by_id, get_sweet_by_name, create_sweet as db_create_sweet, update_sweet as db_update_sweet, delete_sweet as db_delete_sweet, update_sweet_quantity
-from models import Sweet, MessageResponse, Purchase, Restock
+from bson import ObjectId
+from bson.errors import InvalidId
+import base64
+import binascii
+import json
+from database import get_all_sweets as db_get_all_sweets, find_sweets, sweets_cursor, build_sweet_filters, SWEET_SORT_FIELDS, get_sweet_by_id, SWEET_FIELDS, create_sweet as db_create_sweet, update_sweet as db_update_sweet, delete_sweet as db_delete_sweet, increment_sweet_stock, decrement_sweet_stock, get_stock_movements, low_stock_cursor
+from models import Sweet, MessageResponse, Purchase, Restock, CurrentUser
 from auth import is_admin
+import catalog_cache
+import search_index
+import ledger
+import idempotency
+from streaming import stream_cursor
+from config import SWEETS_PAGE_SIZE, SWEETS_MAX_PAGE_SIZE, SEARCH_MAX_RESULTS
 
-def get_all_sweets() -> list:
-    return db_get_all_sweets()
+async def get_all_sweets() -> list:
+    return await db_get_all_sweets()
 
-def create_sweet(sweet: Sweet, current_user: str) -> MessageResponse:
-    if not is_admin(current_user):
+def _parse_sort(sort: str):
+    """Turn `price` / `-price` into (field, descending)"""
+    if not sort:
+        return "_id", False
+    descending = sort.startswith("-")
+    field = sort.lstrip("-")
+    if field not in SWEET_SORT_FIELDS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid sort key. Use one of: {', '.join(SWEET_SORT_FIELDS)} (prefix with '-' for descending)"
+        )
+    return field, descending
+
+def _encode_cursor(sort: str, sweet: dict, sort_field: str) -> str:
+    # Legacy documents may lack the sort field; Mongo sorts them as null
+    value = sweet["id"] if sort_field == "_id" else sweet.get(sort_field)
+    payload = json.dumps({"s": sort or "", "v": value, "id": sweet["id"]}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def _decode_cursor(cursor: str, sort: str, sort_field: str) -> tuple:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        last_id = ObjectId(payload["id"])
+        last_value = last_id if sort_field == "_id" else payload["v"]
+    except (binascii.Error, ValueError, KeyError, TypeError, InvalidId):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if payload.get("s", "") != (sort or ""):
+        raise HTTPException(status_code=400, detail="Cursor does not match the requested sort")
+    return last_value, last_id
+
+async def list_sweets(limit: int = None, cursor: str = None, sort: str = None, name: str = None,
+                category: str = None, min_price: float = None, max_price: float = None,
+                in_stock: bool = None, legacy: bool = False):
+    """List sweets with filters and keyset pagination.
+
+    Returns `{"items": [...], "next_cursor": ...}`; with `legacy` the bare,
+    unpaginated list is returned instead, as older clients expect.
+    """
+    sort_field, descending = _parse_sort(sort)
+    filters = build_sweet_filters(name, category, min_price, max_price, in_stock)
+
+    if legacy:
+        return await find_sweets(filters, sort_field, descending)
+
+    limit = min(limit or SWEETS_PAGE_SIZE, SWEETS_MAX_PAGE_SIZE)
+    after = _decode_cursor(cursor, sort, sort_field) if cursor else None
+
+    # Fetch one extra document to learn whether another page exists
+    sweets = await find_sweets(filters, sort_field, descending, limit + 1, after)
+    next_cursor = None
+    if len(sweets) > limit:
+        sweets = sweets[:limit]
+        next_cursor = _encode_cursor(sort, sweets[-1], sort_field)
+
+    return {"items": sweets, "next_cursor": next_cursor}
+
+async def list_low_stock(threshold: int = None, limit: int = None, cursor: str = None,
+                         current_user: CurrentUser = None):
+    """Sweets due for restocking, most urgent first, with keyset pagination.
+
+    Without `threshold` each sweet is compared with its own reorder_threshold
+    via the partial index on stock_headroom; with it, the (quantity, _id)
+    index is used. Either way only low-stock sweets are read.
+    """
+    if not await is_admin(current_user):
         raise HTTPException(status_code=403, detail="Not enough permissions")
     
-    if get_sweet_by_name(sweet.name):
-        raise HTTPException(status_code=400, detail="Sweet already exists")
+    sort_field = "stock_headroom" if threshold is None else "quantity"
+    limit = min(limit or SWEETS_PAGE_SIZE, SWEETS_MAX_PAGE_SIZE)
+    after = _decode_cursor(cursor, sort_field, sort_field) if cursor else None
+    
+    sweets = await low_stock_cursor(threshold, limit + 1, after).to_list(None)
+    next_cursor = None
+    if len(sweets) > limit:
+        sweets = sweets[:limit]
+        next_cursor = _encode_cursor(sort_field, sweets[-1], sort_field)
+    
+    return {"items": sweets, "next_cursor": next_cursor}
+
+def stream_sweets(format: str, sort: str = None, name: str = None, category: str = None,
+                  min_price: float = None, max_price: float = None, in_stock: bool = None):
+    """The full filtered listing, serialized straight from the cursor"""
+    sort_field, descending = _parse_sort(sort)
+    filters = build_sweet_filters(name, category, min_price, max_price, in_stock)
+    return stream_cursor(sweets_cursor(filters, sort_field, descending), format)
+
+async def get_sweets_listing(params: dict) -> tuple:
+    """list_sweets through the catalog cache; returns (etag, payload)"""
+    return await catalog_cache.get_or_load(catalog_cache.make_key(params), lambda: list_sweets(**params))
+
+async def search_sweets(q: str, limit: int) -> list:
+    return await search_index.search(q, min(limit, SEARCH_MAX_RESULTS))
+
+async def create_sweet(sweet: Sweet, current_user: CurrentUser) -> MessageResponse:
+    if not await is_admin(current_user):
+        raise HTTPException(status_code=403, detail="Not enough permissions")
     
     sweet_data = {
         "name": sweet.name,
         "category": sweet.category,
         "price": sweet.price,
         "quantity": sweet.quantity,
+        "reorder_threshold": sweet.reorder_threshold,
         "created_at": datetime.utcnow()
     }
     
-    db_create_sweet(sweet_data)
+    # The unique index on name rejects duplicates without a pre-read
+    try:
+        result = await db_create_sweet(sweet_data)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Sweet already exists")
+    catalog_cache.invalidate()
+    search_index.upsert(str(result.inserted_id), sweet.name, sweet.category)
     return MessageResponse(message="Sweet added successfully")
 
-def update_sweet(sweet_id: str, sweet: Sweet, current_user: str) -> MessageResponse:
-    if not is_admin(current_user):
-        raise HTTPException(status_code=403, detail="Not enough permissions")
-    
-    existing_sweet = get_sweet_by_id(sweet_id)
-    if not existing_sweet:
+async def get_sweet(sweet_id: str) -> dict:
+    try:
+        sweet = await get_sweet_by_id(sweet_id, SWEET_FIELDS)
+    except InvalidId:
+        sweet = None
+    if not sweet:
         raise HTTPException(status_code=404, detail="Sweet not found")
+    return sweet
+
+async def update_sweet(sweet_id: str, sweet: Sweet, current_user: CurrentUser, if_match: str = None) -> dict:
+    """Replace a sweet's fields and return it; with If-Match, only if it is still at that version"""
+    if not await is_admin(current_user):
+        raise HTTPException(status_code=403, detail="Not enough permissions")
     
     update_data = {
         "name": sweet.name,
         "category": sweet.category,
         "price": sweet.price,
         "quantity": sweet.quantity,
+        "reorder_threshold": sweet.reorder_threshold,
         "updated_at": datetime.utcnow()
     }
     
-    result = db_update_sweet(sweet_id, update_data)
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Sweet not found")
+    versions = catalog_cache.if_match_versions(if_match)
+    try:
+        updated = await db_update_sweet(sweet_id, update_data, versions)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Sweet already exists")
+    if not updated:
+        # Only the failure path reads again, to tell 404, 409 and 412 apart
+        current = await get_sweet_by_id(sweet_id, {"quantity": 1, "reserved": 1})
+        if not current:
+            raise HTTPException(status_code=404, detail="Sweet not found")
+        if current.get("reserved", 0) > 0 and current.get("quantity") != sweet.quantity:
+            raise HTTPException(
+                status_code=409,
+                detail=f"{current['reserved']} units are reserved; change the quantity once they are committed or released"
+            )
+        raise HTTPException(status_code=412, detail="Sweet was changed by someone else; reload it and retry")
     
-    return MessageResponse(message="Sweet updated successfully")
+    catalog_cache.invalidate()
+    search_index.upsert(sweet_id, sweet.name, sweet.category)
+    return updated
 
-def delete_sweet(sweet_id: str, current_user: str) -> MessageResponse:
-    if not is_admin(current_user):
+async def delete_sweet(sweet_id: str, current_user: CurrentUser) -> MessageResponse:
+    if not await is_admin(current_user):
         raise HTTPException(status_code=403, detail="Not enough permissions")
     
-    result = db_delete_sweet(sweet_id)
+    result = await db_delete_sweet(sweet_id)
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Sweet not found")
     
+    catalog_cache.invalidate()
+    search_index.remove(sweet_id)
     return MessageResponse(message="Sweet deleted successfully")
 
-def purchase_sweet(sweet_id: str, purchase: Purchase, current_user: str) -> MessageResponse:
-    sweet = get_sweet_by_id(sweet_id)
-    if not sweet:
+async def purchase_sweet(sweet_id: str, purchase: Purchase, current_user: CurrentUser) -> MessageResponse:
+    if not ObjectId.is_valid(sweet_id):
         raise HTTPException(status_code=404, detail="Sweet not found")
-    
-    if sweet["quantity"] < purchase.quantity:
+    # Stock check and decrement happen in one conditional update, so concurrent
+    # buyers can never drive the quantity below zero
+    idempotency.write_started()
+    sweet = await decrement_sweet_stock(sweet_id, purchase.quantity)
+    if not sweet:
+        # Only the failure path pays for a second read, to tell 404 from 400
+        if not await get_sweet_by_id(sweet_id):
+            raise HTTPException(status_code=404, detail="Sweet not found")
         raise HTTPException(status_code=400, detail="Not enough stock")
     
-    update_sweet_quantity(sweet_id, -purchase.quantity)
+    catalog_cache.invalidate()
+    await ledger.record("purchase", sweet, -purchase.quantity, current_user.username)
     return MessageResponse(message=f"Successfully purchased {purchase.quantity} {sweet['name']}(s)")
 
-def restock_sweet(sweet_id: str, restock: Restock, current_user: str) -> MessageResponse:
-    if not is_admin(current_user):
+async def restock_sweet(sweet_id: str, restock: Restock, current_user: CurrentUser) -> MessageResponse:
+    if not await is_admin(current_user):
         raise HTTPException(status_code=403, detail="Not enough permissions")
     
-    sweet = get_sweet_by_id(sweet_id)
+    if not ObjectId.is_valid(sweet_id):
+        raise HTTPException(status_code=404, detail="Sweet not found")
+    idempotency.write_started()
+    sweet = await increment_sweet_stock(sweet_id, restock.quantity)
     if not sweet:
         raise HTTPException(status_code=404, detail="Sweet not found")
     
-    update_sweet_quantity(sweet_id, restock.quantity)
+    catalog_cache.invalidate()
+    await ledger.record("restock", sweet, restock.quantity, current_user.username)
     return MessageResponse(message=f"Successfully restocked {restock.quantity} {sweet['name']}(s)")
+
+async def get_sweet_movements(sweet_id: str, limit: int, current_user: CurrentUser) -> list:
+    """Ledger entries for one sweet, newest first (admin only)"""
+    if not await is_admin(current_user):
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    
+    return await get_stock_movements(sweet_id, limit)
@@ -2,6 +2,7 @@
 Pytest configuration and fixtures for Sweet Shop Management System tests
 """
 
+import asyncio
 import pytest
 import os
 import sys
@@ -13,14 +14,44 @@ from datetime import datetime
 # Add the backend directory to the Python path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
-from main import app
-from database import get_user_by_username, create_user
-from auth import hash_password
+import catalog_cache
+import search_index
+import rate_limit
+import idempotency
+import readiness
+
+# How long the client fixture waits for MongoDB and the indexes before giving up
+READY_TIMEOUT_SECONDS = float(os.getenv("TEST_READY_TIMEOUT_SECONDS", "30"))
+# Why MongoDB wasn't ready, once a test has waited for it in vain
+_not_ready = None
 
 @pytest.fixture
 def client():
     """Create a test client for the FastAPI application"""
-    return TestClient(app)
+    global _not_ready
+    if _not_ready:
+        # Don't make every remaining test wait out the timeout again
+        pytest.fail(_not_ready, pytrace=False)
+    # Every test starts with full rate limit buckets
+    rate_limit.reset()
+    idempotency.reset()
+    # Imported here so collecting tests that don't need the app stays cheap
+    from main import app
+    # Entering the client keeps one event loop (and Mongo client) for the whole test
+    with TestClient(app) as test_client:
+        # Indexes must exist before tests rely on them; without MongoDB the
+        # bootstrap retries forever, so fail instead of hanging the suite
+        try:
+            test_client.portal.call(readiness.wait, READY_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            _not_ready = (
+                f"MongoDB was not ready within {READY_TIMEOUT_SECONDS:g}s "
+                f"({readiness._bootstrap_error or 'still starting'}); is it running at MONGODB_URL?"
+            )
+        if not _not_ready:
+            yield test_client
+    if _not_ready:
+        pytest.fail(_not_ready, pytrace=False)
 
 @pytest.fixture
 def test_db():
@@ -35,12 +66,21 @@ def test_db():
     # Clean up before each test
     db.users.delete_many({})
     db.sweets.delete_many({})
+    db.categories.delete_many({})
+    db.stock_movements.delete_many({})
+    db.reservations.delete_many({})
+    # Tests write to the collections directly, behind the app's caches
+    catalog_cache.invalidate()
+    search_index.invalidate()
     
     yield db
     
     # Clean up after each test
     db.users.delete_many({})
     db.sweets.delete_many({})
+    db.categories.delete_many({})
+    db.stock_movements.delete_many({})
+    db.reservations.delete_many({})
     client.close()
 
 @pytest.fixture
@@ -3,6 +3,7 @@ Test cases for authentication functionality
 """
 
 import pytest
+import time
 from fastapi.testclient import TestClient
 from unittest.mock import patch, Mock
 from datetime import datetime
@@ -122,6 +123,62 @@ class TestAuthentication:
         assert user is not None
         assert user["is_admin"] == True
     
+    def test_login_token_carries_role_claim(self, client, test_db, sample_admin_data):
+        """Test that the login token is signed with the user's role"""
+        from auth import decode_token
+        
+        client.post("/api/auth/register", json=sample_admin_data)
+        response = client.post("/api/auth/login", json={
+            "username": sample_admin_data["username"],
+            "password": sample_admin_data["password"]
+        })
+        
+        payload = decode_token(response.json()["access_token"])
+        assert payload["sub"] == sample_admin_data["username"]
+        assert payload["role"] == "admin"
+    
+    def test_role_change_overrides_stale_token_claim(self, client, test_db, admin_headers, auth_headers, sample_user_data):
+        """Test that a promoted user is authorized even with a token issued before the change"""
+        sweet = {"name": "Promoted Sweet", "category": "Test", "price": 10.0, "quantity": 5}
+        assert client.post("/api/sweets", json=sweet, headers=auth_headers).status_code == 403
+        
+        response = client.put(
+            f"/api/auth/users/{sample_user_data['username']}/role",
+            json={"is_admin": True},
+            headers=admin_headers
+        )
+        assert response.status_code == 200
+        
+        assert client.post("/api/sweets", json=sweet, headers=auth_headers).status_code == 200
+    
+    def test_demotion_revokes_stale_admin_claim_in_fresh_process(self, client, test_db, admin_headers, sample_admin_data):
+        """Test that a demoted admin's old token is refused, even by a worker that didn't make the change"""
+        import auth
+        sweet = {"name": "Demoted Sweet", "category": "Test", "price": 10.0, "quantity": 5}
+        # Warm the user cache with the admin record, as a busy worker would have
+        assert client.post("/api/sweets", json=sweet, headers=admin_headers).status_code == 200
+        
+        # Another worker demotes the user
+        test_db.users.update_one(
+            {"username": sample_admin_data["username"]},
+            {"$set": {"is_admin": False, "role_changed_at": int(time.time())}}
+        )
+        # A fresh process starts with empty caches
+        auth._user_cache.clear()
+        
+        sweet["name"] = "Another Sweet"
+        assert client.post("/api/sweets", json=sweet, headers=admin_headers).status_code == 403
+    
+    def test_role_change_requires_admin(self, client, test_db, auth_headers, sample_user_data):
+        """Test that regular users cannot change roles"""
+        response = client.put(
+            f"/api/auth/users/{sample_user_data['username']}/role",
+            json={"is_admin": True},
+            headers=auth_headers
+        )
+        
+        assert response.status_code == 403
+    
     def test_password_hashing(self):
         """Test password hashing functionality"""
         from auth import hash_password, verify_password
@@ -138,6 +195,36 @@ class TestAuthentication:
         # Should fail with wrong password
         assert verify_password("wrongpassword", hashed) == False
     
+    def test_outdated_hash_is_upgraded(self):
+        """Test that a hash made with a different bcrypt cost is flagged for rehashing"""
+        from hashing import get_pwd_context, verify_and_update
+        from config import BCRYPT_ROUNDS
+        
+        password = "TestPassword123!"
+        old_hash = get_pwd_context().copy(bcrypt__rounds=BCRYPT_ROUNDS - 1).hash(password)
+        
+        valid, new_hash = verify_and_update(password, old_hash)
+        
+        assert valid == True
+        assert new_hash is not None
+        assert get_pwd_context().needs_update(new_hash) == False
+    
+    def test_login_sheds_load_when_hash_queue_full(self, client, test_db, sample_user_data, monkeypatch):
+        """Test that logins fail fast with 503 while the hashing pool is saturated"""
+        import hashing
+        from config import PASSWORD_QUEUE_LIMIT
+        
+        client.post("/api/auth/register", json=sample_user_data)
+        monkeypatch.setattr(hashing, "_pending", PASSWORD_QUEUE_LIMIT)
+        
+        response = client.post("/api/auth/login", json={
+            "username": sample_user_data["username"],
+            "password": sample_user_data["password"]
+        })
+        
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "1"
+    
     def test_jwt_token_creation_and_verification(self):
         """Test JWT token creation and verification"""
         from auth import create_token, verify_token
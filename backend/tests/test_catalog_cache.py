@@ -0,0 +1,85 @@
+"""
+Test cases for coalescing identical concurrent catalog reads
+"""
+
+import asyncio
+import pytest
+import catalog_cache
+from metrics import CATALOG_READS
+
+pytestmark = pytest.mark.asyncio
+
+def _reads(kind: str, role: str) -> float:
+    return CATALOG_READS.labels(kind, role)._value.get()
+
+class TestReadCoalescing:
+    """Test that concurrent identical reads share one query"""
+    
+    async def test_concurrent_identical_reads_share_one_query(self):
+        """Test that many callers with the same key run the loader once"""
+        calls = 0
+        
+        async def load():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return [{"name": "Ladoo"}]
+        
+        shared_before = _reads("test", "shared")
+        results = await asyncio.gather(*(catalog_cache.coalesce("test", ("a",), load) for _ in range(20)))
+        
+        assert calls == 1
+        assert all(result == [{"name": "Ladoo"}] for result in results)
+        assert _reads("test", "shared") - shared_before == 19
+        
+        # Once the query finished, the next caller runs a fresh one
+        await catalog_cache.coalesce("test", ("a",), load)
+        assert calls == 2
+    
+    async def test_reads_after_a_write_do_not_join_earlier_query(self):
+        """Test that a write in between starts a new query for later callers"""
+        started = asyncio.Event()
+        release = asyncio.Event()
+        versions = []
+        
+        async def load():
+            seen = catalog_cache.version()
+            versions.append(seen)
+            started.set()
+            await release.wait()
+            return seen
+        
+        before = asyncio.ensure_future(catalog_cache.coalesce("test", ("b",), load))
+        await started.wait()
+        catalog_cache.invalidate()
+        after = asyncio.ensure_future(catalog_cache.coalesce("test", ("b",), load))
+        await asyncio.sleep(0)
+        release.set()
+        
+        assert await before != await after
+        assert len(versions) == 2
+    
+    async def test_errors_reach_every_caller(self):
+        """Test that a failed query fails all callers sharing it"""
+        async def load():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+        
+        results = await asyncio.gather(
+            *(catalog_cache.coalesce("test", ("c",), load) for _ in range(3)), return_exceptions=True
+        )
+        
+        assert all(isinstance(result, ValueError) for result in results)
+    
+    async def test_cancelled_caller_does_not_cancel_others(self):
+        """Test that one caller going away leaves the shared query running"""
+        async def load():
+            await asyncio.sleep(0.02)
+            return "done"
+        
+        first = asyncio.ensure_future(catalog_cache.coalesce("test", ("d",), load))
+        second = asyncio.ensure_future(catalog_cache.coalesce("test", ("d",), load))
+        await asyncio.sleep(0)
+        first.cancel()
+        
+        assert await second == "done"
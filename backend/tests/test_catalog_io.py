@@ -0,0 +1,88 @@
+"""
+Test cases for bulk catalog import and export
+"""
+
+import json
+import pytest
+
+class TestCatalogImportExport:
+    """Test streaming NDJSON/CSV import and export of sweets"""
+    
+    def test_import_ndjson_reports_bad_rows(self, client, test_db, admin_headers):
+        """Test NDJSON import upserts valid rows and reports invalid ones by line"""
+        body = "\n".join([
+            json.dumps({"name": "Ladoo", "category": "Traditional", "price": 10, "quantity": 5}),
+            json.dumps({"name": "Barfi", "category": "Traditional", "price": "not a number", "quantity": 5}),
+            "{broken json",
+            json.dumps({"name": "Jalebi", "category": "Traditional", "price": 12.5, "quantity": 8}),
+        ])
+        
+        response = client.post(
+            "/api/sweets/import",
+            content=body,
+            headers={**admin_headers, "Content-Type": "application/x-ndjson"}
+        )
+        
+        assert response.status_code == 200
+        data = response.json()
+        assert data["processed"] == 4
+        assert data["inserted"] == 2
+        assert data["error_count"] == 2
+        assert [error["line"] for error in data["errors"]] == [2, 3]
+        assert test_db.sweets.count_documents({}) == 2
+    
+    def test_import_csv_updates_existing(self, client, test_db, admin_headers, sample_sweet_data):
+        """Test CSV import updates sweets that already exist by name"""
+        test_db.sweets.insert_one(sample_sweet_data.copy())
+        body = f"name,category,price,quantity\n{sample_sweet_data['name']},Test,99,1\nKaju Katli,Premium,45,20\n"
+        
+        response = client.post(
+            "/api/sweets/import?format=csv",
+            content=body,
+            headers=admin_headers
+        )
+        
+        assert response.status_code == 200
+        assert response.json()["inserted"] == 1
+        assert response.json()["updated"] == 1
+        assert test_db.sweets.find_one({"name": sample_sweet_data["name"]})["price"] == 99
+    
+    def test_import_keeps_quantity_of_sweets_with_reservations(self, client, test_db, admin_headers):
+        """Test that import reports rows that would reset stock under held units"""
+        test_db.sweets.insert_one({"name": "Ladoo", "category": "Traditional", "price": 10.0, "quantity": 3, "reserved": 2})
+        test_db.sweets.insert_one({"name": "Peda", "category": "Traditional", "price": 10.0, "quantity": 3, "reserved": 2})
+        body = "name,category,price,quantity\nLadoo,Traditional,12,10\nPeda,Traditional,12,3\n"
+        
+        response = client.post("/api/sweets/import?format=csv", content=body, headers=admin_headers)
+        
+        data = response.json()
+        assert data["updated"] == 1
+        assert [error["line"] for error in data["errors"]] == [2]
+        assert "reserved" in data["errors"][0]["error"]
+        assert test_db.sweets.find_one({"name": "Ladoo"})["quantity"] == 3
+        # Same quantity, so the rest of the row still applies
+        assert test_db.sweets.find_one({"name": "Peda"})["price"] == 12
+        assert test_db.sweets.count_documents({}) == 2
+    
+    def test_import_requires_admin(self, client, test_db, auth_headers):
+        """Test regular users cannot import"""
+        response = client.post("/api/sweets/import", content="", headers=auth_headers)
+        
+        assert response.status_code == 403
+    
+    def test_export_ndjson_and_csv(self, client, test_db, admin_headers, sample_sweet_data):
+        """Test export streams every sweet in the requested format"""
+        for i in range(3):
+            sweet = sample_sweet_data.copy()
+            sweet["name"] = f"Sweet {i}"
+            test_db.sweets.insert_one(sweet)
+        
+        ndjson = client.get("/api/sweets/export", headers=admin_headers)
+        rows = [json.loads(line) for line in ndjson.text.splitlines()]
+        assert ndjson.headers["content-type"].startswith("application/x-ndjson")
+        assert [row["name"] for row in rows] == ["Sweet 0", "Sweet 1", "Sweet 2"]
+        
+        csv_export = client.get("/api/sweets/export?format=csv", headers=admin_headers)
+        lines = csv_export.text.splitlines()
+        assert lines[0] == "id,name,category,price,quantity,reorder_threshold"
+        assert len(lines) == 4
@@ -311,6 +311,102 @@ class TestCategoriesManagement:
         assert data[0]["name"] == "Gulab Jamun"
         assert data[0]["category"] == "Traditional"
     
+    def test_get_categories_with_embedded_sweets(self, client, test_db):
+        """Test ?include=sweets embeds each category's sweets up to the limit"""
+        test_db.categories.insert_many([
+            {"name": "Traditional", "description": "Traditional Indian sweets", "is_active": True},
+            {"name": "Seasonal", "description": "Seasonal special sweets", "is_active": True}
+        ])
+        test_db.sweets.insert_many([
+            {"name": f"Ladoo {i}", "category": "Traditional", "price": 10.0, "quantity": 5}
+            for i in range(3)
+        ])
+        
+        response = client.get("/api/categories?include=sweets&sweets_limit=2")
+        
+        assert response.status_code == 200
+        categories = {cat["name"]: cat for cat in response.json()}
+        assert [s["name"] for s in categories["Traditional"]["sweets"]] == ["Ladoo 0", "Ladoo 1"]
+        assert categories["Traditional"]["has_more_sweets"] is True
+        assert categories["Seasonal"]["sweets"] == []
+        assert categories["Seasonal"]["has_more_sweets"] is False
+        
+        category_id = categories["Traditional"]["id"]
+        response = client.get(f"/api/categories/{category_id}?include=sweets")
+        assert response.status_code == 200
+        assert len(response.json()["sweets"]) == 3
+        assert "id" in response.json()["sweets"][0]
+        
+        # Without include the plain shape is unchanged
+        assert "sweets" not in client.get(f"/api/categories/{category_id}").json()
+    
+    def test_update_category_if_match(self, client, test_db, admin_headers):
+        """Test that a stale If-Match is rejected with 412 and a fresh one applies"""
+        category_id = str(test_db.categories.insert_one(
+            {"name": "Traditional", "description": "Old", "is_active": True}
+        ).inserted_id)
+        etag = client.get(f"/api/categories/{category_id}").headers["etag"]
+        
+        first = client.put(f"/api/categories/{category_id}", json={"description": "First"},
+                           headers={**admin_headers, "If-Match": etag})
+        second = client.put(f"/api/categories/{category_id}", json={"description": "Second"},
+                            headers={**admin_headers, "If-Match": etag})
+        
+        assert first.status_code == 200
+        assert first.json()["description"] == "First"
+        assert first.headers["etag"] == client.get(f"/api/categories/{category_id}").headers["etag"]
+        assert second.status_code == 412
+        assert test_db.categories.find_one({"_id": ObjectId(category_id)})["description"] == "First"
+        
+        response = client.put(f"/api/categories/{category_id}", json={"description": "Second"},
+                              headers={**admin_headers, "If-Match": first.headers["etag"]})
+        assert response.status_code == 200
+    
+    def _category_with_sweets(self, test_db, name, count):
+        category_id = str(test_db.categories.insert_one(
+            {"name": name, "description": name, "is_active": True}
+        ).inserted_id)
+        test_db.sweets.insert_many([
+            {"name": f"{name} {i}", "category": name, "price": 10.0, "quantity": 5} for i in range(count)
+        ])
+        return category_id
+    
+    def test_rename_category_moves_sweets(self, client, test_db, admin_headers):
+        """Test that renaming a category carries its sweets over to the new name"""
+        category_id = self._category_with_sweets(test_db, "Traditional", 3)
+        self._category_with_sweets(test_db, "Modern", 1)
+        
+        response = client.put(f"/api/categories/{category_id}", json={"name": "Classic"}, headers=admin_headers)
+        
+        assert response.status_code == 200
+        assert response.json()["name"] == "Classic"
+        assert test_db.sweets.count_documents({"category": "Classic"}) == 3
+        assert test_db.sweets.count_documents({"category": "Traditional"}) == 0
+        assert test_db.sweets.count_documents({"category": "Modern"}) == 1
+        assert len(client.get(f"/api/categories/{category_id}/sweets").json()) == 3
+    
+    def test_delete_category_policies(self, client, test_db, admin_headers):
+        """Test block, reassign and cascade when deleting a category that has sweets"""
+        category_id = self._category_with_sweets(test_db, "Traditional", 2)
+        
+        # block (the default) refuses while sweets still use the category
+        response = client.delete(f"/api/categories/{category_id}", headers=admin_headers)
+        assert response.status_code == 409
+        assert test_db.categories.count_documents({"name": "Traditional"}) == 1
+        
+        response = client.delete(f"/api/categories/{category_id}?policy=reassign&reassign_to=Misc", headers=admin_headers)
+        assert response.status_code == 200
+        assert "2 sweet(s) moved to Misc" in response.json()["message"]
+        assert test_db.sweets.count_documents({"category": "Misc"}) == 2
+        assert test_db.categories.count_documents({"name": "Traditional"}) == 0
+        # The target category is created on demand
+        misc_id = str(test_db.categories.find_one({"name": "Misc"})["_id"])
+        
+        response = client.delete(f"/api/categories/{misc_id}?policy=cascade", headers=admin_headers)
+        assert response.status_code == 200
+        assert test_db.sweets.count_documents({}) == 0
+        assert test_db.categories.count_documents({}) == 0
+    
     def test_get_sweets_by_category_not_found(self, client, test_db):
         """Test getting sweets for non-existent category"""
         fake_id = "507f1f77bcf86cd799439011"  # Valid ObjectId format
@@ -351,3 +447,26 @@ class TestCategoriesManagement:
         
         response = client.post("/api/categories", json=category_data, headers=admin_headers)
         assert response.status_code == 422
+    
+    def test_category_stats(self, client, test_db):
+        """Test per-category counts, stock and value come back in one response"""
+        test_db.categories.insert_many([
+            {"name": "Traditional", "description": "Traditional Indian sweets", "is_active": True},
+            {"name": "Seasonal", "description": "Seasonal special sweets", "is_active": True}
+        ])
+        test_db.sweets.insert_many([
+            {"name": "Ladoo", "category": "Traditional", "price": 10.0, "quantity": 5},
+            {"name": "Barfi", "category": "Traditional", "price": 20.0, "quantity": 0},
+            {"name": "Brownie", "category": "Fusion", "price": 15.0, "quantity": 2}
+        ])
+        
+        response = client.get("/api/categories/stats")
+        
+        assert response.status_code == 200
+        stats = {row["category"]: row for row in response.json()}
+        assert stats["Traditional"]["sweet_count"] == 2
+        assert stats["Traditional"]["total_quantity"] == 5
+        assert stats["Traditional"]["inventory_value"] == 50.0
+        assert stats["Traditional"]["out_of_stock"] == 1
+        assert stats["Seasonal"]["sweet_count"] == 0
+        assert stats["Fusion"]["category_id"] is None
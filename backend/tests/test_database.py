@@ -7,10 +7,12 @@ from unittest.mock import Mock, patch
 from bson import ObjectId
 from datetime import datetime
 
+pytestmark = pytest.mark.asyncio
+
 class TestDatabaseOperations:
     """Test database CRUD operations"""
     
-    def test_get_user_by_username(self, test_db, sample_user_data):
+    async def test_get_user_by_username(self, test_db, sample_user_data):
         """Test getting user by username"""
         from database import get_user_by_username
         
@@ -21,20 +23,20 @@ class TestDatabaseOperations:
         test_db.users.insert_one(user_data)
         
         # Test getting user
-        user = get_user_by_username(sample_user_data["username"])
+        user = await get_user_by_username(sample_user_data["username"])
         
         assert user is not None
         assert user["username"] == sample_user_data["username"]
         assert user["email"] == sample_user_data["email"]
     
-    def test_get_user_by_username_not_found(self, test_db):
+    async def test_get_user_by_username_not_found(self, test_db):
         """Test getting non-existent user by username"""
         from database import get_user_by_username
         
-        user = get_user_by_username("nonexistent")
+        user = await get_user_by_username("nonexistent")
         assert user is None
     
-    def test_get_user_by_email(self, test_db, sample_user_data):
+    async def test_get_user_by_email(self, test_db, sample_user_data):
         """Test getting user by email"""
         from database import get_user_by_email
         
@@ -45,20 +47,20 @@ class TestDatabaseOperations:
         test_db.users.insert_one(user_data)
         
         # Test getting user
-        user = get_user_by_email(sample_user_data["email"])
+        user = await get_user_by_email(sample_user_data["email"])
         
         assert user is not None
         assert user["username"] == sample_user_data["username"]
         assert user["email"] == sample_user_data["email"]
     
-    def test_get_user_by_email_not_found(self, test_db):
+    async def test_get_user_by_email_not_found(self, test_db):
         """Test getting non-existent user by email"""
         from database import get_user_by_email
         
-        user = get_user_by_email("nonexistent@example.com")
+        user = await get_user_by_email("nonexistent@example.com")
         assert user is None
     
-    def test_create_user(self, test_db, sample_user_data):
+    async def test_create_user(self, test_db, sample_user_data):
         """Test creating a new user"""
         from database import create_user
         
@@ -66,7 +68,7 @@ class TestDatabaseOperations:
         user_data["password"] = "hashed_password"
         user_data["created_at"] = datetime.utcnow()
         
-        result = create_user(user_data)
+        result = await create_user(user_data)
         
         assert result.inserted_id is not None
         
@@ -75,7 +77,7 @@ class TestDatabaseOperations:
         assert user is not None
         assert user["username"] == sample_user_data["username"]
     
-    def test_get_all_sweets(self, test_db, sample_sweet_data):
+    async def test_get_all_sweets(self, test_db, sample_sweet_data):
         """Test getting all sweets"""
         from database import get_all_sweets
         
@@ -91,7 +93,7 @@ class TestDatabaseOperations:
         test_db.sweets.insert_many([sweet1, sweet2])
         
         # Test getting all sweets
-        sweets = get_all_sweets()
+        sweets = await get_all_sweets()
         
         assert len(sweets) == 2
         assert all("id" in sweet for sweet in sweets)
@@ -101,7 +103,7 @@ class TestDatabaseOperations:
         for sweet in sweets:
             assert isinstance(sweet["id"], str)
     
-    def test_get_sweet_by_id(self, test_db, sample_sweet_data):
+    async def test_get_sweet_by_id(self, test_db, sample_sweet_data):
         """Test getting sweet by ID"""
         from database import get_sweet_by_id
         
@@ -112,21 +114,21 @@ class TestDatabaseOperations:
         sweet_id = str(result.inserted_id)
         
         # Test getting sweet
-        sweet = get_sweet_by_id(sweet_id)
+        sweet = await get_sweet_by_id(sweet_id)
         
         assert sweet is not None
         assert sweet["name"] == sample_sweet_data["name"]
         assert sweet["price"] == sample_sweet_data["price"]
     
-    def test_get_sweet_by_id_not_found(self, test_db):
+    async def test_get_sweet_by_id_not_found(self, test_db):
         """Test getting non-existent sweet by ID"""
         from database import get_sweet_by_id
         
         fake_id = "507f1f77bcf86cd799439011"  # Valid ObjectId format
-        sweet = get_sweet_by_id(fake_id)
+        sweet = await get_sweet_by_id(fake_id)
         assert sweet is None
     
-    def test_get_sweet_by_name(self, test_db, sample_sweet_data):
+    async def test_get_sweet_by_name(self, test_db, sample_sweet_data):
         """Test getting sweet by name"""
         from database import get_sweet_by_name
         
@@ -136,27 +138,27 @@ class TestDatabaseOperations:
         test_db.sweets.insert_one(sweet_data)
         
         # Test getting sweet
-        sweet = get_sweet_by_name(sample_sweet_data["name"])
+        sweet = await get_sweet_by_name(sample_sweet_data["name"])
         
         assert sweet is not None
         assert sweet["name"] == sample_sweet_data["name"]
         assert sweet["price"] == sample_sweet_data["price"]
     
-    def test_get_sweet_by_name_not_found(self, test_db):
+    async def test_get_sweet_by_name_not_found(self, test_db):
         """Test getting non-existent sweet by name"""
         from database import get_sweet_by_name
         
-        sweet = get_sweet_by_name("Nonexistent Sweet")
+        sweet = await get_sweet_by_name("Nonexistent Sweet")
         assert sweet is None
     
-    def test_create_sweet(self, test_db, sample_sweet_data):
+    async def test_create_sweet(self, test_db, sample_sweet_data):
         """Test creating a new sweet"""
         from database import create_sweet
         
         sweet_data = sample_sweet_data.copy()
         sweet_data["created_at"] = datetime.utcnow()
         
-        result = create_sweet(sweet_data)
+        result = await create_sweet(sweet_data)
         
         assert result.inserted_id is not None
         
@@ -165,7 +167,7 @@ class TestDatabaseOperations:
         assert sweet is not None
         assert sweet["name"] == sample_sweet_data["name"]
     
-    def test_update_sweet(self, test_db, sample_sweet_data):
+    async def test_update_sweet(self, test_db, sample_sweet_data):
         """Test updating a sweet"""
         from database import update_sweet
         
@@ -177,16 +179,17 @@ class TestDatabaseOperations:
         
         # Update sweet
         update_data = {"price": 30.0, "quantity": 100}
-        result = update_sweet(sweet_id, update_data)
+        result = await update_sweet(sweet_id, update_data)
         
-        assert result.modified_count == 1
+        assert result["price"] == 30.0
+        assert result["version"] == 1
         
         # Verify update
         sweet = test_db.sweets.find_one({"_id": ObjectId(sweet_id)})
         assert sweet["price"] == 30.0
         assert sweet["quantity"] == 100
     
-    def test_delete_sweet(self, test_db, sample_sweet_data):
+    async def test_delete_sweet(self, test_db, sample_sweet_data):
         """Test deleting a sweet"""
         from database import delete_sweet
         
@@ -197,7 +200,7 @@ class TestDatabaseOperations:
         sweet_id = str(result.inserted_id)
         
         # Delete sweet
-        result = delete_sweet(sweet_id)
+        result = await delete_sweet(sweet_id)
         
         assert result.deleted_count == 1
         
@@ -205,7 +208,7 @@ class TestDatabaseOperations:
         sweet = test_db.sweets.find_one({"_id": ObjectId(sweet_id)})
         assert sweet is None
     
-    def test_update_sweet_quantity(self, test_db, sample_sweet_data):
+    async def test_update_sweet_quantity(self, test_db, sample_sweet_data):
         """Test updating sweet quantity"""
         from database import update_sweet_quantity
         
@@ -217,7 +220,7 @@ class TestDatabaseOperations:
         sweet_id = str(result.inserted_id)
         
         # Update quantity (decrease by 10)
-        result = update_sweet_quantity(sweet_id, -10)
+        result = await update_sweet_quantity(sweet_id, -10)
         
         assert result.modified_count == 1
         
@@ -225,7 +228,7 @@ class TestDatabaseOperations:
         sweet = test_db.sweets.find_one({"_id": ObjectId(sweet_id)})
         assert sweet["quantity"] == 40
     
-    def test_update_sweet_quantity_increase(self, test_db, sample_sweet_data):
+    async def test_update_sweet_quantity_increase(self, test_db, sample_sweet_data):
         """Test increasing sweet quantity"""
         from database import update_sweet_quantity
         
@@ -237,10 +240,66 @@ class TestDatabaseOperations:
         sweet_id = str(result.inserted_id)
         
         # Update quantity (increase by 20)
-        result = update_sweet_quantity(sweet_id, 20)
+        result = await update_sweet_quantity(sweet_id, 20)
         
         assert result.modified_count == 1
         
         # Verify quantity update
         sweet = test_db.sweets.find_one({"_id": ObjectId(sweet_id)})
         assert sweet["quantity"] == 70
+    
+    async def test_ensure_indexes_enforces_unique_names(self, test_db, sample_sweet_data):
+        """Test that the index registry makes duplicate sweet names fail atomically"""
+        from indexes import ensure_indexes
+        from database import create_sweet
+        from pymongo.errors import DuplicateKeyError
+        
+        await ensure_indexes()
+        await create_sweet(sample_sweet_data.copy())
+        
+        with pytest.raises(DuplicateKeyError):
+            await create_sweet(sample_sweet_data.copy())
+        
+        index_names = test_db.sweets.index_information().keys()
+        assert "name_unique" in index_names
+        assert "category_id" in index_names
+    
+    async def test_ensure_indexes_fails_when_unique_index_cannot_be_built(self, test_db, monkeypatch):
+        """Test that duplicates blocking a unique index fail the bootstrap instead of being logged"""
+        import indexes
+        from pymongo import IndexModel
+        from pymongo.errors import OperationFailure
+        
+        test_db.index_scratch.drop()
+        test_db.index_scratch.insert_many([{"name": "Ladoo"}, {"name": "Ladoo"}])
+        monkeypatch.setattr(indexes, "INDEXES", {"index_scratch": [
+            IndexModel([("name", 1)], unique=True, name="name_unique"),
+            IndexModel([("price", 1)], name="price"),
+        ]})
+        
+        try:
+            with pytest.raises(OperationFailure):
+                await indexes.ensure_indexes()
+            # Indexes that don't guard data are still built
+            assert "price" in test_db.index_scratch.index_information()
+        finally:
+            test_db.index_scratch.drop()
+    
+    async def test_connect_and_close_manage_one_client_per_process(self, test_db):
+        """Test that startup opens the client, shutdown drops it and a forked worker gets its own"""
+        import database
+        
+        await database.connect()
+        parent_client = database.client
+        assert parent_client is not None
+        assert database.get_client() is parent_client
+        
+        # A forked worker must not reuse (or close) the parent's pool, and
+        # closes its own on shutdown
+        with patch("database.os.getpid", return_value=database._client_pid + 1):
+            assert database.get_client() is not parent_client
+            await database.close()
+        assert database.client is None
+        
+        # The "parent" is really this process, so its client is still ours to close
+        await parent_client.close()
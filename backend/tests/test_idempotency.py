@@ -0,0 +1,225 @@
+"""
+Test cases for Idempotency-Key handling on purchase and restock
+"""
+
+import asyncio
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException, Response
+import idempotency
+from idempotency import MemoryStore, MongoStore, DONE, PENDING
+
+class TestIdempotencyKeys:
+    """Test that retried purchases and restocks replay instead of repeating"""
+
+    def _sweet(self, test_db, quantity=10):
+        return str(test_db.sweets.insert_one(
+            {"name": "Barfi", "category": "Traditional", "price": 10.0, "quantity": quantity}
+        ).inserted_id)
+
+    def test_retried_purchase_is_replayed(self, client, test_db, auth_headers):
+        """Test that a retry with the same key doesn't take stock twice"""
+        sweet_id = self._sweet(test_db)
+        headers = {**auth_headers, "Idempotency-Key": "order-1"}
+
+        first = client.post(f"/api/sweets/{sweet_id}/purchase", json={"quantity": 3}, headers=headers)
+        retry = client.post(f"/api/sweets/{sweet_id}/purchase", json={"quantity": 3}, headers=headers)
+
+        assert first.status_code == retry.status_code == 200
+        assert retry.json() == first.json()
+        assert "idempotent-replayed" not in first.headers
+        assert retry.headers["idempotent-replayed"] == "true"
+        assert test_db.sweets.find_one({"_id": ObjectId(sweet_id)})["quantity"] == 7
+
+        # Without a key (or with a new one) every request counts
+        client.post(f"/api/sweets/{sweet_id}/purchase", json={"quantity": 1}, headers=auth_headers)
+        client.post(f"/api/sweets/{sweet_id}/purchase", json={"quantity": 1},
+                    headers={**auth_headers, "Idempotency-Key": "order-2"})
+        assert test_db.sweets.find_one({"_id": ObjectId(sweet_id)})["quantity"] == 5
+
+    def test_key_reused_for_different_request(self, client, test_db, auth_headers):
+        """Test that one key can't be spent on a different quantity"""
+        sweet_id = self._sweet(test_db)
+        headers = {**auth_headers, "Idempotency-Key": "order-1"}
+
+        client.post(f"/api/sweets/{sweet_id}/purchase", json={"quantity": 3}, headers=headers)
+        response = client.post(f"/api/sweets/{sweet_id}/purchase", json={"quantity": 4}, headers=headers)
+
+        assert response.status_code == 422
+        assert test_db.sweets.find_one({"_id": ObjectId(sweet_id)})["quantity"] == 7
+
+    def test_client_errors_are_replayed(self, client, test_db, auth_headers):
+        """Test that a final 4xx outcome is stored like a success"""
+        sweet_id = self._sweet(test_db, quantity=2)
+        headers = {**auth_headers, "Idempotency-Key": "order-1"}
+
+        first = client.post(f"/api/sweets/{sweet_id}/purchase", json={"quantity": 3}, headers=headers)
+        test_db.sweets.update_one({"_id": ObjectId(sweet_id)}, {"$set": {"quantity": 10}})
+        retry = client.post(f"/api/sweets/{sweet_id}/purchase", json={"quantity": 3}, headers=headers)
+
+        assert first.status_code == retry.status_code == 400
+        assert retry.headers["idempotent-replayed"] == "true"
+        assert test_db.sweets.find_one({"_id": ObjectId(sweet_id)})["quantity"] == 10
+
+    def test_keys_are_scoped_per_user(self, client, test_db, auth_headers, admin_headers):
+        """Test that two users sending the same key both get served"""
+        sweet_id = self._sweet(test_db)
+
+        for headers in (auth_headers, admin_headers):
+            response = client.post(f"/api/sweets/{sweet_id}/purchase", json={"quantity": 1},
+                                   headers={**headers, "Idempotency-Key": "same"})
+            assert "idempotent-replayed" not in response.headers
+
+        assert test_db.sweets.find_one({"_id": ObjectId(sweet_id)})["quantity"] == 8
+
+    @pytest.mark.asyncio
+    async def test_concurrent_duplicates_wait_for_first(self, monkeypatch):
+        """Test that duplicates arriving mid-request share the first outcome"""
+        monkeypatch.setattr(idempotency, "_store", MemoryStore())
+        calls = 0
+
+        async def purchase():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.05)
+            return {"message": "ok"}
+
+        responses = [Response() for _ in range(5)]
+        results = await asyncio.gather(*(
+            idempotency.run("k", "alice", "purchase 1", {"quantity": 1}, purchase, response)
+            for response in responses
+        ))
+
+        assert calls == 1
+        assert results == [{"message": "ok"}] * 5
+        assert sum("idempotent-replayed" in response.headers for response in responses) == 4
+
+    @pytest.mark.asyncio
+    async def test_server_errors_release_the_key(self, monkeypatch):
+        """Test that a 5xx isn't stored, so a retry runs for real"""
+        monkeypatch.setattr(idempotency, "_store", MemoryStore())
+
+        async def busy():
+            raise HTTPException(status_code=503, detail="Server is busy")
+
+        async def purchase():
+            return {"message": "ok"}
+
+        with pytest.raises(HTTPException):
+            await idempotency.run("k", "alice", "purchase 1", {}, busy, Response())
+        response = Response()
+        assert await idempotency.run("k", "alice", "purchase 1", {}, purchase, response) == {"message": "ok"}
+        assert "idempotent-replayed" not in response.headers
+
+    @pytest.mark.asyncio
+    async def test_unexpected_failure_keeps_the_key(self, monkeypatch):
+        """Test that a request that blew up midway is never run again under its key"""
+        monkeypatch.setattr(idempotency, "_store", MemoryStore())
+        calls = 0
+        
+        async def purchase():
+            nonlocal calls
+            calls += 1
+            idempotency.write_started()
+            raise RuntimeError("connection reset after the stock update")
+        
+        with pytest.raises(RuntimeError):
+            await idempotency.run("k", "alice", "purchase 1", {}, purchase, Response())
+        with pytest.raises(HTTPException) as exc_info:
+            await idempotency.run("k", "alice", "purchase 1", {}, purchase, Response())
+        
+        assert calls == 1
+        assert exc_info.value.status_code == 500
+        assert exc_info.value.detail == idempotency.UNKNOWN_OUTCOME
+    
+    @pytest.mark.asyncio
+    async def test_failure_before_the_write_releases_the_key(self, monkeypatch):
+        """Test that errors raised before anything was sent let a retry run for real"""
+        from pymongo.errors import ServerSelectionTimeoutError
+        monkeypatch.setattr(idempotency, "_store", MemoryStore())
+        
+        async def no_server():
+            # Marked as sending, but no server was ever selected
+            idempotency.write_started()
+            raise ServerSelectionTimeoutError("No servers found")
+        
+        async def broken_before_write():
+            raise RuntimeError("failed while preparing the update")
+        
+        async def purchase():
+            return {"message": "ok"}
+        
+        for failing in (no_server, broken_before_write):
+            with pytest.raises(Exception):
+                await idempotency.run("k", "alice", "purchase 1", {}, failing, Response())
+        response = Response()
+        assert await idempotency.run("k", "alice", "purchase 1", {}, purchase, response) == {"message": "ok"}
+        assert "idempotent-replayed" not in response.headers
+    
+    def test_malformed_sweet_id_is_a_final_404(self, client, test_db, auth_headers):
+        """Test that a bad id is answered before any write and replayed as 404"""
+        headers = {**auth_headers, "Idempotency-Key": "order-1"}
+        
+        first = client.post("/api/sweets/not-an-id/purchase", json={"quantity": 1}, headers=headers)
+        retry = client.post("/api/sweets/not-an-id/purchase", json={"quantity": 1}, headers=headers)
+        
+        assert first.status_code == retry.status_code == 404
+        assert retry.headers["idempotent-replayed"] == "true"
+    
+    @pytest.mark.asyncio
+    async def test_running_claim_is_renewed_not_taken_over(self, test_db, monkeypatch):
+        """Test that a slow request keeps its shared claim past IDEMPOTENCY_LOCK_SECONDS"""
+        test_db.idempotency_keys.delete_many({})
+        monkeypatch.setattr(idempotency, "_store", MongoStore())
+        monkeypatch.setattr(idempotency, "IDEMPOTENCY_LOCK_SECONDS", 0.3)
+        calls = 0
+        
+        async def purchase():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.8)
+            return {"message": "ok"}
+        
+        async def duplicate():
+            await asyncio.sleep(0.5)
+            return await idempotency.run("k", "alice", "purchase 1", {}, purchase, Response())
+        
+        try:
+            results = await asyncio.gather(
+                idempotency.run("k", "alice", "purchase 1", {}, purchase, Response()), duplicate()
+            )
+        finally:
+            test_db.idempotency_keys.delete_many({})
+        
+        assert calls == 1
+        assert results == [{"message": "ok"}] * 2
+    
+    @pytest.mark.asyncio
+    async def test_memory_store_never_evicts_pending_claims(self):
+        """Test that other keys filling the LRU can't push out a claim still running"""
+        store = MemoryStore(max_keys=2)
+        
+        assert await store.claim("alice|running", "fp", "a") is None
+        for i in range(5):
+            assert await store.claim(f"bob|{i}", "fp", "b") is None
+            await store.complete(f"bob|{i}", {"fingerprint": "fp", "state": DONE, "status": 200, "body": {}}, "b")
+        
+        assert (await store.claim("alice|running", "fp", "c"))["state"] == PENDING
+    
+    @pytest.mark.asyncio
+    async def test_mongo_store_claims_once(self, test_db):
+        """Test that the shared store hands a key to one claimant and then replays it"""
+        test_db.idempotency_keys.delete_many({})
+        store = MongoStore()
+
+        assert await store.claim("alice|k", "fp", "first") is None
+        assert (await store.claim("alice|k", "fp", "second"))["state"] == PENDING
+
+        # Only the owner can store the outcome
+        await store.complete("alice|k", {"fingerprint": "fp", "state": DONE, "status": 500, "body": {}}, "second")
+        await store.complete("alice|k", {"fingerprint": "fp", "state": DONE, "status": 200, "body": {"message": "ok"}}, "first")
+        entry = await store.claim("alice|k", "fp", "third")
+
+        assert entry["state"] == DONE
+        assert entry["body"] == {"message": "ok"}
+        test_db.idempotency_keys.delete_many({})
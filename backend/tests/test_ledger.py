@@ -0,0 +1,100 @@
+"""
+Test cases for the stock movement ledger
+"""
+
+import pytest
+from fastapi.testclient import TestClient
+import ledger
+
+class TestStockLedger:
+    """Test purchases and restocks are appended to the ledger"""
+    
+    def test_purchase_and_restock_recorded(self, client, test_db, admin_headers, monkeypatch):
+        """Test sync durability writes the entry before the response"""
+        monkeypatch.setattr(ledger, "LEDGER_DURABILITY", "sync")
+        sweet_id = str(test_db.sweets.insert_one(
+            {"name": "Ladoo", "category": "Traditional", "price": 10.0, "quantity": 5}
+        ).inserted_id)
+        
+        assert client.post(f"/api/sweets/{sweet_id}/purchase", json={"quantity": 2}, headers=admin_headers).status_code == 200
+        assert client.post(f"/api/sweets/{sweet_id}/restock", json={"quantity": 10}, headers=admin_headers).status_code == 200
+        
+        response = client.get(f"/api/sweets/{sweet_id}/movements", headers=admin_headers)
+        
+        assert response.status_code == 200
+        movements = response.json()
+        assert [(m["kind"], m["quantity"], m["quantity_after"]) for m in movements] == [
+            ("restock", 10, 13), ("purchase", -2, 3)
+        ]
+        assert movements[0]["username"] == "admin"
+    
+    def test_movements_require_admin(self, client, test_db, auth_headers):
+        """Test regular users cannot read the ledger"""
+        response = client.get("/api/sweets/507f1f77bcf86cd799439011/movements", headers=auth_headers)
+        
+        assert response.status_code == 403
+    
+    def test_queued_entries_drained_on_shutdown(self, test_db, monkeypatch):
+        """Test async durability still writes every entry once the app stops"""
+        from main import app
+        monkeypatch.setattr(ledger, "LEDGER_DURABILITY", "async")
+        # Long enough that nothing is flushed by the timer during the test
+        monkeypatch.setattr(ledger, "LEDGER_FLUSH_INTERVAL_MS", 60000)
+        sweet = {"name": "Ladoo", "category": "Traditional", "price": 10.0, "quantity": 5}
+        sweet["_id"] = test_db.sweets.insert_one(dict(sweet)).inserted_id
+        
+        with TestClient(app) as client:
+            for _ in range(3):
+                client.portal.call(ledger.record, "purchase", sweet, -1, "testuser")
+        
+        assert test_db.stock_movements.count_documents({"sweet_id": sweet["_id"]}) == 3
+
+@pytest.mark.asyncio
+async def test_writer_flushes_bounded_batches(monkeypatch):
+    """Test the writer never sends more than LEDGER_BATCH_SIZE entries per insert_many"""
+    batches = []
+    
+    async def capture(entries):
+        batches.append(len(entries))
+    
+    monkeypatch.setattr(ledger, "insert_stock_movements", capture)
+    monkeypatch.setattr(ledger, "LEDGER_BATCH_SIZE", 2)
+    monkeypatch.setattr(ledger, "LEDGER_DURABILITY", "async")
+    sweet = {"_id": None, "name": "Ladoo", "quantity": 5}
+    
+    for _ in range(5):
+        await ledger.record("purchase", sweet, -1, "testuser")
+    await ledger.drain()
+    
+    assert sum(batches) == 5
+    assert max(batches) <= 2
+
+@pytest.mark.asyncio
+async def test_failed_write_does_not_fail_sync_request(monkeypatch):
+    """Test that a batch failing every retry is held, not raised, and written after the next success"""
+    written = []
+    failures = 2
+    
+    async def flaky(entries):
+        nonlocal failures
+        if failures:
+            failures -= 1
+            raise ConnectionError("primary stepped down")
+        written.extend(entry["quantity"] for entry in entries)
+    
+    monkeypatch.setattr(ledger, "insert_stock_movements", flaky)
+    monkeypatch.setattr(ledger, "LEDGER_DURABILITY", "sync")
+    monkeypatch.setattr(ledger, "LEDGER_MAX_RETRIES", 1)
+    monkeypatch.setattr(ledger, "_unwritten", [])
+    sweet = {"_id": None, "name": "Ladoo", "quantity": 5}
+    
+    # Its stock already changed, so the purchase must not turn into a 500
+    await ledger.record("purchase", sweet, -1, "testuser")
+    assert written == []
+    assert len(ledger._unwritten) == 1
+    
+    await ledger.record("purchase", sweet, -2, "testuser")
+    await ledger.drain()
+    
+    assert sorted(written) == [-2, -1]
+    assert ledger._unwritten == []
@@ -0,0 +1,28 @@
+"""
+Test cases for the Prometheus metrics endpoint
+"""
+
+import pytest
+
+class TestMetrics:
+    """Test request metrics are labelled by route template"""
+    
+    def test_metrics_by_route_template(self, client, test_db):
+        """Test requests are counted per route template, not raw path"""
+        client.get("/api/categories")
+        client.get("/api/categories/507f1f77bcf86cd799439011")
+        client.get("/no/such/path")
+        
+        response = client.get("/metrics")
+        
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        body = response.text
+        assert 'http_requests_total{method="GET",route="/api/categories",status="200"}' in body
+        assert 'route="/api/categories/{category_id}",status="404"' in body
+        assert 'route="unmatched",status="404"' in body
+        assert "507f1f77bcf86cd799439011" not in body
+        assert 'http_request_duration_seconds_bucket{le="0.001",method="GET",route="/api/categories"}' in body
+        for name in ("http_requests_in_flight", "threadpool_size", "mongodb_command_duration_seconds",
+                     "mongodb_pool_checkout_wait_seconds", "ledger_queue_depth", "catalog_reads"):
+            assert f"# TYPE {name}" in body
@@ -0,0 +1,73 @@
+"""
+Test cases for token-bucket rate limiting
+"""
+
+import pytest
+from fastapi.testclient import TestClient
+from rate_limit import RateLimitMiddleware, MemoryBuckets, parse_rules
+import rate_limit
+
+class TestRateLimiting:
+    """Test per-route budgets, keys and refill"""
+    
+    def test_login_limited_per_ip(self, client, test_db):
+        """Test login attempts beyond the budget get 429 with Retry-After"""
+        exact, _ = parse_rules(rate_limit.RATE_LIMITS)
+        budget = exact[("POST", "/api/auth/login")].capacity
+        credentials = {"username": "nobody", "password": "WrongPassword1!"}
+        
+        for _ in range(budget):
+            assert client.post("/api/auth/login", json=credentials).status_code == 401
+        response = client.post("/api/auth/login", json=credentials)
+        
+        assert response.status_code == 429
+        assert int(response.headers["Retry-After"]) >= 1
+        # Routes without a rule are untouched
+        assert client.get("/api/categories").status_code == 200
+    
+    def test_budgets_are_per_user(self, test_db, auth_headers, admin_headers):
+        """Test users with valid tokens each get their own bucket"""
+        from main import app
+        limited = RateLimitMiddleware(app, rules="GET /api/categories/{category_id}=1/60", backend=MemoryBuckets())
+        fake_id = "507f1f77bcf86cd799439011"
+        
+        # No lifespan: the app's own client fixture is already running it
+        client = TestClient(limited)
+        assert client.get(f"/api/categories/{fake_id}", headers=auth_headers).status_code == 404
+        assert client.get(f"/api/categories/{fake_id}", headers=admin_headers).status_code == 404
+        assert client.get(f"/api/categories/{fake_id}", headers=auth_headers).status_code == 429
+        # A forged token falls back to the IP's bucket, not a fresh one
+        forged = {"Authorization": "Bearer not-a-jwt"}
+        assert client.get(f"/api/categories/{fake_id}", headers=forged).status_code == 404
+        assert client.get(f"/api/categories/{fake_id}", headers=forged).status_code == 429
+
+    def test_spoofed_forwarded_for_does_not_buy_a_fresh_bucket(self, test_db, monkeypatch):
+        """Test that only the entry added by our own proxy identifies the client"""
+        from main import app
+        monkeypatch.setattr(rate_limit, "RATE_LIMIT_TRUST_FORWARDED", True)
+        monkeypatch.setattr(rate_limit, "RATE_LIMIT_TRUSTED_PROXIES", 1)
+        limited = RateLimitMiddleware(app, rules="GET /api/categories=1/60:ip", backend=MemoryBuckets())
+        client = TestClient(limited)
+        
+        # The proxy appends the real peer after whatever the client claimed
+        assert client.get("/api/categories", headers={"X-Forwarded-For": "1.1.1.1, 203.0.113.7"}).status_code == 200
+        assert client.get("/api/categories", headers={"X-Forwarded-For": "2.2.2.2, 203.0.113.7"}).status_code == 429
+        assert client.get("/api/categories", headers={"X-Forwarded-For": "203.0.113.8"}).status_code == 200
+
+@pytest.mark.asyncio
+async def test_bucket_refills_over_time(monkeypatch):
+    """Test a spent bucket regains tokens at capacity/seconds"""
+    clock = [1000.0]
+    monkeypatch.setattr(rate_limit.time, "monotonic", lambda: clock[0])
+    exact, _ = parse_rules("GET /x=2/10")
+    rule = exact[("GET", "/x")]
+    buckets = MemoryBuckets(shards=4)
+    
+    assert await buckets.take(rule, "a") == 0
+    assert await buckets.take(rule, "a") == 0
+    assert await buckets.take(rule, "a") == pytest.approx(5.0)
+    
+    clock[0] += 5
+    assert await buckets.take(rule, "a") == 0
+    # Other keys are unaffected
+    assert await buckets.take(rule, "b") == 0
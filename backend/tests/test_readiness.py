@@ -0,0 +1,69 @@
+"""
+Test cases for the liveness and readiness probes
+"""
+
+import pytest
+from unittest.mock import patch
+from pymongo.errors import ServerSelectionTimeoutError
+import readiness
+
+class _Admin:
+    def __init__(self, error=None):
+        self.error = error
+        self.pings = 0
+
+    async def command(self, name):
+        self.pings += 1
+        if self.error:
+            raise self.error
+        return {"ok": 1}
+
+class _Client:
+    def __init__(self, error=None):
+        self.admin = _Admin(error)
+
+class TestReadiness:
+    """Test /health and /ready"""
+
+    def test_health_does_not_touch_database(self, client):
+        """Test that liveness answers without pinging MongoDB"""
+        fake = _Client(ServerSelectionTimeoutError("down"))
+        with patch("readiness.database.get_client", return_value=fake):
+            response = client.get("/health")
+
+        assert response.status_code == 200
+        assert response.json() == {"status": "healthy"}
+        assert fake.admin.pings == 0
+
+    def test_ready_once_bootstrap_finished(self, client, test_db):
+        """Test that /ready is healthy after startup"""
+        response = client.get("/ready")
+
+        assert response.status_code == 200
+        assert response.json() == {"status": "ready"}
+
+    def test_ready_caches_ping(self, client, test_db):
+        """Test that repeated probes within the cache window share one ping"""
+        readiness._checked_at = None
+        fake = _Client()
+        with patch("readiness.database.get_client", return_value=fake):
+            for _ in range(5):
+                assert client.get("/ready").status_code == 200
+
+        assert fake.admin.pings == 1
+
+    def test_ready_reports_unreachable_database(self, client, test_db):
+        """Test that a failed ping makes /ready answer 503"""
+        readiness._checked_at = None
+        fake = _Client(ServerSelectionTimeoutError("No servers found"))
+        with patch("readiness.database.get_client", return_value=fake):
+            response = client.get("/ready")
+
+        assert response.status_code == 503
+        assert response.json()["status"] == "unavailable"
+        assert "No servers found" in response.json()["detail"]
+
+        # The failure is cached too, until the next interval
+        assert client.get("/ready").status_code == 503
+        readiness._checked_at = None
+        assert client.get("/ready").status_code == 200
@@ -0,0 +1,121 @@
+"""
+Test cases for checkout reservations
+"""
+
+import pytest
+from datetime import datetime, timedelta
+from bson import ObjectId
+import ledger
+import reservations
+
+class TestReservations:
+    """Test reserve/commit/release and expiry of held stock"""
+    
+    def _sweet(self, test_db, quantity=5):
+        return str(test_db.sweets.insert_one(
+            {"name": "Ladoo", "category": "Traditional", "price": 10.0, "quantity": quantity}
+        ).inserted_id)
+    
+    def test_reserve_and_commit(self, client, test_db, auth_headers, monkeypatch):
+        """Test reserving takes stock off sale and committing records the purchase"""
+        monkeypatch.setattr(ledger, "LEDGER_DURABILITY", "sync")
+        sweet_id = self._sweet(test_db)
+        
+        response = client.post(f"/api/sweets/{sweet_id}/reserve", json={"quantity": 3}, headers=auth_headers)
+        
+        assert response.status_code == 200
+        reservation = response.json()
+        assert reservation["status"] == "held"
+        sweet = test_db.sweets.find_one({"_id": ObjectId(sweet_id)})
+        assert (sweet["quantity"], sweet["reserved"]) == (2, 3)
+        
+        response = client.post(f"/api/reservations/{reservation['id']}/commit", headers=auth_headers)
+        
+        assert response.status_code == 200
+        sweet = test_db.sweets.find_one({"_id": ObjectId(sweet_id)})
+        assert (sweet["quantity"], sweet["reserved"]) == (2, 0)
+        assert test_db.stock_movements.count_documents({"kind": "purchase", "quantity": -3}) == 1
+        
+        # A reservation can only be closed once
+        response = client.post(f"/api/reservations/{reservation['id']}/release", headers=auth_headers)
+        assert response.status_code == 409
+    
+    def test_reserve_more_than_available(self, client, test_db, auth_headers):
+        """Test held units are not available to a second reservation"""
+        sweet_id = self._sweet(test_db, quantity=3)
+        
+        assert client.post(f"/api/sweets/{sweet_id}/reserve", json={"quantity": 2}, headers=auth_headers).status_code == 200
+        response = client.post(f"/api/sweets/{sweet_id}/reserve", json={"quantity": 2}, headers=auth_headers)
+        
+        assert response.status_code == 400
+        assert "Not enough stock" in response.json()["detail"]
+    
+    def test_release_returns_stock(self, client, test_db, auth_headers):
+        """Test releasing puts the held units back on sale"""
+        sweet_id = self._sweet(test_db)
+        reservation = client.post(f"/api/sweets/{sweet_id}/reserve", json={"quantity": 4}, headers=auth_headers).json()
+        
+        response = client.post(f"/api/reservations/{reservation['id']}/release", headers=auth_headers)
+        
+        assert response.status_code == 200
+        sweet = test_db.sweets.find_one({"_id": ObjectId(sweet_id)})
+        assert (sweet["quantity"], sweet["reserved"]) == (5, 0)
+    
+    def test_expired_reservation_swept(self, client, test_db, auth_headers):
+        """Test the sweeper returns stock from abandoned reservations"""
+        sweet_id = self._sweet(test_db)
+        reservation = client.post(f"/api/sweets/{sweet_id}/reserve", json={"quantity": 4}, headers=auth_headers).json()
+        test_db.reservations.update_one(
+            {"_id": ObjectId(reservation["id"])},
+            {"$set": {"expires_at": datetime.utcnow() - timedelta(seconds=1)}}
+        )
+        
+        assert client.portal.call(reservations.sweep_expired) == 1
+        
+        sweet = test_db.sweets.find_one({"_id": ObjectId(sweet_id)})
+        assert (sweet["quantity"], sweet["reserved"]) == (5, 0)
+        response = client.post(f"/api/reservations/{reservation['id']}/commit", headers=auth_headers)
+        assert response.status_code == 409
+    
+    def test_commit_after_expiry(self, client, test_db, auth_headers):
+        """Test committing a lapsed reservation fails and frees the stock"""
+        sweet_id = self._sweet(test_db)
+        reservation = client.post(f"/api/sweets/{sweet_id}/reserve", json={"quantity": 4}, headers=auth_headers).json()
+        test_db.reservations.update_one(
+            {"_id": ObjectId(reservation["id"])},
+            {"$set": {"expires_at": datetime.utcnow() - timedelta(seconds=1)}}
+        )
+        
+        response = client.post(f"/api/reservations/{reservation['id']}/commit", headers=auth_headers)
+        
+        assert response.status_code == 410
+        assert test_db.sweets.find_one({"_id": ObjectId(sweet_id)})["quantity"] == 5
+    
+    def test_quantity_edit_refused_while_units_are_reserved(self, client, test_db, auth_headers, admin_headers):
+        """Test that setting quantity outright can't be undone by a later release"""
+        sweet_id = self._sweet(test_db)
+        reservation = client.post(f"/api/sweets/{sweet_id}/reserve", json={"quantity": 2}, headers=auth_headers).json()
+        update = {"name": "Ladoo", "category": "Traditional", "price": 12.0, "quantity": 10}
+        
+        response = client.put(f"/api/sweets/{sweet_id}", json=update, headers=admin_headers)
+        assert response.status_code == 409
+        
+        # Other fields can still change while the quantity stays as it is
+        response = client.put(f"/api/sweets/{sweet_id}", json={**update, "quantity": 3}, headers=admin_headers)
+        assert response.status_code == 200
+        assert response.json()["price"] == 12.0
+        
+        client.post(f"/api/reservations/{reservation['id']}/release", headers=auth_headers)
+        response = client.put(f"/api/sweets/{sweet_id}", json=update, headers=admin_headers)
+        assert response.status_code == 200
+        sweet = test_db.sweets.find_one({"_id": ObjectId(sweet_id)})
+        assert (sweet["quantity"], sweet["reserved"]) == (10, 0)
+    
+    def test_other_users_reservation_not_found(self, client, test_db, auth_headers, admin_headers):
+        """Test a reservation can only be closed by the user who made it"""
+        sweet_id = self._sweet(test_db)
+        reservation = client.post(f"/api/sweets/{sweet_id}/reserve", json={"quantity": 1}, headers=admin_headers).json()
+        
+        response = client.post(f"/api/reservations/{reservation['id']}/commit", headers=auth_headers)
+        
+        assert response.status_code == 404
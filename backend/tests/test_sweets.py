@@ -15,7 +15,7 @@ class TestSweetsManagement:
         response = client.get("/api/sweets")
         
         assert response.status_code == 200
-        assert response.json() == []
+        assert response.json() == {"items": [], "next_cursor": None}
     
     def test_get_all_sweets_with_data(self, client, test_db, sample_sweet_data):
         """Test getting all sweets when data exists"""
@@ -29,12 +29,236 @@ class TestSweetsManagement:
         response = client.get("/api/sweets")
         
         assert response.status_code == 200
-        data = response.json()
+        data = response.json()["items"]
         assert len(data) == 1
         assert data[0]["name"] == sample_sweet_data["name"]
         assert data[0]["price"] == sample_sweet_data["price"]
         assert "id" in data[0]
     
+    def test_get_all_sweets_legacy(self, client, test_db, sample_sweet_data):
+        """Test the unpaginated list shape is still available for old clients"""
+        test_db.sweets.insert_one(sample_sweet_data.copy())
+        
+        response = client.get("/api/sweets?legacy=true")
+        
+        assert response.status_code == 200
+        data = response.json()
+        assert isinstance(data, list)
+        assert data[0]["name"] == sample_sweet_data["name"]
+    
+    def test_get_sweets_cursor_pagination(self, client, test_db, sample_sweet_data):
+        """Test walking the catalog page by page with next_cursor"""
+        for i in range(5):
+            sweet = sample_sweet_data.copy()
+            sweet["name"] = f"Sweet {i}"
+            sweet["price"] = float(10 - i)
+            test_db.sweets.insert_one(sweet)
+        
+        seen = []
+        cursor = None
+        while True:
+            params = {"limit": 2, "sort": "price"}
+            if cursor:
+                params["cursor"] = cursor
+            data = client.get("/api/sweets", params=params).json()
+            seen.extend(sweet["price"] for sweet in data["items"])
+            cursor = data["next_cursor"]
+            if not cursor:
+                break
+        
+        assert seen == [6.0, 7.0, 8.0, 9.0, 10.0]
+    
+    def test_legacy_sweets_missing_fields_are_served(self, client, test_db):
+        """Test that sweets stored without category, price or quantity still render"""
+        legacy_id = str(test_db.sweets.insert_one({"name": "Old Peda"}).inserted_id)
+        test_db.sweets.insert_one({"name": "Kaju Katli", "category": "Traditional", "price": 30.0, "quantity": 4})
+        
+        for params in ({}, {"sort": "price"}, {"sort": "-quantity", "limit": 1}, {"legacy": True}):
+            response = client.get("/api/sweets", params=params)
+            assert response.status_code == 200
+        
+        response = client.get("/api/sweets", params={"sort": "price"})
+        legacy = response.json()["items"][0]
+        assert legacy["name"] == "Old Peda"
+        assert legacy["price"] is None and legacy["quantity"] is None and legacy["category"] is None
+        
+        response = client.get(f"/api/sweets/{legacy_id}")
+        assert response.status_code == 200
+        assert response.json()["price"] is None
+    
+    @pytest.mark.asyncio
+    async def test_cursor_pagination_over_missing_sort_field(self, test_db, sample_sweet_data):
+        """Test that legacy sweets without a price page like null prices, in both directions"""
+        from sweets import list_sweets
+        for i in range(4):
+            sweet = sample_sweet_data.copy()
+            sweet["name"] = f"Sweet {i}"
+            if i % 2:
+                del sweet["price"]
+            else:
+                sweet["price"] = float(i)
+            test_db.sweets.insert_one(sweet)
+        
+        for sort, expected in (("price", ["Sweet 1", "Sweet 3", "Sweet 0", "Sweet 2"]),
+                               ("-price", ["Sweet 2", "Sweet 0", "Sweet 3", "Sweet 1"])):
+            seen = []
+            cursor = None
+            while True:
+                page = await list_sweets(limit=1, cursor=cursor, sort=sort)
+                seen.extend(sweet["name"] for sweet in page["items"])
+                cursor = page["next_cursor"]
+                if not cursor:
+                    break
+            assert seen == expected
+    
+    def test_get_sweets_filters(self, client, test_db, sample_sweet_data):
+        """Test name prefix, category, price range and stock filters"""
+        rows = [
+            ("Gulab Jamun", "Traditional", 20.0, 10),
+            ("Gajar Halwa", "Traditional", 40.0, 0),
+            ("Chocolate Barfi", "Modern", 30.0, 5),
+        ]
+        for name, category, price, quantity in rows:
+            test_db.sweets.insert_one({"name": name, "category": category, "price": price, "quantity": quantity})
+        
+        names = lambda params: sorted(s["name"] for s in client.get("/api/sweets", params=params).json()["items"])
+        
+        assert names({"name": "Ga"}) == ["Gajar Halwa"]
+        assert names({"category": "Traditional", "in_stock": True}) == ["Gulab Jamun"]
+        assert names({"min_price": 25, "max_price": 45}) == ["Chocolate Barfi", "Gajar Halwa"]
+    
+    def test_get_sweets_invalid_sort_and_cursor(self, client, test_db):
+        """Test unknown sort keys and malformed cursors are rejected"""
+        assert client.get("/api/sweets?sort=created_at").status_code == 400
+        assert client.get("/api/sweets?cursor=not-a-cursor").status_code == 400
+    
+    def test_get_sweets_streaming(self, client, test_db, sample_sweet_data):
+        """Test the listing can be streamed as NDJSON or an incrementally written JSON array"""
+        import json
+        for i in range(3):
+            sweet = sample_sweet_data.copy()
+            sweet["name"] = f"Sweet {i}"
+            sweet["price"] = float(i)
+            test_db.sweets.insert_one(sweet)
+        
+        ndjson = client.get("/api/sweets?stream=ndjson&sort=-price")
+        assert ndjson.headers["content-type"].startswith("application/x-ndjson")
+        assert [json.loads(line)["name"] for line in ndjson.text.splitlines()] == ["Sweet 2", "Sweet 1", "Sweet 0"]
+        
+        array = client.get("/api/sweets?stream=json&in_stock=true")
+        data = array.json()
+        assert len(data) == 3
+        assert all("id" in sweet and "_id" not in sweet for sweet in data)
+    
+    def test_get_sweets_etag_revalidation(self, client, test_db, sample_sweet_data, admin_headers):
+        """Test If-None-Match gets a 304 until the catalog changes"""
+        first = client.get("/api/sweets")
+        etag = first.headers["ETag"]
+        
+        cached = client.get("/api/sweets", headers={"If-None-Match": etag})
+        assert cached.status_code == 304
+        assert cached.content == b""
+        
+        client.post("/api/sweets", json=sample_sweet_data, headers=admin_headers)
+        
+        changed = client.get("/api/sweets", headers={"If-None-Match": etag})
+        assert changed.status_code == 200
+        assert changed.headers["ETag"] != etag
+        assert len(changed.json()["items"]) == 1
+    
+    def test_get_sweets_etag_follows_content_after_reload(self, client, test_db, sample_sweet_data):
+        """Test that a reloaded listing changed behind this worker's back isn't answered with 304"""
+        import catalog_cache
+        etag = client.get("/api/sweets").headers["ETag"]
+        
+        # Another worker writes; this one only notices once its entry expires
+        test_db.sweets.insert_one(sample_sweet_data.copy())
+        catalog_cache._entries.clear()
+        
+        changed = client.get("/api/sweets", headers={"If-None-Match": etag})
+        assert changed.status_code == 200
+        assert len(changed.json()["items"]) == 1
+        
+        # An unchanged reload keeps the tag, on this worker or any other
+        catalog_cache._entries.clear()
+        again = client.get("/api/sweets", headers={"If-None-Match": changed.headers["ETag"]})
+        assert again.status_code == 304
+    
+    def test_search_sweets_typeahead(self, client, test_db, admin_headers):
+        """Test type-ahead search ranks name prefixes first and tracks writes"""
+        for name, category in [("Gulab Jamun", "Traditional"), ("Kala Jamun", "Traditional"), ("Gajar Halwa", "Winter")]:
+            client.post("/api/sweets", json={"name": name, "category": category, "price": 10.0, "quantity": 1}, headers=admin_headers)
+        
+        names = lambda q: [hit["name"] for hit in client.get("/api/sweets/search", params={"q": q}).json()]
+        
+        assert names("ga") == ["Gajar Halwa"]
+        assert names("jam") == ["Kala Jamun", "Gulab Jamun"]
+        assert names("amu") == ["Kala Jamun", "Gulab Jamun"]
+        assert names("winter") == ["Gajar Halwa"]
+        
+        gajar_id = client.get("/api/sweets/search", params={"q": "gajar"}).json()[0]["id"]
+        client.delete(f"/api/sweets/{gajar_id}", headers=admin_headers)
+        assert names("ga") == []
+    
+    @pytest.mark.asyncio
+    async def test_search_rebuild_rescans_after_invalidate(self):
+        """Test an invalidate() during a rebuild's scan keeps its stale rows out of the index"""
+        import search_index
+        scans = []
+        
+        async def fake_iter_sweets(projection):
+            scans.append(projection)
+            if len(scans) == 1:
+                yield {"_id": "a1", "name": "Kaju Katli", "category": "Festive"}
+                # A category rename lands while the first scan is still reading
+                search_index.invalidate()
+            else:
+                yield {"_id": "a1", "name": "Kaju Katli", "category": "Premium"}
+        
+        with patch("search_index.iter_sweets", fake_iter_sweets):
+            await search_index.rebuild()
+        
+        assert len(scans) == 2
+        assert await search_index.search("premium") == [{"id": "a1", "name": "Kaju Katli", "category": "Premium"}]
+        assert await search_index.search("festive") == []
+        search_index.invalidate()
+    
+    def test_low_stock_uses_reorder_thresholds(self, client, test_db, admin_headers):
+        """Test low-stock lists sweets at or below their own threshold, most urgent first"""
+        sweets = [("Ladoo", 3, 5), ("Barfi", 20, 5), ("Jalebi", 8, 12), ("Peda", 0, None)]
+        for name, quantity, threshold in sweets:
+            sweet = {"name": name, "category": "Traditional", "price": 10.0, "quantity": quantity}
+            if threshold is not None:
+                sweet["reorder_threshold"] = threshold
+            assert client.post("/api/sweets", json=sweet, headers=admin_headers).status_code == 200
+        
+        response = client.get("/api/sweets/low-stock?limit=2", headers=admin_headers)
+        
+        assert response.status_code == 200
+        page = response.json()
+        # Peda falls back to the default threshold
+        assert [s["name"] for s in page["items"]] == ["Peda", "Jalebi"]
+        assert page["items"][0]["reorder_threshold"] == 10
+        next_page = client.get(f"/api/sweets/low-stock?limit=2&cursor={page['next_cursor']}", headers=admin_headers).json()
+        assert [s["name"] for s in next_page["items"]] == ["Ladoo"]
+        assert next_page["next_cursor"] is None
+        
+        # Purchases keep the headroom in step with quantity
+        barfi = test_db.sweets.find_one({"name": "Barfi"})
+        client.post(f"/api/sweets/{barfi['_id']}/purchase", json={"quantity": 15}, headers=admin_headers)
+        names = [s["name"] for s in client.get("/api/sweets/low-stock", headers=admin_headers).json()["items"]]
+        assert "Barfi" in names
+        
+        # An explicit threshold compares quantity directly
+        response = client.get("/api/sweets/low-stock?threshold=3", headers=admin_headers)
+        assert [s["name"] for s in response.json()["items"]] == ["Peda", "Ladoo"]
+    
+    def test_low_stock_requires_admin(self, client, test_db, auth_headers):
+        """Test regular users cannot list low stock"""
+        response = client.get("/api/sweets/low-stock", headers=auth_headers)
+        
+        assert response.status_code == 403
+    
     def test_create_sweet_success(self, client, test_db, sample_sweet_data, admin_headers):
         """Test successful sweet creation by admin"""
         response = client.post("/api/sweets", json=sample_sweet_data, headers=admin_headers)
@@ -121,6 +345,42 @@ class TestSweetsManagement:
         assert response.status_code == 404
         assert "Sweet not found" in response.json()["detail"]
     
+    def test_update_sweet_if_match(self, client, test_db, sample_sweet_data, admin_headers):
+        """Test that If-Match updates only the version the client read"""
+        sweet_id = str(test_db.sweets.insert_one(sample_sweet_data.copy()).inserted_id)
+        
+        read = client.get(f"/api/sweets/{sweet_id}")
+        assert read.status_code == 200
+        etag = read.headers["etag"]
+        assert client.get(f"/api/sweets/{sweet_id}", headers={"If-None-Match": etag}).status_code == 304
+        
+        update = {**sample_sweet_data, "price": 30.0}
+        response = client.put(f"/api/sweets/{sweet_id}", json=update, headers={**admin_headers, "If-Match": etag})
+        
+        assert response.status_code == 200
+        assert response.json()["price"] == 30.0
+        assert response.json()["version"] == read.json()["version"] + 1
+        assert response.headers["etag"] != etag
+        
+        # A second editor still holding the old ETag must not overwrite the first
+        stale = {**sample_sweet_data, "price": 99.0}
+        response = client.put(f"/api/sweets/{sweet_id}", json=stale, headers={**admin_headers, "If-Match": etag})
+        
+        assert response.status_code == 412
+        assert test_db.sweets.find_one({"_id": ObjectId(sweet_id)})["price"] == 30.0
+    
+    def test_purchase_changes_sweet_version(self, client, test_db, sample_sweet_data, auth_headers, admin_headers):
+        """Test that stock changes invalidate an ETag held by an editor"""
+        sweet_id = str(test_db.sweets.insert_one(sample_sweet_data.copy()).inserted_id)
+        etag = client.get(f"/api/sweets/{sweet_id}").headers["etag"]
+        
+        client.post(f"/api/sweets/{sweet_id}/purchase", json={"quantity": 1}, headers=auth_headers)
+        response = client.put(f"/api/sweets/{sweet_id}", json=sample_sweet_data,
+                              headers={**admin_headers, "If-Match": etag})
+        
+        assert response.status_code == 412
+        assert test_db.sweets.find_one({"_id": ObjectId(sweet_id)})["quantity"] == sample_sweet_data["quantity"] - 1
+    
     def test_delete_sweet_success(self, client, test_db, sample_sweet_data, admin_headers):
         """Test successful sweet deletion by admin"""
         # Create a sweet first
@@ -193,6 +453,20 @@ class TestSweetsManagement:
         assert response.status_code == 400
         assert "Insufficient quantity" in response.json()["detail"]
     
+    def test_purchase_sweet_never_oversells(self, client, test_db, sample_sweet_data, auth_headers):
+        """Test the conditional decrement rejects purchases beyond remaining stock"""
+        sweet_data = sample_sweet_data.copy()
+        sweet_data["quantity"] = 3
+        sweet_id = str(test_db.sweets.insert_one(sweet_data).inserted_id)
+        
+        first = client.post(f"/api/sweets/{sweet_id}/purchase", json={"quantity": 2}, headers=auth_headers)
+        second = client.post(f"/api/sweets/{sweet_id}/purchase", json={"quantity": 2}, headers=auth_headers)
+        
+        assert first.status_code == 200
+        assert second.status_code == 400
+        assert "Not enough stock" in second.json()["detail"]
+        assert test_db.sweets.find_one({"_id": ObjectId(sweet_id)})["quantity"] == 1
+    
     def test_purchase_sweet_not_found(self, client, test_db, auth_headers):
         """Test purchasing non-existent sweet"""
         fake_id = "507f1f77bcf86cd799439011"  # Valid ObjectId format
@@ -20,7 +20,7 @@ export const SweetProvider = ({ children }) => {
   const fetchSweets = async () => {
     setLoading(true);
     try {
-      const response = await axios.get(`${config.API_BASE_URL}/sweets`);
+      const response = await axios.get(`${config.API_BASE_URL}/sweets`, { params: { legacy: true } });
       setSweets(response.data);
     } catch (err) {
       console.error('Error fetching sweets:', err);
@@ -0,0 +1,34 @@
+#!/bin/bash
+
+# Sweet Shop - Multi-worker Backend Launch
+#
+# Runs the API without --reload across several worker processes, as for
+# production or load testing. Each worker opens and warms its own MongoDB
+# pool during startup and only then reports ready on /ready, so size the pool
+# per worker: total connections = WEB_CONCURRENCY x MONGO_MAX_POOL_SIZE.
+#
+# Usage: ./serve.sh [workers]   (default: WEB_CONCURRENCY or the CPU count)
+#
+# Per-worker state to keep in mind:
+#   - rate limits: set RATE_LIMIT_BACKEND=mongo to share one budget
+#   - /metrics: each scrape hits one worker
+#   - bcrypt pool: PASSWORD_POOL_WORKERS defaults to CPUs / workers here
+
+set -e
+
+CPUS=$(python3 -c "import os; print(os.cpu_count() or 1)")
+WORKERS=${1:-${WEB_CONCURRENCY:-$CPUS}}
+export PASSWORD_POOL_WORKERS=${PASSWORD_POOL_WORKERS:-$(( CPUS / WORKERS > 0 ? CPUS / WORKERS : 1 ))}
+
+cd "$(dirname "$0")/backend"
+if [ -d "venv" ]; then
+    source venv/bin/activate
+fi
+
+echo "🍭 Starting Sweet Shop API with $WORKERS workers on ${HOST:-0.0.0.0}:${PORT:-8000}"
+exec uvicorn main:app \
+    --host "${HOST:-0.0.0.0}" \
+    --port "${PORT:-8000}" \
+    --workers "$WORKERS" \
+    --timeout-graceful-shutdown 30 \
+    --no-access-log